@@ -29,7 +29,10 @@ export default function commandReducer(state = initialState, action = {}) {
     case EXECUTE_FAILED:
       return state.set('output', iList());
     case OUTPUT_RECEIVED:
-      return state.set('output', state.get('output').push(action.output));
+      // output is a line, or an array of lines when the job server coalesces output
+      return state.set('output', Array.isArray(action.output)
+        ? state.get('output').concat(action.output)
+        : state.get('output').push(action.output));
     case OUTPUT_FINISHED:
       return state;
     default:
@@ -79,6 +82,10 @@ const commandQuery = gql`
   subscription commandExecute($command: String!) {
     commandExecute(command: $command) {
       stdout
+      lines {
+        stdout
+        timestamp
+      }
       finished
       timestamp
     }
@@ -100,6 +107,9 @@ export const commandLogic = createLogic({
         if (resp.stdout) {
           dispatch(outputReceived(resp.stdout));
         }
+        if (resp.lines) {
+          dispatch(outputReceived(resp.lines.map(line => line.stdout)));
+        }
         if (resp.finished) {
           sub.unsubscribe();
           subscriptions['command'] = null;
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""Compare in-process and subprocess runners of the job server commands
+
+Runs `countdown` jobs through JobServer.run_command with replies captured
+in memory instead of sent over ZeroMQ, and reports jobs/sec and the
+latency from the start of a job to its first line of output.
+
+Usage: python benchmarks/bench_commands.py [-j JOBS] [-c CONCURRENCY]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado_graphql_example.jobserver import JobOutput, JobServer  # noqa
+from tornado import gen, ioloop  # noqa
+
+
+class ReplyRecorder(object):
+    """Stands in for the ZMQStream of the job server and records the first reply of each job"""
+
+    def __init__(self):
+        self.first_reply = {}
+
+    def send_multipart(self, msg):
+        self.first_reply.setdefault(msg[1], time.time())
+
+
+@gen.coroutine
+def run_jobs(server, args):
+    recorder = server.zmq_stream = ReplyRecorder()
+    request = {'command': 'countdown', 'interval': 0, 'count': args.count}
+    latencies = []
+    pending = list(range(args.jobs))
+
+    @gen.coroutine
+    def worker():
+        while pending:
+            request_id = str(pending.pop()).encode('ascii')
+            started = time.time()
+            output = JobOutput(server, b'bench', request_id)
+            yield server.run_command(output, 'countdown', request)
+            latencies.append(recorder.first_reply[request_id] - started)
+
+    started = time.time()
+    yield [worker() for _ in range(args.concurrency)]
+    elapsed = time.time() - started
+    latencies.sort()
+    raise gen.Return((args.jobs / elapsed, latencies[len(latencies) // 2],
+                      latencies[int(len(latencies) * 0.99)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-j', '--jobs', type=int, default=500)
+    parser.add_argument('-c', '--concurrency', type=int, default=8)
+    parser.add_argument('--count', type=int, default=5, help='countdown from this number')
+    args = parser.parse_args()
+
+    # the external countdown script is run from the current directory
+    os.chdir(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print('countdown {0} jobs (count={1}, concurrency={2})'.format(
+        args.jobs, args.count, args.concurrency))
+    print('{0:<12} {1:>10} {2:>14} {3:>14}'.format(
+        'runner', 'jobs/s', 'p50 start ms', 'p99 start ms'))
+    for name, native in [('native', True), ('subprocess', False)]:
+        server = JobServer(native_commands=native)
+        server.log.setLevel(logging.WARNING)
+        rate, p50, p99 = ioloop.IOLoop.current().run_sync(lambda: run_jobs(server, args))
+        print('{0:<12} {1:>10.1f} {2:>14.3f} {3:>14.3f}'.format(
+            name, rate, p50 * 1000, p99 * 1000))
+
+
+if __name__ == '__main__':
+    main()
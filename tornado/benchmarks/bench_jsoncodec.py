@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""Compare the JSON codec backends on the payloads of the hot paths
+
+Usage: python benchmarks/bench_jsoncodec.py [-n NUMBER]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from collections import OrderedDict
+from datetime import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado_graphql_example.jsoncodec import available_backends  # noqa
+
+
+def todo_list_response(num):
+    todos = [OrderedDict([('id', str(i)), ('text', 'Todo item number {0}'.format(i)),
+                          ('completed', i % 3 == 0)])
+             for i in range(1, num + 1)]
+    return {'data': OrderedDict([('todoList', OrderedDict([('todos', todos)]))])}
+
+
+def payloads():
+    return OrderedDict([
+        ('graphql request', {
+            'query': 'mutation toggleTodo($id: String!) '
+                     '{ toggleTodo(id: $id) { completed __typename } }',
+            'variables': {'id': '2'},
+            'operationName': 'toggleTodo'
+        }),
+        ('todoList (10 todos)', todo_list_response(10)),
+        ('todoList (1000 todos)', todo_list_response(1000)),
+        ('job output', {
+            'stdout': '42',
+            'finished': False,
+            'timestamp': datetime.now().timestamp()
+        }),
+        ('subscription_data', {
+            'type': 'subscription_data',
+            'id': 3,
+            'payload': {'data': {'stdout': '42', 'finished': False,
+                                 'timestamp': datetime.now().timestamp()}}
+        })
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=10000,
+                        help='iterations per measurement')
+    args = parser.parse_args()
+
+    backends = available_backends()
+    print('backends: {0}'.format(', '.join(backends)))
+    print('{0:<24} {1:<10} {2:>12} {3:>12}'.format('payload', 'backend', 'dumps us', 'loads us'))
+    for name, payload in payloads().items():
+        for backend, (dumps, loads) in backends.items():
+            encoded = dumps(payload)
+            number = max(1, args.number // max(1, len(encoded) // 1000))
+            dumps_time = timeit.timeit(lambda: dumps(payload), number=number)
+            loads_time = timeit.timeit(lambda: loads(encoded), number=number)
+            print('{0:<24} {1:<10} {2:>12.2f} {3:>12.2f}'.format(
+                name, backend, dumps_time / number * 1e6, loads_time / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
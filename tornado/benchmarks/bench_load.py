@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+"""Load-test the web app and job servers on localhost
+
+Starts the web app and `-j` job servers as subprocesses with a runtime
+directory of their own, and drives them with `-c` concurrent clients:
+
+* query:    `todoList` queries over HTTP
+* mutation: `addTodo` mutations over HTTP
+* fanout:   `addTodo` events delivered to `-s` WebSocket subscribers
+* command:  `commandExecute` subscriptions, from the subscription to the
+            first line of output of the job (start-to-first-byte)
+
+Writes the throughput and latency percentiles of each as JSON (`-o`).
+With `--baseline`, compares them with an earlier run and exits with
+status 1 if any of them regressed by more than `--tolerance`. The client
+runs in a single process, so compare runs made on the same machine.
+
+Usage: python benchmarks/bench_load.py [-c CONCURRENCY] [-j JOB_SERVERS] [-o FILE]
+                                       [--baseline FILE] [--tolerance 0.2]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from datetime import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado import gen, httpclient, ioloop, websocket  # noqa
+from tornado.concurrent import Future  # noqa
+
+PACKAGE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+QUERY = 'query todoList { todoList { todos { id text completed } } }'
+
+MUTATION = 'mutation addTodo($text: String!) { addTodo(text: $text) { todo { id } } }'
+
+NEW_TODOS = 'subscription newTodos { newTodos { id text completed } }'
+
+COMMAND_EXECUTE = 'subscription commandExecute { commandExecute { stdout finished } }'
+
+# metrics compared with the baseline, and whether higher values are better
+GATED_METRICS = {
+    'requests_per_second': True,
+    'events_per_second': True,
+    'jobs_per_second': True,
+    'p50_ms': False,
+    'p90_ms': False,
+    'p99_ms': False
+}
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(int(round(p / 100 * len(sorted_values) + 0.5)) - 1, len(sorted_values) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def summarize(latencies, errors, elapsed, rate_name='requests_per_second'):
+    latencies = sorted(latencies)
+    result = {
+        'count': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        rate_name: round(len(latencies) / elapsed, 1) if elapsed else None
+    }
+    for p in (50, 90, 99):
+        value = percentile(latencies, p)
+        result['p{0}_ms'.format(p)] = None if value is None else round(value * 1000, 3)
+    result['max_ms'] = round(latencies[-1] * 1000, 3) if latencies else None
+    return result
+
+
+class Servers(object):
+    """The web app and job servers under test"""
+
+    def __init__(self, args):
+        self.args = args
+        self.port = args.port or free_port()
+        self.url = 'http://127.0.0.1:{0}'.format(self.port)
+        self.ws_url = 'ws://127.0.0.1:{0}/'.format(self.port)
+        self.runtime_dir = tempfile.mkdtemp(prefix='bench-load-')
+        self.procs = []
+
+    def spawn(self, module, argv):
+        env = dict(os.environ, XDG_RUNTIME_DIR=self.runtime_dir)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [PACKAGE_DIR,
+                                                          env.get('PYTHONPATH')]))
+        code = 'from {0} import main; main()'.format(module)
+        proc = subprocess.Popen([sys.executable, '-c', code] + argv,
+                                cwd=PACKAGE_DIR, env=env)
+        self.procs.append(proc)
+        return proc
+
+    def start(self):
+        self.spawn('tornado_graphql_example.jobserverapp', [
+            '--num={0}'.format(self.args.job_servers),
+            '--ip=127.0.0.1',
+            '--capacity={0}'.format(self.args.job_capacity),
+            '--shutdown-timeout=1',
+            '--log-level=ERROR'
+        ])
+        self.spawn('tornado_graphql_example.app', [
+            '--port={0}'.format(self.port),
+            '--ip=127.0.0.1',
+            '--shutdown-timeout=1',
+            '--log-level=ERROR'
+        ] + self.args.app_args)
+
+    @gen.coroutine
+    def wait_ready(self, timeout=60):
+        """Wait until the web app serves and sees all the job servers"""
+        client = httpclient.AsyncHTTPClient()
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                resp = yield client.fetch(self.url + '/admin/health')
+                health = json.loads(resp.body.decode('utf-8'))
+                if len(health) >= self.args.job_servers and \
+                        all(s['state'] == 'closed' and s['rtt_ms'] is not None
+                            for s in health.values()):
+                    return
+            except (IOError, httpclient.HTTPError):
+                pass
+            if any(proc.poll() is not None for proc in self.procs):
+                raise RuntimeError('a server exited during startup')
+            yield gen.sleep(0.2)
+        raise RuntimeError('the servers did not start in {0}s'.format(timeout))
+
+    def stop(self):
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        for proc in self.procs:
+            try:
+                proc.wait(15)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+
+
+@gen.coroutine
+def drive(fn, concurrency, number):
+    """Call the coroutine ``fn`` ``number`` times from ``concurrency`` workers
+
+    Returns the latencies of the calls, the number of failed calls and
+    the elapsed seconds.
+    """
+    latencies = []
+    errors = [0]
+    calls = itertools.count()
+
+    @gen.coroutine
+    def worker():
+        while next(calls) < number:
+            started = time.perf_counter()
+            try:
+                yield fn()
+            except Exception:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    yield [worker() for _ in range(concurrency)]
+    raise gen.Return((latencies, errors[0], time.perf_counter() - started))
+
+
+def graphql_request(servers, query, variables=None):
+    return httpclient.HTTPRequest(
+        servers.url + '/graphql', method='POST',
+        headers={'Content-Type': 'application/json'},
+        body=json.dumps({'query': query, 'variables': variables or {}}))
+
+
+@gen.coroutine
+def connect(servers):
+    request = httpclient.HTTPRequest(
+        servers.ws_url, headers={'Sec-WebSocket-Protocol': 'graphql-subscriptions'})
+    ws = yield websocket.websocket_connect(request)
+    raise gen.Return(ws)
+
+
+@gen.coroutine
+def read_json(ws):
+    message = yield ws.read_message()
+    if message is None:
+        raise IOError('the WebSocket was closed')
+    raise gen.Return(json.loads(message))
+
+
+@gen.coroutine
+def subscribe(ws, subid, query):
+    ws.write_message(json.dumps({'type': 'subscription_start', 'id': subid, 'query': query}))
+    while True:
+        message = yield read_json(ws)
+        if message.get('type') == 'subscription_success':
+            return
+        if message.get('type') == 'subscription_fail':
+            raise IOError('subscription failed: {0}'.format(message))
+
+
+@gen.coroutine
+def bench_query(servers, args):
+    client = httpclient.AsyncHTTPClient()
+    latencies, errors, elapsed = yield drive(
+        lambda: client.fetch(graphql_request(servers, QUERY)), args.concurrency, args.requests)
+    raise gen.Return(summarize(latencies, errors, elapsed))
+
+
+@gen.coroutine
+def bench_mutation(servers, args):
+    client = httpclient.AsyncHTTPClient()
+    latencies, errors, elapsed = yield drive(
+        lambda: client.fetch(graphql_request(servers, MUTATION, {'text': 'bench'})),
+        args.concurrency, args.requests)
+    raise gen.Return(summarize(latencies, errors, elapsed))
+
+
+@gen.coroutine
+def bench_fanout(servers, args):
+    """Publish ``events`` todos to ``subscribers`` sockets
+
+    The latency of an event is from sending its mutation to receiving it
+    on a socket; the text of the todo carries the time it was sent at.
+    """
+    sockets = yield [connect(servers) for _ in range(args.subscribers)]
+    yield [subscribe(ws, 1, NEW_TODOS) for ws in sockets]
+    expected = args.events * len(sockets)
+    latencies = []
+    done = Future()
+
+    @gen.coroutine
+    def receive(ws):
+        while len(latencies) < expected:
+            message = yield ws.read_message()
+            if message is None:
+                break
+            data = json.loads(message).get('payload', {}).get('data', {})
+            if data.get('text', '').startswith('fanout '):
+                latencies.append(time.perf_counter() - float(data['text'].split()[1]))
+        if len(latencies) >= expected and not done.done():
+            done.set_result(None)
+
+    for ws in sockets:
+        receive(ws)
+
+    client = httpclient.AsyncHTTPClient()
+    started = time.perf_counter()
+    _, errors, _ = yield drive(
+        lambda: client.fetch(graphql_request(
+            servers, MUTATION, {'text': 'fanout {0!r}'.format(time.perf_counter())})),
+        args.concurrency, args.events)
+    try:
+        yield gen.with_timeout(ioloop.IOLoop.current().time() + 30, done)
+    except gen.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    for ws in sockets:
+        ws.close()
+
+    result = summarize(latencies, errors, elapsed, 'events_per_second')
+    result['subscribers'] = len(sockets)
+    result['lost'] = expected - len(latencies)
+    raise gen.Return(result)
+
+
+@gen.coroutine
+def bench_command(servers, args):
+    """Subscribe to ``commandExecute`` and wait for the first line of the job"""
+
+    @gen.coroutine
+    def first_byte():
+        ws = yield connect(servers)
+        try:
+            ws.write_message(json.dumps({'type': 'subscription_start', 'id': 1,
+                                         'query': COMMAND_EXECUTE}))
+            while True:
+                message = yield read_json(ws)
+                if message.get('type') == 'subscription_fail':
+                    raise IOError('subscription failed: {0}'.format(message))
+                data = message.get('payload', {}).get('data', {})
+                if data.get('error'):
+                    raise IOError(data['error'])
+                if data.get('stdout') is not None or data.get('lines'):
+                    return
+        finally:
+            ws.close()
+
+    latencies, errors, elapsed = yield drive(first_byte, args.concurrency, args.jobs)
+    raise gen.Return(summarize(latencies, errors, elapsed, 'jobs_per_second'))
+
+
+BENCHMARKS = [
+    ('query', bench_query),
+    ('mutation', bench_mutation),
+    ('fanout', bench_fanout),
+    ('command', bench_command)
+]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=PACKAGE_DIR,
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print the changes from the baseline and return the regressions"""
+    regressions = []
+    for name, result in sorted(results['results'].items()):
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        if result['errors'] and not base.get('errors'):
+            regressions.append('{0}: {1} errors'.format(name, result['errors']))
+        for key, higher_is_better in sorted(GATED_METRICS.items()):
+            value, base_value = result.get(key), base.get(key)
+            if not value or not base_value:
+                continue
+            # the relative change for the worse
+            change = base_value / value - 1 if higher_is_better else value / base_value - 1
+            flag = ''
+            if change > tolerance:
+                flag = '  REGRESSION'
+                regressions.append('{0} {1}: {2} -> {3}'.format(name, key, base_value, value))
+            print('{0:<10} {1:<20} {2:>12} -> {3:>12} {4:>+8.1%}{5}'.format(
+                name, key, base_value, value, change, flag))
+    return regressions
+
+
+@gen.coroutine
+def run(servers, args):
+    yield servers.wait_ready()
+    results = {}
+    for name, bench in BENCHMARKS:
+        if name not in args.only:
+            continue
+        results[name] = yield bench(servers, args)
+        print('{0:<10} {1}'.format(name, json.dumps(results[name], sort_keys=True)))
+    raise gen.Return(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-c', '--concurrency', type=int, default=20)
+    parser.add_argument('-j', '--job-servers', type=int, default=2)
+    parser.add_argument('-n', '--requests', type=int, default=2000,
+                        help='queries and mutations to send')
+    parser.add_argument('-s', '--subscribers', type=int, default=50)
+    parser.add_argument('-e', '--events', type=int, default=200,
+                        help='todos to publish to the subscribers')
+    parser.add_argument('--jobs', type=int, default=200, help='commands to execute')
+    parser.add_argument('--job-capacity', type=int, default=1000,
+                        help='jobs each job server runs at once, high so that jobs do not queue')
+    parser.add_argument('--only', default=','.join(name for name, _ in BENCHMARKS),
+                        help='comma-separated benchmarks to run')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--app-args', default='',
+                        help='extra options of the web app, e.g. "--executor-threads=4"')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with the results in this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='the relative change for the worse counted as a regression')
+    args = parser.parse_args()
+    args.only = args.only.split(',')
+    args.app_args = args.app_args.split()
+
+    httpclient.AsyncHTTPClient.configure(None, max_clients=args.concurrency)
+    servers = Servers(args)
+    servers.start()
+    try:
+        results = ioloop.IOLoop.current().run_sync(lambda: run(servers, args))
+    finally:
+        servers.stop()
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {k: v for k, v in vars(args).items()
+                 if k not in ('output', 'baseline', 'tolerance')},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print('regressions beyond {0:.0%}:'.format(args.tolerance))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+"""Measure fan-out throughput of the pub/sub bus across processes
+
+One process publishes events on a PubSubBus and `-p` processes each run a
+PubSubBus with a local subscriber to the topic, as web app processes with
+WebSocket subscribers would. Reports the events delivered per second
+over all processes and the share of events each process received.
+
+Usage: python benchmarks/bench_pubsub_bus.py [-n EVENTS] [-p PROCESSES]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from multiprocessing import Event, Process, Queue
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from zmq.eventloop import ioloop  # noqa
+
+ioloop.install()
+
+from tornado import gen  # noqa
+import zmq  # noqa
+from tornado_graphql_example.pubsub import PubSub  # noqa
+from tornado_graphql_example.pubsub_bus import PubSubBus  # noqa
+
+
+class CountingSubscriber(object):
+
+    def __init__(self, ready, results):
+        self.ready = ready
+        self.results = results
+        self.received = 0
+        self.first = None
+        self.last = None
+
+    def send_data(self, subid, data, encoded_data=None):
+        if subid == 'warmup':
+            self.ready.set()
+        elif data.get('done'):
+            self.results.put((os.getpid(), self.received, self.first, self.last))
+            ioloop.IOLoop.current().stop()
+        else:
+            self.last = time.time()
+            if self.first is None:
+                self.first = self.last
+            self.received += 1
+
+
+def subscriber_main(appdir, hwm, ready, results):
+    zmq.Context.instance().rcvhwm = hwm
+    pubsub = PubSub()
+    subscriber = CountingSubscriber(ready, results)
+    pubsub.subscribe('warmup', subscriber, 'warmup')
+    pubsub.subscribe('bench', subscriber, 'bench')
+    bus = PubSubBus(pubsub, appdir=appdir, poll_interval=0.1)
+    bus.start()
+    try:
+        ioloop.IOLoop.current().start()
+    finally:
+        bus.stop()
+
+
+@gen.coroutine
+def publish(pubsub, args, readies):
+    while not all(ready.is_set() for ready in readies):
+        pubsub.publish('warmup', {})
+        yield gen.sleep(0.05)
+    yield gen.sleep(0.2)
+
+    payload = {'id': '1', 'text': 'x' * args.size, 'completed': False}
+    started = time.time()
+    for i in range(args.events):
+        pubsub.publish('bench', payload)
+        if i % 1000 == 0:
+            yield gen.moment
+    yield gen.moment
+    elapsed = time.time() - started
+    # let the subscribers drain before the end marker
+    yield gen.sleep(0.5)
+    pubsub.publish('bench', {'done': True})
+    yield gen.moment
+    raise gen.Return(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--events', type=int, default=100000)
+    parser.add_argument('-p', '--processes', type=int, default=4)
+    parser.add_argument('--size', type=int, default=100, help='bytes of text per event')
+    parser.add_argument('--hwm', type=int, default=100000,
+                        help='ZeroMQ high-water mark; events beyond it are dropped')
+    args = parser.parse_args()
+
+    appdir = tempfile.mkdtemp(prefix='bench-pubsub-bus-')
+    results = Queue()
+    readies = [Event() for _ in range(args.processes)]
+    # fork the subscribers before this process creates a ZeroMQ context
+    procs = [Process(target=subscriber_main, args=(appdir, args.hwm, ready, results))
+             for ready in readies]
+    for proc in procs:
+        proc.start()
+
+    try:
+        zmq.Context.instance().sndhwm = args.hwm
+        pubsub = PubSub()
+        bus = PubSubBus(pubsub, appdir=appdir, poll_interval=0.1)
+        bus.start()
+        elapsed = ioloop.IOLoop.current().run_sync(lambda: publish(pubsub, args, readies))
+        stats = [results.get(timeout=60) for _ in procs]
+        bus.stop()
+    finally:
+        for proc in procs:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        shutil.rmtree(appdir, ignore_errors=True)
+
+    first = min(s[2] for s in stats if s[2] is not None)
+    last = max(s[3] for s in stats if s[3] is not None)
+    delivered = sum(s[1] for s in stats)
+    print('{0} events of {1} bytes to {2} processes'.format(
+        args.events, args.size, args.processes))
+    print('publish:   {0:>12.0f} events/s'.format(args.events / elapsed))
+    print('delivered: {0:>12.0f} events/s ({1} events in {2:.3f}s)'.format(
+        delivered / (last - first), delivered, last - first))
+    for pid, received, _, _ in sorted(stats):
+        print('  pid {0}: {1:.1%} received'.format(pid, received / args.events))
+
+
+if __name__ == '__main__':
+    main()
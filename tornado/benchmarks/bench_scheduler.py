@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+"""Simulate job-start latency of the job server scheduling policies
+
+Jobs arrive as a Poisson process and are dispatched to job servers which
+run up to `capacity` jobs at once and queue the rest. One server is slower
+than the others. The scheduler sees the outstanding jobs of each server,
+optionally as reported `--staleness` seconds ago.
+
+Usage: python benchmarks/bench_scheduler.py [-j JOBS] [--load LOAD]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+from collections import deque
+import heapq
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado_graphql_example.scheduler import SCHEDULERS  # noqa
+
+
+class SimServer(object):
+
+    def __init__(self, pid, capacity, speed):
+        self.pid = pid
+        self.capacity = capacity
+        self.speed = speed
+        self.running = 0
+        self.queue = deque()
+        self.reported = 0
+
+
+def simulate(policy, args):
+    rand = random.Random(args.seed)
+    servers = [SimServer(i, args.capacity, args.slow_speed if i == 0 else 1.0)
+               for i in range(args.servers)]
+    infos = [{'pid': s.pid, 'capacity': s.capacity * s.speed} for s in servers]
+    scheduler = SCHEDULERS[policy]()
+    if hasattr(scheduler, 'random'):
+        scheduler.random = random.Random(args.seed)
+
+    total_capacity = sum(s.capacity * s.speed for s in servers) / args.job_time
+    rate = total_capacity * args.load
+    events = []
+    now = 0.0
+    for i in range(args.jobs):
+        now += rand.expovariate(rate)
+        heapq.heappush(events, (now, 0, 'arrive', i))
+    for s in servers:
+        heapq.heappush(events, (0.0, 1, 'report', s.pid))
+
+    latencies = []
+
+    def start(server, arrived, t):
+        server.running += 1
+        latencies.append(t - arrived)
+        duration = rand.expovariate(1.0 / args.job_time) / server.speed
+        heapq.heappush(events, (t + duration, 0, 'finish', server.pid))
+
+    while events:
+        t, _, kind, value = heapq.heappop(events)
+        if kind == 'arrive':
+            load = (lambda info: servers[info['pid']].reported) if args.staleness else \
+                (lambda info: servers[info['pid']].running + len(servers[info['pid']].queue))
+            info = scheduler.select(infos, load, lambda info: info['capacity'])
+            server = servers[info['pid']]
+            if server.running < server.capacity:
+                start(server, t, t)
+            else:
+                server.queue.append(t)
+        elif kind == 'finish':
+            server = servers[value]
+            server.running -= 1
+            if server.queue:
+                start(server, server.queue.popleft(), t)
+        elif kind == 'report' and args.staleness and len(latencies) < args.jobs:
+            server = servers[value]
+            server.reported = server.running + len(server.queue)
+            heapq.heappush(events, (t + args.staleness, 1, 'report', value))
+
+    latencies.sort()
+    return [latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+            for p in (0.5, 0.9, 0.99, 0.999)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-j', '--jobs', type=int, default=100000)
+    parser.add_argument('-s', '--servers', type=int, default=4)
+    parser.add_argument('-c', '--capacity', type=int, default=2)
+    parser.add_argument('--job-time', type=float, default=1.0, help='mean job time in seconds')
+    parser.add_argument('--slow-speed', type=float, default=0.3,
+                        help='relative speed of the slow server')
+    parser.add_argument('--load', type=float, default=0.8, help='offered load (0-1)')
+    parser.add_argument('--staleness', type=float, default=0.0,
+                        help='interval in seconds of load reports (0 for exact load)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print('job-start latency in seconds (servers={0} capacity={1} load={2})'.format(
+        args.servers, args.capacity, args.load))
+    print('{0:<20} {1:>9} {2:>9} {3:>9} {4:>9}'.format('policy', 'p50', 'p90', 'p99', 'p99.9'))
+    for policy in ['round-robin', 'least-outstanding', 'power-of-two', 'weighted']:
+        print('{0:<20} {1:>9.3f} {2:>9.3f} {3:>9.3f} {4:>9.3f}'.format(
+            policy, *simulate(policy, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""Measure DurableTodoStore mutations/sec for each fsync policy
+
+Usage: python benchmarks/bench_todo_log.py [-n MUTATIONS] [-t THREADS]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado_graphql_example.todo_log import FSYNC_POLICIES, DurableTodoStore  # noqa
+
+
+def mutate(store, count):
+    for i in range(count):
+        if i % 2 == 0:
+            store.add('benchmark todo {0}'.format(i))
+        else:
+            store.toggle(str(len(store)))
+
+
+def run(policy, mutations, threads, data_dir):
+    store = DurableTodoStore(data_dir, fsync=policy)
+    store.add('seed')
+    workers = [threading.Thread(target=mutate, args=(store, mutations // threads))
+               for _ in range(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - start
+    store.close()
+    return store.log.entries - 1, elapsed, store.log.fsyncs
+
+
+def recover(data_dir):
+    start = time.time()
+    store = DurableTodoStore(data_dir, fsync='never')
+    elapsed = time.time() - start
+    store.close()
+    return len(store), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--mutations', type=int, default=20000)
+    parser.add_argument('-t', '--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    print('{0:<10} {1:>10} {2:>14} {3:>10}'.format('fsync', 'mutations', 'mutations/s', 'fsyncs'))
+    for policy in FSYNC_POLICIES:
+        data_dir = tempfile.mkdtemp(prefix='bench-todo-log-')
+        try:
+            entries, elapsed, fsyncs = run(policy, args.mutations, args.threads, data_dir)
+            print('{0:<10} {1:>10} {2:>14.0f} {3:>10}'.format(
+                policy, entries, entries / elapsed, fsyncs))
+        finally:
+            shutil.rmtree(data_dir)
+
+    data_dir = tempfile.mkdtemp(prefix='bench-todo-log-')
+    try:
+        store = DurableTodoStore(data_dir, fsync='never', snapshot_interval=args.mutations)
+        mutate(store, args.mutations * 2)
+        store.close()
+        todos, elapsed = recover(data_dir)
+        print('recovery: {0} todos from snapshot and log tail in {1:.3f}s'.format(todos, elapsed))
+    finally:
+        shutil.rmtree(data_dir)
+
+
+if __name__ == '__main__':
+    main()
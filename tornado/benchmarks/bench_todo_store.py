@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Measure TodoStore adds, toggles and pages at a number of todos
+
+Adds `-n` todos, toggles `-t` random todos and reads pages of `-f` todos
+with each filter, and reports the time per operation.
+
+Usage: python benchmarks/bench_todo_store.py [-n TODOS] [-t TOGGLES] [-f FIRST]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from tornado_graphql_example.todo_store import TodoStore  # noqa
+
+PAGES = [
+    ('page', {}),
+    ('page after the middle', {'after': 'MIDDLE'}),
+    ('page of completed', {'completed': True}),
+    ('last page of active', {'completed': False, 'last': True}),
+    ('page of short prefix', {'text_prefix': 'Todo'}),
+    ('page of long prefix', {'text_prefix': 'Todo item number 9'}),
+    ('long prefix + total', {'text_prefix': 'Todo item number 9', 'total': True})
+]
+
+
+def report(name, seconds, number):
+    print('{0:<24} {1:>10.2f} us/op'.format(name, seconds * 1e6 / number))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--todos', type=int, default=100000)
+    parser.add_argument('-t', '--toggles', type=int, default=100000)
+    parser.add_argument('-f', '--first', type=int, default=10)
+    parser.add_argument('-r', '--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    store = TodoStore()
+    started = time.perf_counter()
+    for i in range(args.todos):
+        store.add('Todo item number {0}'.format(i), i % 3 == 0)
+    report('add', time.perf_counter() - started, args.todos)
+
+    ids = [str(random.randint(1, args.todos)) for _ in range(args.toggles)]
+    started = time.perf_counter()
+    for todo_id in ids:
+        store.toggle(todo_id)
+    report('toggle', time.perf_counter() - started, args.toggles)
+
+    for name, kwargs in PAGES:
+        kwargs = dict(kwargs)
+        read_total = kwargs.pop('total', False)
+        if kwargs.get('after') == 'MIDDLE':
+            kwargs['after'] = str(args.todos // 2)
+        if kwargs.pop('last', False):
+            kwargs['last'] = args.first
+        else:
+            kwargs['first'] = args.first
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            page = store.page(**kwargs)
+            if read_total:
+                page.total
+        report(name, time.perf_counter() - started, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
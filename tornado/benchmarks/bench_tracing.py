@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""Measure the overhead of resolver tracing on GraphQL execution
+
+Executes a todoList query over `-t` todos without tracing, then traced at
+each sample rate, and reports the operations per second and the overhead
+relative to no tracing. As in GraphQLHandler, only the sampled operations
+run with the TracingMiddleware.
+
+Usage: python benchmarks/bench_tracing.py [-n NUMBER] [-t TODOS] [--rates 0.01,1]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from graphql.execution import execute  # noqa
+from graphql.execution.middleware import MiddlewareManager  # noqa
+from graphql.language.parser import parse  # noqa
+from tornado_graphql_example.graphql import Tracer, TracingMiddleware  # noqa
+from tornado_graphql_example.schema import schema, use_todo_store  # noqa
+from tornado_graphql_example.todo_store import TodoStore  # noqa
+
+QUERY = 'query todoList { todoList { todos { id text completed } totalCount } }'
+
+
+def run(ast, number, tracer=None, middleware=None):
+    started = time.perf_counter()
+    for _ in range(number):
+        trace = tracer.begin() if tracer is not None else None
+        result = execute(schema, ast, operation_name='todoList',
+                         middleware=middleware if trace is not None else None)
+        if trace is not None:
+            tracer.end(trace, 'todoList')
+        assert not result.errors, result.errors
+    return number / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--number', type=int, default=2000)
+    parser.add_argument('-t', '--todos', type=int, default=20)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--rates', default='0.01,0.1,1',
+                        help='comma-separated sample rates')
+    args = parser.parse_args()
+
+    use_todo_store(TodoStore([('Todo item number {0}'.format(i), i % 3 == 0)
+                              for i in range(args.todos)]))
+    ast = parse(QUERY)
+    run(ast, args.number // 10)
+
+    cases = [('no tracing', None, None)]
+    for rate in [float(r) for r in args.rates.split(',')]:
+        tracer = Tracer(sample_rate=rate)
+        middleware = MiddlewareManager(TracingMiddleware(tracer), wrap_in_promise=False)
+        cases.append(('sample rate {0:g}'.format(rate), tracer, middleware))
+
+    print('{0} x todoList with {1} todos, best of {2}'.format(
+        args.number, args.todos, args.repeat))
+    # the cases take turns so that drift of the machine affects them alike
+    best = [0] * len(cases)
+    for _ in range(args.repeat):
+        for i, (_, tracer, middleware) in enumerate(cases):
+            best[i] = max(best[i], run(ast, args.number, tracer, middleware))
+    for (name, _, _), ops in zip(cases, best):
+        print('{0:<16} {1:>10.0f} ops/s {2:>+7.1%}'.format(name, ops, best[0] / ops - 1))
+
+
+if __name__ == '__main__':
+    main()
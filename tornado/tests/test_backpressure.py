@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+from tornado.concurrent import Future
+from tornado_graphql_example import jsoncodec
+from tornado_graphql_example.graphql import GraphQLSubscriptionHandler
+
+
+class SlowSocket(GraphQLSubscriptionHandler):
+    """A socket whose frames stay in flight until ``flush()``"""
+
+    def __init__(self, policy, max_buffer_size):
+        # not a WebSocket, only its send queue
+        self.policy = policy
+        self.limit = max_buffer_size
+        self.written = []
+        self.in_flight = None
+        self.upstream = []
+        self.initialize()
+
+    @property
+    def max_buffer_size(self):
+        return self.limit
+
+    @property
+    def backpressure_policy(self):
+        return self.policy
+
+    def write_message(self, message, binary=False):
+        self.written.append(jsoncodec.loads(message))
+        self.in_flight = Future()
+        return self.in_flight
+
+    def flush(self):
+        while self.in_flight is not None and not self.in_flight.done():
+            self.in_flight.set_result(None)
+
+    def coalesce(self, data_list):
+        return {'values': [v for data in data_list for v in data['values']]}
+
+    def pause_upstream(self):
+        self.upstream.append('pause')
+
+    def resume_upstream(self):
+        self.upstream.append('resume')
+
+
+def data_message(subid, value):
+    return {'type': 'subscription_data', 'id': subid, 'payload': {'data': {'values': [value]}}}
+
+
+def queued(socket):
+    return [m for m, _ in socket.send_queue]
+
+
+def frame_size(message):
+    return len(jsoncodec.dumps(message))
+
+
+class BackpressureTest(unittest.TestCase):
+
+    def test_no_limit(self):
+        socket = SlowSocket('drop-oldest', 0)
+        for i in range(10):
+            socket.send(data_message('1', i))
+        self.assertEqual(len(socket.send_queue), 9)
+        self.assertEqual(socket.dropped, 0)
+
+    def test_drop_oldest(self):
+        size = frame_size(data_message('1', 0))
+        socket = SlowSocket('drop-oldest', 3 * size)
+        socket.send(data_message('1', 0))
+        socket.send({'type': 'subscription_success', 'id': '2'})
+        for i in range(1, 6):
+            socket.send(data_message('1', i))
+        # the success is never dropped, the oldest data is; the frame in flight counts
+        self.assertEqual(queued(socket), [{'type': 'subscription_success', 'id': '2'},
+                                          data_message('1', 5)])
+        self.assertEqual(socket.dropped, 4)
+        self.assertLessEqual(socket.buffered_bytes, 3 * size)
+        self.assertEqual(socket.buffered_bytes,
+                         sum(len(f) for _, f in socket.send_queue) + size)
+
+        socket.flush()
+        self.assertEqual(socket.written[-1], data_message('1', 5))
+        self.assertEqual(socket.buffered_bytes, 0)
+
+    def test_coalesce(self):
+        socket = SlowSocket('coalesce', 2 * frame_size(data_message('1', 0)))
+        socket.send(data_message('1', 0))
+        for i in range(1, 4):
+            socket.send(data_message('1', i))
+        socket.send(data_message('2', 10))
+        socket.send(data_message('2', 11))
+        self.assertEqual(queued(socket), [
+            {'type': 'subscription_data', 'id': '1', 'payload': {'data': {'values': [1, 2, 3]}}},
+            {'type': 'subscription_data', 'id': '2', 'payload': {'data': {'values': [10, 11]}}}
+        ])
+        self.assertEqual(socket.buffered_bytes,
+                         sum(len(f) for _, f in socket.send_queue) +
+                         frame_size(data_message('1', 0)))
+        socket.flush()
+        self.assertEqual(socket.buffered_bytes, 0)
+        self.assertEqual(len(socket.written), 3)
+
+    def test_pause(self):
+        size = frame_size(data_message('1', 0))
+        socket = SlowSocket('pause', 4 * size)
+        for i in range(6):
+            socket.send(data_message('1', i))
+        self.assertEqual(socket.upstream, ['pause'])
+        self.assertTrue(socket.stats['paused'])
+        self.assertEqual(len(socket.send_queue), 5)
+
+        # resumed once the queue drains below half of the limit
+        socket.in_flight.set_result(None)
+        self.assertEqual(socket.upstream, ['pause'])
+        socket.flush()
+        self.assertEqual(socket.upstream, ['pause', 'resume'])
+        self.assertFalse(socket.paused)
+        self.assertEqual(len(socket.written), 6)
+
+    def test_unknown_policy(self):
+        socket = SlowSocket('block', 1)
+        with self.assertRaises(ValueError):
+            socket.send(data_message('1', 0))
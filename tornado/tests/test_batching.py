@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+from tornado import testing
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+QUERY = '{ todoList { totalCount } }'
+
+
+class BatchTest(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True,
+            'max_batch_size': 3
+        }, [])
+
+    def post(self, body):
+        resp = self.fetch('/graphql', method='POST', body=json.dumps(body))
+        return resp.code, json.loads(resp.body.decode('utf-8'))
+
+    def test_batch(self):
+        code, body = self.post([{'query': QUERY}, {'query': QUERY}])
+        self.assertEqual(code, 200)
+        self.assertEqual(len(body), 2)
+        self.assertEqual(body[0], body[1])
+        self.assertIn('totalCount', body[0]['data']['todoList'])
+
+    def test_errors_stay_in_their_operation(self):
+        code, body = self.post([{'query': QUERY}, {'query': '{ nope }'}, 'query'])
+        self.assertEqual(code, 200)
+        self.assertIn('data', body[0])
+        self.assertNotIn('data', body[1])
+        self.assertEqual(len(body[1]['errors']), 1)
+        self.assertEqual(body[2]['errors'],
+                         [{'message': 'Each batched operation must be an object'}])
+
+    def test_max_batch_size(self):
+        code, body = self.post([{'query': QUERY}] * 4)
+        self.assertEqual(code, 400)
+        self.assertEqual(body['errors'],
+                         [{'message': 'Batch size 4 exceeds the maximum of 3'}])
+
+    def test_documents_are_shared_by_the_batch(self):
+        self.post([{'query': QUERY}] * 3)
+        self.assertEqual(self._app.opts['document_cache'].misses, 1)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+
+# tiny runs which only check that the benchmarks still work with the code
+SMOKE_ARGS = {
+    'bench_commands.py': ['-j', '4', '-c', '2', '--count', '1'],
+    'bench_jsoncodec.py': ['-n', '10'],
+    'bench_load.py': ['-c', '2', '-j', '1', '-n', '10', '-s', '2', '-e', '5', '--jobs', '3'],
+    'bench_pubsub_bus.py': ['-n', '50', '-p', '2'],
+    'bench_scheduler.py': ['-j', '200'],
+    'bench_todo_log.py': ['-n', '50', '-t', '2'],
+    'bench_todo_store.py': ['-n', '100', '-t', '100', '-r', '2'],
+    'bench_tracing.py': ['-n', '5', '-r', '1']
+}
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_benchmark(self, name, *args):
+        proc = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, name)] +
+                                SMOKE_ARGS[name] + list(args),
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate(timeout=120)[0].decode('utf-8', 'replace')
+        self.assertEqual(proc.returncode, 0, '{0} failed:\n{1}'.format(name, output))
+        return output
+
+    def test_every_benchmark_is_covered(self):
+        self.assertEqual(sorted(f for f in os.listdir(BENCHMARKS_DIR) if f.endswith('.py')),
+                         sorted(SMOKE_ARGS))
+
+    def test_benchmarks(self):
+        for name in sorted(SMOKE_ARGS):
+            if name != 'bench_load.py':
+                with self.subTest(name):
+                    self.run_benchmark(name)
+
+    def test_load_with_baseline(self):
+        results = os.path.join(self.tmp_dir, 'results.json')
+        self.run_benchmark('bench_load.py', '-o', results)
+        with open(results) as f:
+            self.assertEqual(sorted(json.load(f)['results']),
+                             ['command', 'fanout', 'mutation', 'query'])
+        # tiny runs are too noisy to gate on, only the comparison is checked
+        output = self.run_benchmark('bench_load.py', '--only', 'query', '--baseline', results,
+                                    '--tolerance', '1000')
+        self.assertIn('requests_per_second', output)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from graphql.error import GraphQLError
+import json
+import unittest
+from tornado import testing
+from tornado_graphql_example.graphql.document_cache import DocumentCache
+from tornado_graphql_example.schema import schema
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+QUERY = '{ todoList { todos { id } } }'
+
+
+class DocumentCacheTest(unittest.TestCase):
+
+    def test_hit(self):
+        cache = DocumentCache(schema)
+        ast, errors = cache.get(QUERY)
+        self.assertEqual(errors, [])
+        self.assertIs(cache.get(QUERY)[0], ast)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_operation_name_is_part_of_the_key(self):
+        cache = DocumentCache(schema)
+        cache.get(QUERY)
+        cache.get(QUERY, 'Todos')
+        self.assertEqual(len(cache), 2)
+
+    def test_validation_errors_are_cached(self):
+        cache = DocumentCache(schema)
+        _, errors = cache.get('{ nope }')
+        self.assertEqual(len(errors), 1)
+        self.assertIs(cache.get('{ nope }')[1], errors)
+
+    def test_parse_errors_are_not_cached(self):
+        cache = DocumentCache(schema)
+        with self.assertRaises(GraphQLError):
+            cache.get('{')
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = DocumentCache(schema, maxsize=2)
+        first, second, third = ['{ todoList { totalCount } }', QUERY,
+                                '{ todoList { todos { text } } }']
+        cache.get(first)
+        cache.get(second)
+        cache.get(first)
+        cache.get(third)
+        self.assertEqual(cache.evictions, 1)
+        cache.get(first)
+        self.assertEqual(cache.stats['hits'], 2)
+        cache.get(second)
+        self.assertEqual(cache.stats['misses'], 4)
+
+
+class DocumentCacheHandlerTest(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True
+        }, [])
+
+    def test_cached_operation(self):
+        for _ in range(2):
+            resp = self.fetch('/graphql', method='POST', body=json.dumps({'query': QUERY}))
+            self.assertEqual(resp.code, 200)
+            self.assertIn('todos', json.loads(resp.body.decode('utf-8'))['data']['todoList'])
+        self.assertEqual(self._app.opts['document_cache'].hits, 1)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import threading
+import time
+import unittest
+from tornado import testing, web
+from tornado_graphql_example.graphql.executor import BoundedExecutor
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+
+class BoundedExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = BoundedExecutor(1, max_queue=1)
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+
+    def test_shed_when_saturated(self):
+        running = self.executor.submit(self.release.wait)
+        queued = self.executor.submit(lambda: 'queued')
+        with self.assertRaises(web.HTTPError) as cm:
+            self.executor.submit(lambda: 'shed')
+        self.assertEqual(cm.exception.status_code, 503)
+        self.assertEqual(self.executor.stats['rejected'], 1)
+        self.assertEqual(self.executor.stats['in_flight'], 2)
+
+        self.release.set()
+        running.result(5)
+        self.assertEqual(queued.result(5), 'queued')
+        # the slots are given back by done callbacks, just after the results
+        deadline = time.time() + 5
+        while self.executor.in_flight and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.executor.submit(lambda: 'again').result(5), 'again')
+
+    def test_in_flight_drops_when_done(self):
+        self.executor.submit(lambda: None).result(5)
+        self.executor.shutdown()
+        self.assertEqual(self.executor.in_flight, 0)
+
+
+class ExecutorHandlerTest(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True,
+            'executor_threads': 2,
+            'executor_queue_size': 0
+        }, [])
+
+    def tearDown(self):
+        self._app.opts['executor'].shutdown()
+        super(ExecutorHandlerTest, self).tearDown()
+
+    def test_operation_on_executor(self):
+        resp = self.fetch('/graphql', method='POST',
+                          body=json.dumps({'query': '{ todoList { totalCount } }'}))
+        self.assertEqual(resp.code, 200)
+        self.assertIn('totalCount', json.loads(resp.body.decode('utf-8'))['data']['todoList'])
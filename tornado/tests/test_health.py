@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+from tornado import ioloop
+import zmq
+from tornado_graphql_example.health import ServerHealth
+from tornado_graphql_example.jobserver_pool import JobServerPool
+
+# nothing listens on these ports, so pings are never answered
+SERVERS = [{'pid': 1, 'ip': '127.0.0.1', 'zmq_port': 1, 'capacity': 1},
+           {'pid': 2, 'ip': '127.0.0.1', 'zmq_port': 2, 'capacity': 1}]
+
+
+class ServerHealthTest(unittest.TestCase):
+
+    def test_circuit_opens_and_closes(self):
+        health = ServerHealth(failure_threshold=3)
+        self.assertEqual(health.state, 'closed')
+        self.assertFalse(health.failure())
+        self.assertFalse(health.failure())
+        self.assertTrue(health.failure())
+        self.assertEqual((health.state, health.available), ('open', False))
+        # only the failure that opens the circuit reports it
+        self.assertFalse(health.failure())
+        self.assertEqual((health.failures, health.consecutive_failures), (4, 4))
+
+        self.assertTrue(health.success(0.01))
+        self.assertEqual((health.state, health.consecutive_failures), ('closed', 0))
+        self.assertFalse(health.success(0.01))
+
+    def test_success_resets_the_failure_count(self):
+        health = ServerHealth(failure_threshold=2)
+        health.failure()
+        health.success(0.01)
+        self.assertFalse(health.failure())
+        self.assertTrue(health.available)
+
+    def test_moving_averages(self):
+        health = ServerHealth(alpha=0.5)
+        health.success(0.1)
+        self.assertAlmostEqual(health.rtt, 0.1)
+        health.success(0.3)
+        self.assertAlmostEqual(health.rtt, 0.2)
+        health.failure()
+        self.assertAlmostEqual(health.failure_rate, 0.5)
+        stats = health.as_dict()
+        self.assertEqual((stats['rtt_ms'], stats['open_for']), (200.0, None))
+        self.assertIsNotNone(stats['last_seen_ago'])
+
+
+class PoolFailOverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.io_loop = ioloop.IOLoop()
+        self.io_loop.make_current()
+        self.context = zmq.Context()
+        self.pool = JobServerPool([dict(s) for s in SERVERS], context=self.context,
+                                  heartbeat_timeout=3.0, failure_threshold=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.context.term()
+        ioloop.IOLoop.clear_current()
+        self.io_loop.close(all_fds=True)
+
+    def miss_heartbeat(self):
+        self.pool.heartbeat()
+        for conn in self.pool.connections.values():
+            conn.ping_sent -= self.pool.heartbeat_timeout
+
+    def test_open_circuit_moves_jobs(self):
+        replies = []
+        job = self.pool.submit(SERVERS[0], {'command': 'countdown'}, replies.append)
+        first, second = self.pool.connection(SERVERS[0]), self.pool.connection(SERVERS[1])
+        self.miss_heartbeat()
+        self.miss_heartbeat()
+        self.assertEqual(first.health.state, 'closed')
+        self.assertEqual(self.pool.select(), SERVERS[0])
+
+        # both circuits open on the third heartbeat: the job moves to the second server,
+        # then fails there as it is out of retries
+        self.pool.heartbeat()
+        self.assertEqual(first.health.state, 'open')
+        self.assertIsNone(self.pool.select())
+        self.assertEqual((job.retries, job.finished), (1, True))
+        self.assertEqual(replies[0]['error'], 'job server 2 is not responding')
+        self.assertEqual(first.in_flight, 0)
+        self.assertEqual(second.in_flight, 0)
+
+        first.health.success(0.01)
+        self.assertEqual(self.pool.select(), SERVERS[0])
+        self.assertEqual(self.pool.select(exclude=1), None)
+
+    def test_retry_on_another_server(self):
+        replies = []
+        job = self.pool.submit(SERVERS[0], {'command': 'countdown'}, replies.append)
+        first, second = self.pool.connection(SERVERS[0]), self.pool.connection(SERVERS[1])
+        self.pool.fail_over(first, 'job server 1 is gone')
+        self.assertIs(job.conn, second)
+        self.assertEqual((job.retries, replies), (1, []))
+
+        # out of retries
+        self.pool.fail_over(second, 'job server 2 is gone')
+        self.assertTrue(job.finished)
+        self.assertEqual(replies[0]['error'], 'job server 2 is gone')
+
+    def test_busy_reply_is_retried(self):
+        replies = []
+        job = self.pool.submit(SERVERS[0], {'command': 'countdown'}, replies.append)
+        first = self.pool.connection(SERVERS[0])
+        first.response_handler([job.request_id, b'{"busy": true, "finished": true}'])
+        self.assertIs(job.conn, self.pool.connection(SERVERS[1]))
+        self.assertEqual(replies, [])
+
+        job.conn.response_handler([job.request_id, b'{"busy": true, "finished": true}'])
+        self.assertEqual(replies, [{'busy': True, 'finished': True}])
+
+    def test_remove_server(self):
+        replies = []
+        self.pool.submit(SERVERS[0], {'command': 'countdown'}, replies.append)
+        self.pool.remove_server(1)
+        self.assertEqual([s['pid'] for s in self.pool.job_servers], [2])
+        self.assertNotIn(1, self.pool.connections)
+        self.assertEqual(self.pool.connection(SERVERS[1]).in_flight, 1)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from multiprocessing import Process
+import os
+import shutil
+import tempfile
+import time
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado import testing
+from tornado_graphql_example.commands import COMMANDS
+from tornado_graphql_example.jobserver import JobServer
+from tornado_graphql_example.jobserver_pool import JobServerPool
+from tornado_graphql_example.membership import read_server_info, server_info_files
+
+
+@gen.coroutine
+def fail(write, request):
+    write('failing')
+    raise RuntimeError('the command failed')
+
+
+def run_job_server(job_server):
+    # only the forked job server gets the command, so that no other test sees it
+    COMMANDS['fail'] = fail
+    job_server()
+
+
+def wait_server_info(timeout=10):
+    """Return the info of the job server once it has written its info file"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for file_path in server_info_files():
+            server = read_server_info(file_path)
+            if server is not None:
+                return server
+        time.sleep(0.05)
+    raise RuntimeError('the job server did not start')
+
+
+class JobServerTest(testing.AsyncTestCase):
+    """Every job gets a final reply, so that its subscription completes"""
+
+    @classmethod
+    def setUpClass(cls):
+        # the job server is forked before the test creates an IOLoop or a ZeroMQ context
+        cls.runtime_dir = tempfile.mkdtemp()
+        os.environ['XDG_RUNTIME_DIR'] = cls.runtime_dir
+        job_server = JobServer(ip='127.0.0.1', capacity=2, log_level='ERROR')
+        cls.proc = Process(target=run_job_server, args=(job_server,))
+        cls.proc.start()
+        cls.server = wait_server_info()
+        # one pool for all the tests, as the job server routes replies by the
+        # identity of the connection, which is the pid of this process
+        cls.pool = JobServerPool([cls.server])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        cls.proc.terminate()
+        cls.proc.join()
+        shutil.rmtree(cls.runtime_dir)
+
+    def get_new_ioloop(self):
+        # the IOLoop of the pool's connection, which AsyncTestCase does not close
+        return IOLoop.instance()
+
+    @gen.coroutine
+    def run_job(self, request):
+        """Submit a request and return its replies once it is finished"""
+        replies = []
+        finished = Future()
+
+        def callback(resp):
+            replies.append(resp)
+            if resp.get('finished'):
+                finished.set_result(replies)
+
+        self.pool.submit(self.pool.job_servers[0], request, callback)
+        result = yield finished
+        raise gen.Return(result)
+
+    @testing.gen_test(timeout=10)
+    def test_unknown_command(self):
+        replies = yield self.run_job({'command': 'nope'})
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(replies[0]['error'], "Unknown command 'nope'")
+        self.assertEqual(self.pool.connections[self.proc.pid].in_flight, 0)
+
+    @testing.gen_test(timeout=10)
+    def test_missing_command(self):
+        replies = yield self.run_job({})
+        self.assertIn('command must be specified', replies[-1]['error'])
+        self.assertEqual(self.pool.connections[self.proc.pid].in_flight, 0)
+
+    @testing.gen_test(timeout=10)
+    def test_failing_command(self):
+        replies = yield self.run_job({'command': 'fail'})
+        self.assertEqual([r.get('stdout') for r in replies], ['failing', None])
+        self.assertEqual(replies[-1]['error'], 'the command failed')
+        self.assertEqual(self.pool.connections[self.proc.pid].in_flight, 0)
+
+    @testing.gen_test(timeout=10)
+    def test_command(self):
+        replies = yield self.run_job({'command': 'countdown', 'interval': 0, 'count': 2})
+        self.assertEqual([r.get('stdout') for r in replies], ['2', '1', '0', None])
+        self.assertNotIn('error', replies[-1])
+
+    @testing.gen_test(timeout=10)
+    def test_pause(self):
+        replies = []
+        finished = Future()
+
+        def callback(resp):
+            replies.append(resp)
+            if resp.get('finished'):
+                finished.set_result(replies)
+
+        job = self.pool.submit(self.pool.job_servers[0],
+                               {'command': 'countdown', 'interval': 0.1, 'count': 3}, callback)
+        job.pause()
+        yield gen.sleep(0.5)
+        # the output is held back once the pause arrives, which may be after
+        # the first line, and the connection still serves other jobs
+        self.assertLessEqual(len(replies), 1)
+        other = yield self.run_job({'command': 'countdown', 'interval': 0, 'count': 0})
+        self.assertEqual(other[-1]['finished'], True)
+        job.resume()
+        yield finished
+        lines = []
+        for resp in replies:
+            lines.extend(line['stdout'] for line in resp.get('lines', []))
+            if resp.get('stdout') is not None:
+                lines.append(resp['stdout'])
+        self.assertEqual(lines, ['3', '2', '1', '0'])
+
+    @testing.gen_test(timeout=10)
+    def test_cancel(self):
+        replies = []
+        job = self.pool.submit(self.pool.job_servers[0],
+                               {'command': 'countdown', 'interval': 5, 'count': 1},
+                               replies.append)
+        yield gen.sleep(0.2)
+        job.cancel()
+        yield gen.sleep(0.2)
+        # the job server stopped the job instead of letting it run for 5s
+        yield self.run_job({'command': 'countdown', 'interval': 0, 'count': 0})
+        self.assertEqual(self.pool.connections[self.proc.pid].running, 0)
+        self.assertTrue(all(not r.get('finished') for r in replies))
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import unittest
+from tornado_graphql_example import jsoncodec
+
+DATA = {
+    'data': {'todoList': {'todos': [{'id': '1', 'text': u'café \U0001f600'}]}},
+    'number': 1.5,
+    'none': None,
+    'flags': [True, False]
+}
+
+
+class JsonCodecTest(unittest.TestCase):
+    """Every installed backend behaves like the standard library"""
+
+    def test_round_trip(self):
+        for name, (dumps, loads) in jsoncodec.available_backends().items():
+            encoded = dumps(DATA)
+            self.assertIsInstance(encoded, bytes, name)
+            self.assertEqual(json.loads(encoded.decode('utf-8')), DATA, name)
+            self.assertEqual(loads(encoded), DATA, name)
+            self.assertEqual(loads(encoded.decode('utf-8')), DATA, name)
+
+    def test_utf8_output(self):
+        for name, (dumps, _) in jsoncodec.available_backends().items():
+            self.assertEqual(dumps(u'é'), u'"é"'.encode('utf-8'), name)
+
+    def test_script_end_is_escaped(self):
+        for name, (dumps, loads) in jsoncodec.available_backends().items():
+            encoded = dumps({'stdout': '</script><script>alert(1)</script>'})
+            self.assertNotIn(b'</', encoded, name)
+            self.assertEqual(loads(encoded)['stdout'], '</script><script>alert(1)</script>', name)
+
+    def test_default_backend(self):
+        self.assertEqual(jsoncodec.backend, next(iter(jsoncodec.available_backends())))
+        self.assertIn(b'<\\/', jsoncodec.dumps('</'))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from tornado_graphql_example.membership import JobServerMembership, read_server_info
+
+
+class FakePool(object):
+
+    def __init__(self):
+        self.job_servers = []
+        self.removed = []
+
+    def add_server(self, server):
+        self.job_servers.append(server)
+
+    def remove_server(self, pid):
+        self.job_servers = [s for s in self.job_servers if s['pid'] != pid]
+        self.removed.append(pid)
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+class MembershipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.appdir = tempfile.mkdtemp()
+        self.pool = FakePool()
+        self.membership = JobServerMembership(self.pool, appdir=self.appdir, timeout=15.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.appdir)
+
+    def write_info(self, pid, age=0):
+        path = os.path.join(self.appdir, 'jobserver-{0}'.format(pid))
+        with open(path, 'w') as f:
+            json.dump({'pid': pid, 'ip': '127.0.0.1', 'zmq_port': 1}, f)
+        if age:
+            mtime = time.time() - age
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def pids(self):
+        return [s['pid'] for s in self.pool.job_servers]
+
+    def test_join_and_leave(self):
+        path = self.write_info(os.getpid())
+        self.membership.scan()
+        self.assertEqual(self.pids(), [os.getpid()])
+        self.membership.scan()
+        self.assertEqual(self.pids(), [os.getpid()])
+
+        os.unlink(path)
+        self.membership.scan()
+        self.assertEqual(self.pids(), [])
+        self.assertEqual(self.pool.removed, [os.getpid()])
+
+    def test_dead_process(self):
+        self.write_info(dead_pid())
+        self.membership.scan()
+        self.assertEqual(self.pids(), [])
+
+    def test_stale_file(self):
+        self.write_info(os.getpid(), age=60)
+        self.membership.scan()
+        self.assertEqual(self.pids(), [])
+
+    def test_incomplete_file(self):
+        with open(os.path.join(self.appdir, 'jobserver-1'), 'w') as f:
+            f.write('{"pid": ')
+        self.assertIsNone(read_server_info(os.path.join(self.appdir, 'jobserver-1')))
+        self.assertIsNone(read_server_info(os.path.join(self.appdir, 'jobserver-2')))
+        self.membership.scan()
+        self.assertEqual(self.pids(), [])
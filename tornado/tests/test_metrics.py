@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import unittest
+from tornado import testing
+from tornado_graphql_example.metrics import Counter, Gauge, Histogram, MetricsRegistry
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_counter(self):
+        counter = Counter('requests_total', 'Requests', ['method'])
+        counter.inc(labels=('GET',))
+        counter.inc(2, labels=('GET',))
+        counter.inc(labels=('a"b\\c\nd',))
+        self.assertEqual(counter.render().split('\n'), [
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{method="GET"} 3',
+            'requests_total{method="a\\"b\\\\c\\nd"} 1'
+        ])
+
+    def test_gauge_without_labels(self):
+        gauge = Gauge('temperature', 'Degrees')
+        gauge.set(1.5)
+        gauge.inc(0.5)
+        self.assertEqual(gauge.render().split('\n')[-1], 'temperature 2.0')
+        gauge.clear()
+        self.assertEqual(len(gauge.render().split('\n')), 2)
+
+    def test_series_are_bounded(self):
+        counter = Counter('hits_total', 'Hits', ['path'], max_series=2)
+        for path in ['/a', '/b', '/c', '/d', '/a']:
+            counter.inc(labels=(path,))
+        self.assertEqual(counter.series, {('/a',): 2, ('/b',): 1, ('_other',): 2})
+
+    def test_histogram(self):
+        histogram = Histogram('latency_seconds', 'Latency', ['op'], buckets=(0.1, 1.0))
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(value, ('q',))
+        self.assertEqual(histogram.render().split('\n')[2:], [
+            'latency_seconds_bucket{op="q",le="0.1"} 2',
+            'latency_seconds_bucket{op="q",le="1.0"} 3',
+            'latency_seconds_bucket{op="q",le="+Inf"} 4',
+            'latency_seconds_sum{op="q"} 3.65',
+            'latency_seconds_count{op="q"} 4'
+        ])
+
+    def test_collectors_run_before_rendering(self):
+        registry = MetricsRegistry()
+        gauge = registry.gauge('queued', 'Queued jobs')
+        registry.add_collector(lambda: gauge.set(7))
+        self.assertTrue(registry.render().endswith('queued 7\n'))
+
+
+class MetricsHandlerTest(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True
+        }, [])
+
+    def test_scrape(self):
+        body = json.dumps({'query': 'query Count { todoList { totalCount } }'})
+        self.assertEqual(self.fetch('/graphql', method='POST', body=body).code, 200)
+        body = json.dumps({'query': 'query Broken { todoList(after: "x") { totalCount } }'})
+        self.assertEqual(self.fetch('/graphql', method='POST', body=body).code, 200)
+
+        resp = self.fetch('/metrics')
+        self.assertEqual(resp.code, 200)
+        self.assertTrue(resp.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = resp.body.decode('utf-8').split('\n')
+        self.assertIn('graphql_request_duration_seconds_count{operation="Count"} 1', lines)
+        self.assertIn('graphql_errors_total{operation="Broken"} 1', lines)
+        self.assertNotIn('graphql_errors_total{operation="Count"} 1', lines)
+        self.assertIn('graphql_resolver_duration_seconds_count{field="Query.todoList"} 2', lines)
+        self.assertIn('websocket_connections 0', lines)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import tempfile
+import unittest
+from tornado import testing
+from tornado_graphql_example.graphql.graphql_handler import ExecutionError
+from tornado_graphql_example.graphql.persisted_queries import PersistedQueryRegistry, query_hash
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+QUERY = 'query Todos { todoList { todos { id } } }'
+
+
+def persisted(query):
+    return {'persistedQuery': {'version': 1, 'sha256Hash': query_hash(query)}}
+
+
+class PersistedQueryRegistryTest(unittest.TestCase):
+
+    def test_register_on_miss(self):
+        registry = PersistedQueryRegistry()
+        with self.assertRaises(ExecutionError) as cm:
+            registry.resolve(None, persisted(QUERY))
+        self.assertEqual(cm.exception.errors, ['PersistedQueryNotFound'])
+        self.assertEqual(registry.resolve(QUERY, persisted(QUERY)), QUERY)
+        self.assertEqual(registry.resolve(None, persisted(QUERY)), QUERY)
+
+    def test_hash_mismatch(self):
+        registry = PersistedQueryRegistry()
+        with self.assertRaises(ExecutionError):
+            registry.resolve(QUERY + ' ', persisted(QUERY))
+        self.assertEqual(len(registry), 0)
+
+    def test_plain_query(self):
+        self.assertEqual(PersistedQueryRegistry().resolve(QUERY, None), QUERY)
+
+    def test_max_entries(self):
+        registry = PersistedQueryRegistry(max_entries=1)
+        registry.resolve(QUERY, persisted(QUERY))
+        other = QUERY.replace('Todos', 'Other')
+        self.assertEqual(registry.resolve(other, persisted(other)), other)
+        self.assertNotIn(query_hash(other), registry)
+
+    def test_allowlist(self):
+        registry = PersistedQueryRegistry(allowlist_only=True)
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump([QUERY], f)
+        try:
+            registry.load_manifest(path)
+        finally:
+            os.unlink(path)
+        self.assertEqual(registry.resolve(None, persisted(QUERY)), QUERY)
+        self.assertEqual(registry.resolve(QUERY, None), QUERY)
+        for query, extensions in [('{ todoList { totalCount } }', None),
+                                  (None, persisted('{ x }'))]:
+            with self.assertRaises(ExecutionError) as cm:
+                registry.resolve(query, extensions)
+            self.assertEqual(cm.exception.errors, ['PersistedQueryNotAllowed'])
+
+    def test_manifest_hash_mismatch(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({query_hash(QUERY): QUERY + ' '}, f)
+        try:
+            with self.assertRaises(ValueError):
+                PersistedQueryRegistry().load_manifest(path)
+        finally:
+            os.unlink(path)
+
+
+class PersistedQueryHandlerTest(testing.AsyncHTTPTestCase):
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True,
+            'persisted_queries': True
+        }, [])
+
+    def post(self, body):
+        resp = self.fetch('/graphql', method='POST', body=json.dumps(body))
+        return resp.code, json.loads(resp.body.decode('utf-8'))
+
+    def test_retry_with_query(self):
+        code, body = self.post({'extensions': persisted(QUERY)})
+        self.assertEqual(code, 400)
+        self.assertEqual(body['errors'], [{'message': 'PersistedQueryNotFound'}])
+        code, body = self.post({'query': QUERY, 'extensions': persisted(QUERY)})
+        self.assertEqual(code, 200)
+        code, body = self.post({'extensions': persisted(QUERY)})
+        self.assertEqual(code, 200)
+        self.assertIn('todos', body['data']['todoList'])
+
+    def test_missing_query(self):
+        code, body = self.post({})
+        self.assertEqual(code, 400)
+        self.assertEqual(body['errors'], [{'message': 'Must provide query string.'}])
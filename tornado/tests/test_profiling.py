@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from base64 import b64decode
+import marshal
+import time
+from tornado import gen, testing
+from tornado_graphql_example.profiling import (BlockingDetector, Profiler, ProfilerBusy,
+                                               check_profile_args)
+
+
+def busy_loop(seconds):
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        pass
+
+
+class ProfilingTest(testing.AsyncTestCase):
+
+    def test_check_profile_args(self):
+        self.assertEqual(check_profile_args(1, 'cprofile'), 'text')
+        self.assertEqual(check_profile_args(1, 'sample'), 'collapsed')
+        for args in [(1, 'perf'), (1, 'sample', 'text'), (0, 'cprofile'), (61, 'sample')]:
+            with self.assertRaises(ValueError):
+                check_profile_args(*args)
+
+    @gen.coroutine
+    def busy(self, seconds):
+        yield gen.moment
+        busy_loop(seconds)
+
+    @testing.gen_test
+    def test_cprofile(self):
+        profile, _ = yield [Profiler().profile(0.2), self.busy(0.05)]
+        self.assertIn('busy_loop', profile)
+
+        profile, _ = yield [Profiler().profile(0.2, format='pstats'), self.busy(0.05)]
+        stats = marshal.loads(b64decode(profile))
+        self.assertIn('busy_loop', [name for _, _, name in stats])
+
+    @testing.gen_test
+    def test_sample(self):
+        profile, _ = yield [Profiler().profile(0.3, 'sample', interval=0.001),
+                            self.busy(0.1)]
+        stacks = [line for line in profile.splitlines() if 'busy_loop@' in line]
+        self.assertTrue(stacks)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in stacks))
+
+    @testing.gen_test
+    def test_one_profile_at_a_time(self):
+        profiler = Profiler()
+        first = profiler.profile(0.05)
+        with self.assertRaises(ProfilerBusy):
+            yield profiler.profile(0.05)
+        yield first
+        self.assertFalse(profiler.running)
+
+    @testing.gen_test
+    def test_blocking_detector(self):
+        detector = BlockingDetector(0.05, self.io_loop)
+        detector.start()
+        try:
+            yield gen.sleep(0.1)
+            self.assertEqual(detector.blocked, 0)
+            busy_loop(0.2)
+            yield gen.sleep(0.1)
+        finally:
+            detector.stop()
+        self.assertEqual(detector.blocked, 1)
+        self.assertGreaterEqual(detector.blocked_seconds, 0.1)
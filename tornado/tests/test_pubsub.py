@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from tornado import gen, testing
+from tornado_graphql_example import jsoncodec
+from tornado_graphql_example.pubsub import PubSub
+
+
+class Subscriber(object):
+
+    def __init__(self):
+        self.received = []
+
+    def send_data(self, subid, data, encoded_data=None):
+        self.received.append((subid, data, encoded_data))
+
+
+class FakeBus(object):
+
+    def __init__(self):
+        self.topics = []
+        self.sent = []
+
+    def subscribe(self, topic):
+        self.topics.append(topic)
+
+    def unsubscribe(self, topic):
+        self.topics.remove(topic)
+
+    def send(self, topic, encoded_data):
+        self.sent.append((topic, encoded_data))
+
+
+class PubSubTest(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(PubSubTest, self).setUp()
+        self.pubsub = PubSub()
+
+    @testing.gen_test
+    def test_publish_encodes_once(self):
+        first, second, other = Subscriber(), Subscriber(), Subscriber()
+        self.pubsub.subscribe('todoAdded', first, '1')
+        self.pubsub.subscribe('todoAdded', second, '7')
+        self.pubsub.subscribe('todoRemoved', other, '2')
+        self.pubsub.publish('todoAdded', {'id': 'a'})
+        # frames are sent on the IOLoop
+        self.assertEqual(first.received, [])
+        yield gen.moment
+
+        encoded = jsoncodec.dumps({'id': 'a'})
+        self.assertEqual(first.received, [('1', {'id': 'a'}, encoded)])
+        self.assertEqual(second.received, [('7', {'id': 'a'}, encoded)])
+        self.assertIs(first.received[0][2], second.received[0][2])
+        self.assertEqual(other.received, [])
+        self.assertEqual(self.pubsub.stats, {'todoAdded': 2, 'todoRemoved': 1})
+
+    @testing.gen_test
+    def test_unsubscribe(self):
+        first, second = Subscriber(), Subscriber()
+        self.pubsub.subscribe('todoAdded', first, '1')
+        self.pubsub.subscribe('todoRemoved', first, '2')
+        self.pubsub.subscribe('todoAdded', second, '1')
+        self.pubsub.unsubscribe('todoAdded', second)
+        self.pubsub.unsubscribe('todoAdded', second)
+        self.pubsub.unsubscribe('todoToggled', second)
+        self.pubsub.publish('todoAdded', {'id': 'a'})
+        yield gen.moment
+        self.assertEqual(len(first.received), 1)
+        self.assertEqual(second.received, [])
+
+        self.pubsub.unsubscribe_all(first)
+        self.assertEqual(self.pubsub.topics, {})
+        # nothing is encoded for a topic without subscribers
+        self.pubsub.publish('todoAdded', object())
+
+    @testing.gen_test
+    def test_bus(self):
+        bus = FakeBus()
+        self.pubsub.attach(bus)
+        subscriber, other = Subscriber(), Subscriber()
+        self.pubsub.subscribe('todoAdded', subscriber, '1')
+        self.pubsub.subscribe('todoAdded', other, '2')
+        self.assertEqual(bus.topics, ['todoAdded'])
+
+        # published to the other processes even without local subscribers
+        self.pubsub.publish('todoRemoved', {'id': 'b'})
+        self.pubsub.publish('todoAdded', {'id': 'a'})
+        yield gen.moment
+        self.assertEqual(bus.sent, [('todoRemoved', jsoncodec.dumps({'id': 'b'})),
+                                    ('todoAdded', jsoncodec.dumps({'id': 'a'}))])
+        self.assertEqual(len(subscriber.received), 1)
+
+        # events from the bus only go to the local subscribers
+        self.pubsub.deliver('todoAdded', {'id': 'c'}, b'{"id":"c"}')
+        self.assertEqual(subscriber.received[-1], ('1', {'id': 'c'}, b'{"id":"c"}'))
+        self.assertEqual(len(bus.sent), 2)
+
+        self.pubsub.unsubscribe_all(subscriber)
+        self.assertEqual(bus.topics, ['todoAdded'])
+        self.pubsub.unsubscribe_all(other)
+        self.assertEqual(bus.topics, [])
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+from tornado import gen, testing
+import zmq
+from tornado_graphql_example.pubsub import PubSub
+from tornado_graphql_example.pubsub_bus import PubSubBus
+
+
+class Subscriber(object):
+
+    def __init__(self):
+        self.received = []
+
+    def send_data(self, subid, data, encoded_data=None):
+        self.received.append((subid, data, encoded_data))
+
+
+class PubSubBusTest(testing.AsyncTestCase):
+
+    def setUp(self):
+        super(PubSubBusTest, self).setUp()
+        self.appdir = tempfile.mkdtemp()
+        self.context = zmq.Context()
+        self.buses = []
+
+    def tearDown(self):
+        for bus in self.buses:
+            bus.stop()
+        self.context.term()
+        shutil.rmtree(self.appdir)
+        super(PubSubBusTest, self).tearDown()
+
+    def start_bus(self, pid):
+        """Start a bus posing as the web app process ``pid``"""
+        pubsub = PubSub()
+        bus = PubSubBus(pubsub, context=self.context, appdir=self.appdir, poll_interval=60)
+        bus.pid = pid
+        bus.start()
+        self.buses.append(bus)
+        return bus
+
+    @gen.coroutine
+    def wait_for(self, predicate, action=None, timeout=5):
+        deadline = self.io_loop.time() + timeout
+        while not predicate():
+            if self.io_loop.time() > deadline:
+                raise AssertionError('timed out')
+            if action is not None:
+                action()
+            yield gen.sleep(0.02)
+
+    @testing.gen_test
+    def test_events_cross_processes(self):
+        # the parent of the test stands for another live process
+        first, second = self.start_bus(os.getpid()), self.start_bus(os.getppid())
+        first.scan()
+        self.assertEqual(first.peers, {second.pid: second.url})
+        self.assertEqual(second.peers, {first.pid: first.url})
+
+        subscriber = Subscriber()
+        second.pubsub.subscribe('todoAdded', subscriber, '1')
+        # the subscription reaches the publisher asynchronously, so publish until it arrives
+        yield self.wait_for(lambda: subscriber.received,
+                            lambda: first.pubsub.publish('todoAdded', {'id': 'a'}))
+        self.assertEqual(subscriber.received[0], ('1', {'id': 'a'}, b'{"id":"a"}'))
+        self.assertEqual(second.pubsub.topics['todoAdded'], {subscriber: '1'})
+
+        # not subscribed topics are filtered by the publisher
+        received = second.received
+        first.pubsub.publish('todoRemoved', {'id': 'a'})
+        first.pubsub.publish('todoAdded', {'id': 'b'})
+        yield self.wait_for(lambda: len(subscriber.received) > 1)
+        self.assertEqual(second.received, received + 1)
+        self.assertEqual(subscriber.received[-1][1], {'id': 'b'})
+
+    @testing.gen_test
+    def test_peers_leave(self):
+        first, second = self.start_bus(os.getpid()), self.start_bus(os.getppid())
+        second.stop()
+        self.buses.remove(second)
+        self.assertFalse(os.path.exists(second.info_file))
+        first.scan()
+        self.assertEqual(first.peers, {})
+
+    def test_dead_peer_file_is_removed(self):
+        first = self.start_bus(os.getpid())
+        with open(os.path.join(self.appdir, 'webapp-999999999'), 'w') as f:
+            f.write('{"pid": 999999999, "bus_url": "tcp://127.0.0.1:1"}')
+        first.scan()
+        self.assertEqual(first.peers, {})
+        self.assertEqual(os.listdir(self.appdir), ['webapp-{0}'.format(first.pid)])
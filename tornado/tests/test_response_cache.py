@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import unittest
+from tornado import testing
+from tornado.escape import url_escape
+from tornado_graphql_example import schema
+from tornado_graphql_example.graphql import TRACE_HEADER, ResponseCache, response_etag
+from tornado_graphql_example.todo_store import TodoStore
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+QUERY = 'query Count { todoList { totalCount } }'
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def test_lru(self):
+        cache = ResponseCache(maxsize=2)
+        self.assertIsNone(cache.get('a', 1))
+        cache.put('a', 1, b'A')
+        cache.put('b', 1, b'B')
+        self.assertEqual(cache.get('a', 1), b'A')
+        cache.put('c', 1, b'C')
+        # b was the least recently used
+        self.assertIsNone(cache.get('b', 1))
+        self.assertEqual((cache.get('a', 1), cache.get('c', 1)), (b'A', b'C'))
+        self.assertEqual((cache.hits, cache.misses, cache.evictions), (3, 2, 1))
+
+    def test_new_version_invalidates(self):
+        cache = ResponseCache()
+        cache.get('a', 1)
+        cache.put('a', 1, b'A')
+        self.assertIsNone(cache.get('a', 2))
+        self.assertEqual((len(cache), cache.invalidations), (0, 1))
+        # a response computed for an older version is not cached
+        cache.put('a', 1, b'A')
+        self.assertEqual(len(cache), 0)
+
+    def test_etag(self):
+        etag = response_etag((1, 2), QUERY, None, '{}')
+        self.assertEqual(etag, response_etag((1, 2), QUERY, None, '{}'))
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        for other in [((1, 3), QUERY, None, '{}'), ((1, 2), QUERY, 'Count', '{}'),
+                      ((1, 2), QUERY, None, '{"a":1}')]:
+            self.assertNotEqual(response_etag(*other), etag)
+
+
+class ConditionalGetTest(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.saved_store = schema.todo_store
+        schema.use_todo_store(TodoStore([('first', False)]))
+
+    def tearDown(self):
+        schema.use_todo_store(self.saved_store)
+        super(ConditionalGetTest, self).tearDown()
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True
+        }, [])
+
+    def get(self, query=QUERY, headers=None):
+        return self.fetch('/graphql?query=' + url_escape(query), headers=headers)
+
+    def test_not_modified_until_a_mutation(self):
+        resp = self.get()
+        self.assertEqual(resp.code, 200)
+        etag = resp.headers['Etag']
+        self.assertEqual(resp.headers['Cache-Control'], 'no-cache')
+        self.assertEqual(json.loads(resp.body.decode('utf-8')),
+                         {'data': {'todoList': {'totalCount': 1}}})
+
+        resp = self.get(headers={'If-None-Match': etag})
+        self.assertEqual((resp.code, resp.body), (304, b''))
+
+        mutation = 'mutation { addTodo(text: "second") { todo { id } } }'
+        self.assertEqual(self.fetch('/graphql', method='POST',
+                                    body=json.dumps({'query': mutation})).code, 200)
+        resp = self.get(headers={'If-None-Match': etag})
+        self.assertEqual(resp.code, 200)
+        self.assertNotEqual(resp.headers['Etag'], etag)
+        self.assertEqual(json.loads(resp.body.decode('utf-8')),
+                         {'data': {'todoList': {'totalCount': 2}}})
+
+    def test_response_cache(self):
+        cache = self._app.opts['response_cache']
+        first = self.get()
+        second = self.get()
+        self.assertEqual(first.body, second.body)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_errors_are_not_cached(self):
+        resp = self.get('query Broken { todoList(after: "x") { totalCount } }')
+        self.assertEqual(resp.code, 200)
+        self.assertNotIn('Etag', resp.headers)
+        self.assertEqual(len(self._app.opts['response_cache']), 0)
+
+    def test_traced_requests_skip_the_etag(self):
+        resp = self.get(headers={TRACE_HEADER: '1'})
+        self.assertNotIn('Etag', resp.headers)
+
+    def test_mutations_need_post(self):
+        resp = self.get('mutation { addTodo(text: "x") { todo { id } } }')
+        self.assertEqual(resp.code, 405)
+        self.assertEqual(resp.headers['Allow'], 'POST')
+        self.assertEqual(len(schema.todo_store), 1)
+
+    def test_missing_query(self):
+        resp = self.fetch('/graphql')
+        self.assertEqual(resp.code, 400)
+        self.assertEqual(json.loads(resp.body.decode('utf-8'))['errors'][0]['message'],
+                         'Must provide query string.')
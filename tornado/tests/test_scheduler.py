@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import random
+import unittest
+from tornado_graphql_example.scheduler import (LeastOutstandingScheduler, PowerOfTwoScheduler,
+                                               RoundRobinScheduler, WeightedCapacityScheduler,
+                                               make_scheduler)
+
+SERVERS = ['a', 'b', 'c']
+
+
+def selections(scheduler, loads, capacities=None, number=6):
+    capacities = capacities or {}
+    return [scheduler.select(SERVERS, loads.get, lambda s: capacities.get(s, 1))
+            for _ in range(number)]
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_round_robin(self):
+        self.assertEqual(selections(RoundRobinScheduler(), {'a': 5, 'b': 0, 'c': 0}),
+                         ['a', 'b', 'c', 'a', 'b', 'c'])
+
+    def test_round_robin_after_a_server_left(self):
+        scheduler = RoundRobinScheduler()
+        selections(scheduler, {}, number=2)
+        self.assertEqual(scheduler.select(['a'], None, None), 'a')
+
+    def test_least_outstanding(self):
+        self.assertEqual(set(selections(LeastOutstandingScheduler(), {'a': 2, 'b': 0, 'c': 1})),
+                         {'b'})
+
+    def test_least_outstanding_ties_rotate(self):
+        self.assertEqual(set(selections(LeastOutstandingScheduler(), {'a': 0, 'b': 0, 'c': 0})),
+                         set(SERVERS))
+
+    def test_power_of_two(self):
+        chosen = selections(PowerOfTwoScheduler(random.Random(1)), {'a': 9, 'b': 0, 'c': 0},
+                            number=100)
+        # the most loaded server only wins against itself, which sample() never picks
+        self.assertNotIn('a', chosen)
+        self.assertEqual(PowerOfTwoScheduler().select(['a'], None, None), 'a')
+
+    def test_weighted_capacity(self):
+        chosen = selections(WeightedCapacityScheduler(), {'a': 3, 'b': 3, 'c': 0},
+                            {'a': 8, 'b': 2, 'c': 1})
+        # (3 + 1) / 8 beats (0 + 1) / 1 and (3 + 1) / 2
+        self.assertEqual(set(chosen), {'a'})
+
+    def test_make_scheduler(self):
+        self.assertIsInstance(make_scheduler('weighted'), WeightedCapacityScheduler)
+        with self.assertRaises(ValueError):
+            make_scheduler('random')
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from graphql.error import GraphQLError
+import json
+import unittest
+from tornado import testing
+from tornado_graphql_example import schema
+from tornado_graphql_example.todo_store import TodoStore
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+PAGE_QUERY = '''
+query Page($first: Int, $after: String, $last: Int, $before: String, $completed: Boolean) {
+  todoList(first: $first, after: $after, last: $last, before: $before,
+           completed: $completed) {
+    totalCount
+    edges { cursor node { id text } }
+    pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+  }
+}
+'''
+
+
+class TodoCursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        self.assertEqual(schema.todo_cursor_id(schema.todo_cursor('42')), '42')
+
+    def test_invalid(self):
+        for cursor in ['', 'x', schema.todo_cursor('x'), 'dXNlcjox']:
+            with self.assertRaises(GraphQLError):
+                schema.todo_cursor_id(cursor)
+
+
+class TodoListTest(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        super(TodoListTest, self).setUp()
+        self.saved_store = schema.todo_store
+        schema.use_todo_store(TodoStore(('todo {0}'.format(i), i % 2 == 0) for i in range(5)))
+
+    def tearDown(self):
+        schema.use_todo_store(self.saved_store)
+        super(TodoListTest, self).tearDown()
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True
+        }, [])
+
+    def page(self, **variables):
+        resp = self.fetch('/graphql', method='POST',
+                          body=json.dumps({'query': PAGE_QUERY, 'variables': variables}))
+        self.assertEqual(resp.code, 200)
+        return json.loads(resp.body.decode('utf-8'))
+
+    def test_pages_by_cursor(self):
+        body = self.page(first=2)
+        todo_list = body['data']['todoList']
+        self.assertEqual([e['node']['id'] for e in todo_list['edges']], ['1', '2'])
+        self.assertEqual(todo_list['totalCount'], 5)
+        self.assertEqual(todo_list['pageInfo'], {
+            'hasNextPage': True,
+            'hasPreviousPage': False,
+            'startCursor': schema.todo_cursor('1'),
+            'endCursor': schema.todo_cursor('2')
+        })
+
+        body = self.page(first=2, after=todo_list['pageInfo']['endCursor'])
+        self.assertEqual([e['node']['id'] for e in body['data']['todoList']['edges']],
+                         ['3', '4'])
+
+        body = self.page(last=2, before=schema.todo_cursor('5'))
+        todo_list = body['data']['todoList']
+        self.assertEqual([e['node']['id'] for e in todo_list['edges']], ['3', '4'])
+        self.assertEqual(todo_list['edges'][0]['cursor'], schema.todo_cursor('3'))
+
+    def test_completed(self):
+        todo_list = self.page(completed=True)['data']['todoList']
+        self.assertEqual([e['node']['id'] for e in todo_list['edges']], ['1', '3', '5'])
+        self.assertEqual(todo_list['totalCount'], 3)
+
+    def test_invalid_cursor_is_reported(self):
+        body = self.page(first=2, after='nope')
+        self.assertIsNone(body['data']['todoList'])
+        self.assertEqual([e['message'] for e in body['errors']], ['Invalid cursor: nope'])
+
+    def test_empty_page(self):
+        todo_list = self.page(first=2, after=schema.todo_cursor('5'))['data']['todoList']
+        self.assertEqual(todo_list['edges'], [])
+        self.assertIsNone(todo_list['pageInfo']['startCursor'])
+        self.assertFalse(todo_list['pageInfo']['hasNextPage'])
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from multiprocessing import Process
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from tornado_graphql_example import todo_log
+from tornado_graphql_example.todo_log import (DurableTodoStore, SharedTodoStore, TodoLog,
+                                              read_snapshot, write_snapshot)
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class TodoLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.data_dir)
+
+    def open_store(self, **kwargs):
+        kwargs.setdefault('fsync', 'never')
+        store = DurableTodoStore(self.data_dir, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def reopen(self, store, **kwargs):
+        store.close()
+        self.stores.remove(store)
+        return self.open_store(**kwargs)
+
+    def mutate(self, store):
+        store.add('buy milk')
+        store.add('buy eggs', completed=True)
+        store.toggle('1')
+        store.add('sell car')
+        store.set_completed('3', True)
+        store.remove('2')
+
+    def test_replay(self):
+        store = self.open_store()
+        self.mutate(store)
+        values = store.values()
+        store = self.reopen(store)
+        self.assertEqual(store.values(), values)
+        self.assertEqual(store.add('next').id, '4')
+        self.assertEqual(store.page(text_prefix='buy').total, 1)
+
+    def test_snapshot_and_rotation(self):
+        store = self.open_store(snapshot_interval=4)
+        self.mutate(store)
+        wait_for(lambda: os.path.exists(store.snapshot_path))
+        wait_for(lambda: store.log.generations == [store.log.generation])
+        self.assertGreater(store.log.generation, 0)
+        store.add('after the snapshot')
+        values = store.values()
+
+        store = self.reopen(store)
+        self.assertEqual(store.values(), values)
+        self.assertEqual(store.count(True), 2)
+
+    def test_snapshot_does_not_block_mutations(self):
+        writing = threading.Event()
+        release = threading.Event()
+        write = todo_log.write_snapshot
+        writers = []
+
+        def slow_write_snapshot(*args):
+            writers.append(threading.current_thread())
+            writing.set()
+            release.wait(5)
+            write(*args)
+
+        with mock.patch.object(todo_log, 'write_snapshot', slow_write_snapshot):
+            store = self.open_store(snapshot_interval=2)
+            store.add('a')
+            store.add('b')
+            self.assertTrue(writing.wait(5))
+            # the snapshot is being written while the store takes more mutations
+            store.add('c')
+            store.toggle('1')
+            release.set()
+            wait_for(lambda: store.log.generations == [store.log.generation])
+        self.assertNotIn(threading.current_thread(), writers)
+        values = store.values()
+        self.assertEqual(self.reopen(store).values(), values)
+
+    def test_torn_entry_is_truncated(self):
+        store = self.open_store()
+        self.mutate(store)
+        values = store.values()
+        log_path = store.log.log_path(store.log.generation)
+        store.close()
+        self.stores.remove(store)
+        size = os.path.getsize(log_path)
+        with open(log_path, 'ab') as f:
+            f.write(b'{"op": "add", "id": "4", "te')
+
+        store = self.open_store()
+        self.assertEqual(store.values(), values)
+        self.assertEqual(os.path.getsize(log_path), size)
+        store.add('after the crash')
+        store = self.reopen(store)
+        self.assertEqual(store.get('4').text, 'after the crash')
+
+    def test_invalid_entry_is_truncated(self):
+        store = self.open_store()
+        store.add('kept')
+        log_path = store.log.log_path(store.log.generation)
+        store = self.reopen(store)
+        with open(log_path, 'ab') as f:
+            f.write(b'not json\n{"op": "add", "id": "2", "text": "lost", "completed": false}\n')
+        store = self.reopen(store)
+        self.assertEqual([t.text for t in store.values()], ['kept'])
+
+    def test_fsync_always(self):
+        store = self.open_store(fsync='always')
+        store.add('a')
+        store.add('b')
+        self.assertGreaterEqual(store.log.fsyncs, 2)
+
+    def test_unknown_fsync_policy(self):
+        with self.assertRaises(ValueError):
+            TodoLog(self.data_dir, fsync='sometimes')
+
+    def test_snapshot_file(self):
+        path = os.path.join(self.data_dir, 'snapshot')
+        write_snapshot(path, 3, [u'a', None, u'café'], bytearray([1, 0, 0]),
+                       bytearray([0, 1, 0]))
+        self.assertEqual(read_snapshot(path),
+                         (3, [u'a', None, u'café'], bytearray([1, 0, 0]), bytearray([0, 1, 0])))
+        with open(path, 'r+b') as f:
+            f.write(b'NOTASNAP')
+        with self.assertRaises(ValueError):
+            read_snapshot(path)
+
+
+def add_todos(data_dir, name, number):
+    store = SharedTodoStore(data_dir, fsync='never')
+    for i in range(number):
+        store.add('{0} {1}'.format(name, i))
+    store.close()
+
+
+class SharedTodoStoreTest(TodoLogTest):
+
+    def open_store(self, **kwargs):
+        kwargs.setdefault('fsync', 'never')
+        store = SharedTodoStore(self.data_dir, **kwargs)
+        self.stores.append(store)
+        return store
+
+    def test_processes_see_each_other(self):
+        first, second = self.open_store(), self.open_store()
+        first.add('buy milk')
+        self.assertEqual(second.get('1').text, 'buy milk')
+        self.assertEqual(second.add('buy eggs').id, '2')
+        self.assertEqual(first.toggle('2').completed, True)
+        self.assertEqual([t.id for t in second.values(completed=True)], ['2'])
+        second.remove('1')
+        self.assertNotIn('1', first)
+        self.assertEqual((len(first), first.count(False)), (1, 0))
+        self.assertEqual(first.page(text_prefix='buy').total, 1)
+
+    def test_version_changes_with_the_other_processes(self):
+        first, second = self.open_store(), self.open_store()
+        first.refresh()
+        version = first.version
+        second.add('a')
+        first.refresh()
+        self.assertGreater(first.version, version)
+
+    def test_follows_rotations(self):
+        first, second = self.open_store(snapshot_interval=3), self.open_store()
+        for i in range(10):
+            first.add(str(i))
+            self.assertEqual(len(second), i + 1)
+        wait_for(lambda: first.log.generation > 0 and
+                 first.log.generations == [first.log.generation])
+        # the other process writes to the new generation
+        self.assertEqual(second.add('next').id, '11')
+        self.assertEqual(second.log.generation, first.log.generation)
+        self.assertEqual(first.get('11').text, 'next')
+
+    def test_reloads_a_removed_generation(self):
+        first, second = self.open_store(snapshot_interval=2), self.open_store()
+        second.refresh()
+        for i in range(8):
+            first.add(str(i))
+        wait_for(lambda: first.log.generation > 1 and
+                 first.log.generations == [first.log.generation])
+        # second missed the generations removed after the snapshots
+        with self.assertLogs('tornado.application', 'INFO') as logs:
+            self.assertEqual([t.text for t in second.values()], [str(i) for i in range(8)])
+        self.assertIn('reloading', logs.output[0])
+        self.assertEqual(second.add('next').id, '9')
+        self.assertEqual(len(first), 9)
+
+    def test_torn_entry_of_another_process(self):
+        first, second = self.open_store(), self.open_store()
+        first.add('kept')
+        with open(first.log.log_path(first.log.generation), 'ab') as f:
+            f.write(b'{"op": "add", "id": "2", "te')
+        self.assertEqual(len(second), 1)
+        self.assertEqual(second.add('next').id, '2')
+        self.assertEqual(first.get('2').text, 'next')
+
+    def test_concurrent_processes(self):
+        self.open_store().close()
+        procs = [Process(target=add_todos, args=(self.data_dir, name, 50))
+                 for name in ['a', 'b', 'c']]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+            self.assertEqual(proc.exitcode, 0)
+
+        store = self.open_store()
+        texts = [t.text for t in store.values()]
+        self.assertEqual(sorted(texts), sorted('{0} {1}'.format(name, i)
+                                               for name in 'abc' for i in range(50)))
+        # each process added its todos in order
+        for name in 'abc':
+            self.assertEqual([t for t in texts if t.startswith(name)],
+                             ['{0} {1}'.format(name, i) for i in range(50)])
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import random
+import unittest
+from unittest import mock
+from tornado_graphql_example import todo_store
+from tornado_graphql_example.todo_store import PREFIX_SPLIT_SIZE, TodoRecord, TodoStore
+
+
+def reference_page(todos, completed=None, text_prefix=None, after=None, before=None,
+                   first=None, last=None):
+    """Return the ids, has_previous, has_next and total of a page by brute force
+
+    ``todos`` maps the ids of the live todos to ``(text, completed)``.
+    """
+    matching = [todo_id for todo_id, (text, done) in sorted(todos.items())
+                if (completed is None or done == completed) and
+                (not text_prefix or text.startswith(text_prefix))]
+    ids = [i for i in matching
+           if (after is None or i > int(after)) and (before is None or i < int(before))]
+    if first is not None:
+        ids = ids[:max(first, 0)]
+    if last is not None:
+        ids = ids[max(len(ids) - max(last, 0), 0):]
+    if not ids:
+        return ids, None, None, len(matching)
+    return (ids, any(i < ids[0] for i in matching), any(i > ids[-1] for i in matching),
+            len(matching))
+
+
+class TodoStoreTest(unittest.TestCase):
+
+    def test_add_and_get(self):
+        store = TodoStore([('first', False)])
+        todo = store.add('second', completed=True)
+        self.assertEqual(todo, TodoRecord('2', 'second', True))
+        self.assertEqual(store.get('2'), todo)
+        self.assertEqual(len(store), 2)
+        self.assertIn('1', store)
+        for todo_id in ['3', '0', 'x', None]:
+            self.assertNotIn(todo_id, store)
+        with self.assertRaises(KeyError):
+            store.get('3')
+
+    def test_version(self):
+        store = TodoStore()
+        versions = [store.version]
+        store.add('a')
+        versions.append(store.version)
+        store.toggle('1')
+        versions.append(store.version)
+        store.set_completed('1', True)
+        versions.append(store.version)
+        store.remove('1')
+        versions.append(store.version)
+        self.assertEqual(versions, [0, 1, 2, 2, 3])
+        self.assertNotEqual(TodoStore().epoch, store.epoch)
+
+    def test_toggle_across_filters(self):
+        store = TodoStore([('buy milk', False), ('buy eggs', False), ('sell car', True)])
+        self.assertEqual((store.count(True), store.count(False)), (1, 2))
+
+        self.assertTrue(store.toggle('1').completed)
+        self.assertEqual((store.count(True), store.count(False)), (2, 1))
+        self.assertEqual([t.id for t in store.values(completed=True)], ['1', '3'])
+        self.assertEqual([t.id for t in store.values(completed=False)], ['2'])
+        self.assertEqual(store.page(completed=True, text_prefix='buy').total, 1)
+        self.assertEqual(store.page(completed=False, text_prefix='buy').total, 1)
+
+        self.assertFalse(store.toggle('1').completed)
+        self.assertEqual([t.id for t in store.values(completed=False)], ['1', '2'])
+        self.assertEqual(store.page(completed=True, text_prefix='buy').total, 0)
+
+    def test_remove(self):
+        store = TodoStore([('buy milk', True), ('buy eggs', False), ('sell car', False)])
+        store.remove('1')
+        self.assertNotIn('1', store)
+        self.assertEqual(len(store), 2)
+        self.assertEqual((store.count(True), store.count(False)), (0, 2))
+        self.assertEqual([t.id for t in store.values()], ['2', '3'])
+        page = store.page(text_prefix='buy')
+        self.assertEqual(([t.id for t in page.todos], page.total), (['2'], 1))
+        with self.assertRaises(KeyError):
+            store.remove('1')
+        with self.assertRaises(KeyError):
+            store.toggle('1')
+        # ids are never reused
+        self.assertEqual(store.add('buy tea').id, '4')
+
+    def test_page_boundaries(self):
+        store = TodoStore(('todo {0}'.format(i), i % 2 == 0) for i in range(10))
+
+        page = store.page(first=3)
+        self.assertEqual([t.id for t in page.todos], ['1', '2', '3'])
+        self.assertEqual((page.has_previous, page.has_next, page.total), (False, True, 10))
+
+        page = store.page(after='3', first=3)
+        self.assertEqual([t.id for t in page.todos], ['4', '5', '6'])
+        self.assertEqual((page.has_previous, page.has_next), (True, True))
+
+        page = store.page(last=3)
+        self.assertEqual([t.id for t in page.todos], ['8', '9', '10'])
+        self.assertEqual((page.has_previous, page.has_next), (True, False))
+
+        page = store.page(before='8', last=2)
+        self.assertEqual([t.id for t in page.todos], ['6', '7'])
+
+        page = store.page(after='2', before='6')
+        self.assertEqual([t.id for t in page.todos], ['3', '4', '5'])
+
+        page = store.page(after='2', before='6', first=2, last=1)
+        self.assertEqual([t.id for t in page.todos], ['4'])
+
+        self.assertEqual(store.page(first=0).todos, [])
+        self.assertEqual(store.page(after='10', first=3).todos, [])
+        self.assertEqual(store.page(after='100').todos, [])
+        self.assertEqual(store.page(before='1').todos, [])
+
+        page = store.page(completed=True, after='1', first=2)
+        self.assertEqual([t.id for t in page.todos], ['3', '5'])
+        self.assertEqual((page.has_previous, page.total), (True, 5))
+
+    def test_page_after_the_end_has_no_next(self):
+        store = TodoStore([('a', False), ('b', False)])
+        page = store.page(after='2', first=1)
+        self.assertEqual((page.todos, page.has_next), ([], False))
+        self.assertTrue(page.has_previous)
+
+    def test_text_prefix(self):
+        store = TodoStore([('buy milk', False), ('buy eggs', True), ('Buy tea', False)])
+        self.assertEqual([t.id for t in store.page(text_prefix='buy').todos], ['1', '2'])
+        self.assertEqual([t.id for t in store.page(text_prefix='buy m').todos], ['1'])
+        self.assertEqual(store.page(text_prefix='buy milk and').todos, [])
+        self.assertEqual(store.page(text_prefix='x').total, 0)
+        self.assertEqual(store.page(text_prefix='').total, 3)
+
+    def test_split_threshold(self):
+        size = PREFIX_SPLIT_SIZE
+        store = TodoStore(('ab{0}'.format(i % 3), False) for i in range(size))
+        self.assertEqual(len(store._prefixes['a'][0]), size)
+        self.assertNotIn('ab', store._prefixes)
+
+        store.add('ac')
+        # one more than PREFIX_SPLIT_SIZE splits the node one character deeper
+        self.assertEqual(len(store._prefixes['ab'][0]), size)
+        self.assertEqual(len(store._prefixes['ac'][0]), 1)
+        self.assertEqual(store.page(text_prefix='ab').total, size)
+        self.assertEqual(store.page(text_prefix='ab1').total, len(range(1, size, 3)))
+        self.assertEqual([t.text for t in store.page(text_prefix='ac').todos], ['ac'])
+
+        store.add('ab1')
+        self.assertIn('ab1', store._prefixes)
+        self.assertEqual(store.page(text_prefix='ab1').total, len(range(1, size, 3)) + 1)
+
+    def test_no_match_under_a_split_node_scans_nothing(self):
+        store = TodoStore(('a{0}'.format(i % 2), False) for i in range(PREFIX_SPLIT_SIZE + 1))
+        size = len(store._completed)
+        with mock.patch.object(store, '_texts', None):
+            # the texts are not looked at
+            forward, _ = store._scanners(None, 'az')
+            self.assertEqual(list(forward(0, size)), [])
+        self.assertEqual(store.page(text_prefix='az').total, 0)
+        self.assertEqual(store.page(text_prefix='a2x').total, 0)
+
+    def test_against_reference(self):
+        for split_size in [1, 2, 5, PREFIX_SPLIT_SIZE]:
+            with mock.patch.object(todo_store, 'PREFIX_SPLIT_SIZE', split_size):
+                self.check_against_reference(random.Random(split_size))
+
+    def check_against_reference(self, rand):
+        store = TodoStore()
+        todos = {}
+        words = ['a', 'ab', 'abc', 'b', 'ba', 'bab', 'c']
+        for _ in range(300):
+            op = rand.random()
+            if op < 0.6 or not todos:
+                text = rand.choice(words) + rand.choice(words)
+                completed = rand.random() < 0.3
+                todos[int(store.add(text, completed).id)] = (text, completed)
+            elif op < 0.85:
+                todo_id = rand.choice(list(todos))
+                text, completed = todos[todo_id]
+                todos[todo_id] = (text, store.toggle(str(todo_id)).completed)
+                self.assertEqual(todos[todo_id][1], not completed)
+            else:
+                todo_id = rand.choice(list(todos))
+                store.remove(str(todo_id))
+                del todos[todo_id]
+
+            size = max(todos) + 2
+            kwargs = {
+                'completed': rand.choice([None, True, False]),
+                'text_prefix': rand.choice([None, 'a', 'ab', 'abc', 'b', 'bab', 'abab', 'x']),
+                'after': rand.choice([None, str(rand.randrange(0, size))]),
+                'before': rand.choice([None, str(rand.randrange(1, size))]),
+                rand.choice(['first', 'last']): rand.randrange(0, 6)
+            }
+            page = store.page(**kwargs)
+            ids, has_previous, has_next, total = reference_page(todos, **kwargs)
+            self.assertEqual([int(t.id) for t in page.todos], ids, kwargs)
+            self.assertEqual(page.total, total, kwargs)
+            if ids:
+                self.assertEqual((page.has_previous, page.has_next),
+                                 (has_previous, has_next), kwargs)
+            for todo in page.todos:
+                self.assertEqual((todo.text, todo.completed), todos[int(todo.id)])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import tempfile
+from tornado import testing
+from tornado_graphql_example.graphql import TRACE_HEADER
+from tornado_graphql_example.web_app import ExampleWebAPIApplication
+
+QUERY = 'query Todos { todoList(first: 2) { edges { node { id text } } } }'
+
+
+class TracingTest(testing.AsyncHTTPTestCase):
+
+    def setUp(self):
+        fd, self.trace_file = tempfile.mkstemp()
+        os.close(fd)
+        super(TracingTest, self).setUp()
+
+    def tearDown(self):
+        super(TracingTest, self).tearDown()
+        os.unlink(self.trace_file)
+
+    def get_app(self):
+        return ExampleWebAPIApplication({
+            'allow_origin': '*',
+            'allow_origin_pat': None,
+            'allow_credentials': True,
+            'tracing': True,
+            'tracing_sample_rate': 0.0,
+            'tracing_slow_threshold': 0.0,
+            'tracing_file': self.trace_file,
+            'admin_token': 'secret'
+        }, [])
+
+    def query(self, headers=None):
+        resp = self.fetch('/graphql', method='POST', headers=headers,
+                          body=json.dumps({'query': QUERY}))
+        self.assertEqual(resp.code, 200)
+        return json.loads(resp.body.decode('utf-8'))
+
+    def tracing_stats(self):
+        resp = self.fetch('/admin/tracing', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(resp.code, 200)
+        return json.loads(resp.body.decode('utf-8'))
+
+    def test_not_sampled(self):
+        body = self.query()
+        self.assertNotIn('tracing', body.get('extensions', {}))
+        self.assertEqual(self.tracing_stats()['traced_operations'], 0)
+
+    def test_forced_trace(self):
+        body = self.query({TRACE_HEADER: '1'})
+        tracing = body['extensions']['tracing']
+        self.assertEqual(tracing['version'], 1)
+        self.assertGreaterEqual(tracing['duration'], 0)
+        resolvers = tracing['execution']['resolvers']
+        paths = [tuple(r['path']) for r in resolvers]
+        self.assertEqual(paths[0], ('todoList',))
+        self.assertIn(('todoList', 'edges'), paths)
+        self.assertIn(('todoList', 'edges', 'node', 'text'), paths)
+        self.assertEqual(resolvers[0]['parentType'], 'Query')
+        self.assertEqual(resolvers[0]['returnType'], 'TodoList')
+        for resolver in resolvers:
+            self.assertLessEqual(resolver['startOffset'] + resolver['duration'],
+                                 tracing['duration'])
+
+        stats = self.tracing_stats()
+        self.assertEqual(stats['traced_operations'], 1)
+        fields = {f['field']: f for f in stats['slow_fields']}
+        self.assertEqual(fields['Query.todoList']['calls'], 1)
+        # every call is slow with a threshold of 0
+        self.assertEqual(fields['Query.todoList']['slow_calls'], 1)
+
+        with open(self.trace_file) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), len(resolvers))
+        self.assertTrue(lines[0].startswith('Todos;todoList '))
+
+    def test_admin_token(self):
+        self.assertEqual(self.fetch('/admin/tracing').code, 403)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import hmac
+from tornado import web
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class AdminHandler(web.RequestHandler):
+    """Base class of the operational endpoints
+
+    A request is allowed if it carries ``Authorization: Bearer <token>``
+    matching the ``admin_token`` setting. Without a token configured, only
+    requests from localhost are allowed.
+    """
+
+    def initialize(self, opts):
+        self.opts = opts
+
+    @property
+    def admin_token(self):
+        return self.opts.get('admin_token')
+
+    def prepare(self):
+        if self.admin_token:
+            auth = self.request.headers.get('Authorization', '')
+            scheme, _, token = auth.partition(' ')
+            if scheme.lower() != 'bearer' or \
+                    not hmac.compare_digest(token.strip(), self.admin_token):
+                raise web.HTTPError(403)
+        elif self.request.remote_ip not in LOCAL_ADDRESSES:
+            raise web.HTTPError(403)
@@ -2,23 +2,35 @@
 
 from __future__ import absolute_import, division, print_function
 
-from glob import glob
-import json
+import atexit
 import logging
 import os
 import re
+import shutil
+import signal
 import subprocess
 import sys
-from traitlets import Bool, Dict, Integer, Unicode
+import tempfile
+import time
+from traitlets import Bool, Dict, Enum, Float, Integer, TraitError, Unicode
 from traitlets.config.application import Application, catch_config_error
 from zmq.eventloop import ioloop
 
 ioloop.install()
 
 # tornado must be imported after `ioloop.install()`
+from tornado import gen  # noqa
 from tornado.log import LogFormatter, app_log, access_log, gen_log  # noqa
 from tornado.httpserver import HTTPServer  # noqa
+from tornado.netutil import bind_sockets  # noqa
 from .version import __version__  # noqa
+from .membership import JobServerMembership  # noqa
+from .prefork import fork_workers  # noqa
+from .pubsub_bus import PubSubBus  # noqa
+from .schema import pubsub, sample_todos, use_todo_store  # noqa
+from .scheduler import SCHEDULERS  # noqa
+from .graphql import BACKPRESSURE_POLICIES  # noqa
+from .todo_log import FSYNC_POLICIES, DurableTodoStore, SharedTodoStore  # noqa
 from .web_app import ExampleWebAPIApplication  # noqa
 from .jobserverapp import JobServerApp  # noqa
 
@@ -33,8 +45,28 @@ class TornadoGraphqlExampleApp(Application):
         'log-level': 'TornadoGraphqlExampleApp.log_level',
         'ip': 'TornadoGraphqlExampleApp.ip',
         'port': 'TornadoGraphqlExampleApp.port',
+        'workers': 'TornadoGraphqlExampleApp.workers',
+        'shutdown-timeout': 'TornadoGraphqlExampleApp.shutdown_timeout',
         'allow-origin': 'TornadoGraphqlExampleApp.allow_origin',
-        'allow-origin-pat': 'TornadoGraphqlExampleApp.allow_origin_pat'
+        'allow-origin-pat': 'TornadoGraphqlExampleApp.allow_origin_pat',
+        'document-cache-size': 'TornadoGraphqlExampleApp.document_cache_size',
+        'response-cache-size': 'TornadoGraphqlExampleApp.response_cache_size',
+        'persisted-queries-manifest': 'TornadoGraphqlExampleApp.persisted_queries_manifest',
+        'max-batch-size': 'TornadoGraphqlExampleApp.max_batch_size',
+        'executor-threads': 'TornadoGraphqlExampleApp.executor_threads',
+        'executor-queue-size': 'TornadoGraphqlExampleApp.executor_queue_size',
+        'data-dir': 'TornadoGraphqlExampleApp.data_dir',
+        'fsync': 'TornadoGraphqlExampleApp.fsync',
+        'scheduler': 'TornadoGraphqlExampleApp.scheduler',
+        'admin-token': 'TornadoGraphqlExampleApp.admin_token',
+        'pubsub-bus-ip': 'TornadoGraphqlExampleApp.pubsub_bus_ip',
+        'websocket-max-buffer-size': 'TornadoGraphqlExampleApp.websocket_max_buffer_size',
+        'websocket-backpressure': 'TornadoGraphqlExampleApp.websocket_backpressure',
+        'resolver-metrics': 'TornadoGraphqlExampleApp.resolver_metrics',
+        'tracing-sample-rate': 'TornadoGraphqlExampleApp.tracing_sample_rate',
+        'tracing-slow-threshold': 'TornadoGraphqlExampleApp.tracing_slow_threshold',
+        'tracing-file': 'TornadoGraphqlExampleApp.tracing_file',
+        'blocking-threshold': 'TornadoGraphqlExampleApp.blocking_threshold'
     }
 
     flags = {
@@ -45,6 +77,23 @@ class TornadoGraphqlExampleApp(Application):
         'disallow-credentials': (
             {'TornadoGraphqlExampleApp': {'allow_credentials': False}},
             'set Access-Control-Allow-Credentials'
+        ),
+        'pubsub-bus': (
+            {'TornadoGraphqlExampleApp': {'pubsub_bus': True}},
+            'share subscription events with the other web app processes'
+        ),
+        'tracing': (
+            {'TornadoGraphqlExampleApp': {'tracing': True}},
+            'trace the resolvers of a sample of the GraphQL operations'
+        ),
+        'persisted-queries': (
+            {'TornadoGraphqlExampleApp': {'persisted_queries': True}},
+            'accept persisted queries identified by SHA-256 hash'
+        ),
+        'persisted-queries-only': (
+            {'TornadoGraphqlExampleApp': {'persisted_queries': True,
+                                          'persisted_queries_only': True}},
+            'reject queries which are not registered in the persisted queries manifest'
         )
     }
 
@@ -107,6 +156,228 @@ class TornadoGraphqlExampleApp(Application):
         help='The port the server will listen on.'
     )
 
+    workers = Integer(
+        1, config=True,
+        help="""The number of worker processes sharing the listening socket
+
+        With more than one, the workers are pre-forked and restarted when
+        they die, and they share subscription events over the pub/sub bus.
+        They share the todos through the todo log in data_dir, or in a
+        temporary directory if it is empty.
+        """
+    )
+
+    def _workers_changed(self, name, old, new):
+        if new < 1:
+            raise TraitError('workers must be at least 1, not {0}'.format(new))
+
+    document_cache_size = Integer(
+        256, config=True,
+        help='The number of parsed and validated GraphQL documents to cache (0 to disable).'
+    )
+
+    response_cache_size = Integer(
+        256, config=True,
+        help='The number of responses to GET queries to cache (0 to disable).'
+    )
+
+    persisted_queries = Bool(
+        False, config=True,
+        help='Accept Apollo-style persisted queries (extensions.persistedQuery).'
+    )
+
+    persisted_queries_manifest = Unicode(
+        '', config=True,
+        help="""A JSON file of persisted queries to be loaded at startup
+
+        The file is either a list of queries or an object mapping
+        SHA-256 hashes to queries. Setting it enables persisted queries.
+        """
+    )
+
+    persisted_queries_only = Bool(
+        False, config=True,
+        help='Execute only the queries loaded from persisted_queries_manifest.'
+    )
+
+    max_batch_size = Integer(
+        10, config=True,
+        help='The maximum number of operations in a batched request (0 to disable batching).'
+    )
+
+    executor_threads = Integer(
+        0, config=True,
+        help="""The number of threads which execute GraphQL operations
+
+        0 executes operations on the IOLoop.
+        """
+    )
+
+    executor_queue_size = Integer(
+        100, config=True,
+        help="""The number of GraphQL operations which may wait for an executor thread
+
+        Requests beyond that are answered with 503.
+        """
+    )
+
+    data_dir = Unicode(
+        '', config=True,
+        help="""The directory where todos are persisted
+
+        Mutations are appended to a write-ahead log and compacted into
+        snapshots. Todos are kept in memory only if it is empty.
+        """
+    )
+
+    fsync = Enum(
+        FSYNC_POLICIES, 'interval', config=True,
+        help="""When the todo log is fsynced
+
+        'always' waits for the fsync on each mutation (concurrent mutations
+        share one), 'interval' fsyncs every fsync_interval seconds and
+        'never' leaves it to the OS.
+        """
+    )
+
+    fsync_interval = Float(
+        0.05, config=True,
+        help='The interval in seconds of the todo log fsync with fsync=interval.'
+    )
+
+    snapshot_interval = Integer(
+        100000, config=True,
+        help='The number of todo log entries after which a snapshot is taken.'
+    )
+
+    scheduler = Enum(
+        sorted(SCHEDULERS), 'least-outstanding', config=True,
+        help="""The policy which chooses the job server for a job
+
+        'round-robin', 'least-outstanding' jobs, 'power-of-two' random
+        choices, or 'weighted' by the capacity reported by the job servers.
+        """
+    )
+
+    job_server_poll_interval = Float(
+        2.0, config=True,
+        help='The interval in seconds of rescanning the job server info files.'
+    )
+
+    job_server_timeout = Float(
+        15.0, config=True,
+        help='Job servers whose heartbeat is older than this many seconds are dropped.'
+    )
+
+    job_server_heartbeat_interval = Float(
+        1.0, config=True,
+        help='The interval in seconds of pinging each job server.'
+    )
+
+    job_server_heartbeat_timeout = Float(
+        3.0, config=True,
+        help='A ping unanswered within this many seconds counts as a failure.'
+    )
+
+    job_server_failure_threshold = Integer(
+        3, config=True,
+        help='The number of consecutive failed pings which opens the circuit of a job server.'
+    )
+
+    job_max_retries = Integer(
+        1, config=True,
+        help='The number of times a job is retried on another server when its server fails.'
+    )
+
+    admin_token = Unicode(
+        '', config=True,
+        help='The bearer token required by /admin endpoints (localhost only if empty).'
+    )
+
+    websocket_max_buffer_size = Integer(
+        1024 * 1024, config=True,
+        help='The bytes queued to a WebSocket above which backpressure applies (0 for no limit).'
+    )
+
+    websocket_backpressure = Enum(
+        list(BACKPRESSURE_POLICIES), 'pause', config=True,
+        help="""What to do when a WebSocket client does not keep up
+
+        'drop-oldest' queued output, 'coalesce' queued output into batches,
+        or 'pause' the output of its jobs on the job servers until it drains.
+        """
+    )
+
+    resolver_metrics = Enum(
+        ['off', 'root', 'all'], 'root', config=True,
+        help="""Which resolvers /metrics times
+
+        'root' times the fields of the query and mutation types, 'all'
+        times every field, which costs more on large lists.
+        """
+    )
+
+    tracing = Bool(
+        False, config=True,
+        help="""Trace the resolvers of a sample of the GraphQL operations
+
+        A request with the X-GraphQL-Trace: 1 header is always traced and
+        gets the trace in ``extensions.tracing`` of its response.
+        """
+    )
+
+    tracing_sample_rate = Float(
+        0.01, config=True,
+        help='The share of the GraphQL operations traced with --tracing.'
+    )
+
+    tracing_slow_threshold = Float(
+        0.01, config=True,
+        help='The seconds a traced resolver takes to count as slow in /admin/tracing.'
+    )
+
+    tracing_file = Unicode(
+        '', config=True,
+        help='The file the traces are appended to in the collapsed stack format of flame graphs.'
+    )
+
+    blocking_threshold = Float(
+        0.0, config=True,
+        help='Log the stack when a callback blocks the IOLoop this many seconds (0 disables it).'
+    )
+
+    pubsub_bus = Bool(
+        False, config=True,
+        help="""Share subscription events with the other web app processes
+
+        The processes find each other in the runtime directory and are
+        connected by ZeroMQ PUB/SUB sockets.
+        """
+    )
+
+    pubsub_bus_ip = Unicode(
+        '127.0.0.1', config=True,
+        help='The IP address the pub/sub bus listens on.'
+    )
+
+    shutdown_timeout = Float(
+        10.0, config=True,
+        help="""The seconds given to running jobs and requests to finish on SIGTERM
+
+        Jobs still running after it are cancelled.
+        """
+    )
+
+    todo_store = None
+
+    bus = None
+
+    sockets = None
+
+    stopping = False
+
+    worker_id = None
+
     tornado_settings = Dict(
         config=True,
         help='tornado.web.Application settings.'
@@ -125,16 +396,78 @@ class TornadoGraphqlExampleApp(Application):
         logger.parent = self.log
         logger.setLevel(self.log.level)
 
+    def open_todo_store(self, store_class):
+        store = store_class(
+            self.data_dir,
+            fsync=self.fsync,
+            fsync_interval=self.fsync_interval,
+            snapshot_interval=self.snapshot_interval
+        )
+        if store.is_empty:
+            for text, completed in sample_todos:
+                store.add(text, completed)
+        return store
+
+    def init_todo_store(self):
+        if not self.data_dir:
+            return
+
+        self.todo_store = self.open_todo_store(
+            SharedTodoStore if self.workers > 1 else DurableTodoStore)
+        use_todo_store(self.todo_store)
+
     def init_webapp(self):
         self.tornado_settings['allow_origin'] = self.allow_origin
         if self.allow_origin_pat:
             self.tornado_settings['allow_origin_pat'] = re.compile(self.allow_origin_pat)
         self.tornado_settings['allow_credentials'] = self.allow_credentials
         self.tornado_settings['debug'] = self.log_level == logging.DEBUG
-
-        self.web_app = ExampleWebAPIApplication(self.tornado_settings, self.job_servers)
+        self.tornado_settings['document_cache_size'] = self.document_cache_size
+        self.tornado_settings['response_cache_size'] = self.response_cache_size
+        self.tornado_settings['persisted_queries'] = \
+            self.persisted_queries or bool(self.persisted_queries_manifest)
+        self.tornado_settings['persisted_queries_manifest'] = self.persisted_queries_manifest
+        self.tornado_settings['persisted_queries_only'] = self.persisted_queries_only
+        self.tornado_settings['max_batch_size'] = self.max_batch_size
+        self.tornado_settings['executor_threads'] = self.executor_threads
+        self.tornado_settings['executor_queue_size'] = self.executor_queue_size
+        self.tornado_settings['scheduler'] = self.scheduler
+        self.tornado_settings['job_server_heartbeat_interval'] = \
+            self.job_server_heartbeat_interval
+        self.tornado_settings['job_server_heartbeat_timeout'] = self.job_server_heartbeat_timeout
+        self.tornado_settings['job_server_failure_threshold'] = self.job_server_failure_threshold
+        self.tornado_settings['job_max_retries'] = self.job_max_retries
+        self.tornado_settings['admin_token'] = self.admin_token
+        self.tornado_settings['websocket_max_buffer_size'] = self.websocket_max_buffer_size
+        self.tornado_settings['websocket_backpressure'] = self.websocket_backpressure
+        self.tornado_settings['resolver_metrics'] = self.resolver_metrics
+        self.tornado_settings['tracing'] = self.tracing
+        self.tornado_settings['tracing_sample_rate'] = self.tracing_sample_rate
+        self.tornado_settings['tracing_slow_threshold'] = self.tracing_slow_threshold
+        self.tornado_settings['tracing_file'] = self.tracing_file
+        self.tornado_settings['blocking_threshold'] = self.blocking_threshold
+
+        self.web_app = ExampleWebAPIApplication(self.tornado_settings, [])
         self.http_server = HTTPServer(self.web_app)
-        self.http_server.listen(self.port, self.ip)
+        if self.sockets is not None:
+            self.http_server.add_sockets(self.sockets)
+        else:
+            self.http_server.listen(self.port, self.ip)
+
+        self.membership = JobServerMembership(
+            self.web_app.job_server_pool,
+            poll_interval=self.job_server_poll_interval,
+            timeout=self.job_server_timeout
+        )
+        self.membership.start()
+        self.web_app.job_server_pool.start()
+        if self.web_app.blocking_detector is not None:
+            self.web_app.blocking_detector.start()
+
+        if self.pubsub_bus or self.workers > 1:
+            self.bus = PubSubBus(pubsub, self.pubsub_bus_ip,
+                                 poll_interval=self.job_server_poll_interval)
+            self.bus.start()
 
     @catch_config_error
     def initialize(self, argv=None):
@@ -149,8 +482,28 @@ class TornadoGraphqlExampleApp(Application):
         super(TornadoGraphqlExampleApp, self).initialize(argv)
 
         self.init_logging()
+        self.init_workers()
+        self.init_todo_store()
         self.init_webapp()
 
+    def init_workers(self):
+        if self.workers <= 1:
+            return
+
+        if not self.data_dir:
+            self.data_dir = tempfile.mkdtemp(prefix='tornado-graphql-example-todos-')
+            atexit.register(remove_data_dir, os.getpid(), self.data_dir)
+        # the sample todos are added once, before the workers open the log
+        self.open_todo_store(SharedTodoStore).close()
+
+        # the workers share the listening socket, but each of them creates its own
+        # IOLoop, ZeroMQ context and job server connections after the fork
+        self.sockets = bind_sockets(self.port, self.ip)
+        self.log.info('listening on %s:%d with %d workers', self.ip, self.port, self.workers)
+        self.worker_id = fork_workers(self.workers)
+        self.log_format = (u'%(color)s[%(levelname)1.1s %(asctime)s.%(msecs).03d '
+                           u'%(name)s-{0}]%(end_color)s %(message)s').format(os.getpid())
+
     def start(self):
         super(TornadoGraphqlExampleApp, self).start()
 
@@ -163,29 +516,44 @@ class TornadoGraphqlExampleApp(Application):
                 return
 
         self.io_loop = ioloop.IOLoop.current()
+        signal.signal(signal.SIGTERM, self._signal_stop)
         try:
             self.io_loop.start()
         except KeyboardInterrupt:
             self.log.info('TornadoGraphqlExampleApp interrupted...')
+        finally:
+            self.membership.stop()
+            if self.bus is not None:
+                self.bus.stop()
+            self.web_app.close()
+            if self.todo_store is not None:
+                self.todo_store.close()
+
+    def _signal_stop(self, signum, frame):
+        self.log.info('received signal %d, stopping', signum)
+        self.io_loop.add_callback_from_signal(self.stop)
 
     def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+
+        @gen.coroutine
         def _stop():
+            started = time.time()
+            self.log.info('draining (timeout %.1fs)', self.shutdown_timeout)
             self.http_server.stop()
+            yield self.web_app.drain(self.shutdown_timeout)
+            yield self.http_server.close_all_connections()
+            self.log.info('drained in %.3fs', time.time() - started)
             self.io_loop.stop()
         self.io_loop.add_callback(_stop)
 
-    @property
-    def job_servers(self):
-        env = os.environ
-        xdg = env.get('XDG_RUNTIME_DIR', os.path.join(env.get('HOME'), '.config'))
-        appdir = os.path.join(xdg, 'tornado-graphql-example')
-
-        def server_info(file_path):
-            app_log.debug('read server_info: %s', file_path)
-            with open(file_path, 'r') as f:
-                return json.load(f)
 
-        return [server_info(f) for f in glob('{0}/jobserver-*'.format(appdir))]
+def remove_data_dir(pid, data_dir):
+    # the workers inherit the handler, but the directory is the parent's
+    if os.getpid() == pid:
+        shutil.rmtree(data_dir, ignore_errors=True)
 
 
 main = launch_new_instance = TornadoGraphqlExampleApp.launch_instance
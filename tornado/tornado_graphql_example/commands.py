@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from tornado import gen
+
+COMMANDS = {}
+
+
+def register_command(name):
+    """Register a coroutine as the in-process implementation of a command
+
+    The coroutine is called with ``write`` and the request dict, and calls
+    ``write(line)`` for each line of output as the external command would
+    print to stdout. ``write()`` returns a Future to yield, which waits
+    while the requester has paused the output.
+    """
+    def decorator(func):
+        COMMANDS[name] = func
+        return func
+    return decorator
+
+
+@register_command('countdown')
+@gen.coroutine
+def countdown(write, request):
+    """Same as the ``countdown`` script: print ``count`` down to 0 every ``interval`` seconds"""
+    interval = request.get('interval', 1)
+    count = int(request.get('count', 5))
+    yield write(str(count))
+    for i in range(1, count + 1):
+        yield gen.sleep(interval)
+        yield write(str(count - i))
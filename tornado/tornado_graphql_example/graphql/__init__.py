@@ -2,5 +2,11 @@
 
 from __future__ import absolute_import, division, print_function
 
+from .document_cache import DocumentCache  # noqa
+from .executor import BoundedExecutor  # noqa
 from .graphql_handler import GraphQLHandler  # noqa
-from .subscription_handler import GraphQLSubscriptionHandler  # noqa
+from .middleware import ResolverTimingMiddleware  # noqa
+from .persisted_queries import PersistedQueryRegistry  # noqa
+from .response_cache import ResponseCache, response_etag  # noqa
+from .subscription_handler import BACKPRESSURE_POLICIES, GraphQLSubscriptionHandler  # noqa
+from .tracing import TRACE_HEADER, Tracer, TracingMiddleware  # noqa
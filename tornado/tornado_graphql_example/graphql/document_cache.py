@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+from graphql.language.parser import parse
+from graphql.language.source import Source
+from graphql.validation import validate
+import threading
+
+
+class DocumentCache(object):
+    """Bounded LRU cache of parsed and validated GraphQL documents
+
+    Entries are keyed by ``(query, operation_name)`` and hold the parsed
+    document AST together with the list of validation errors, so a hit
+    skips both parsing and validation.
+    """
+
+    def __init__(self, schema, maxsize=256):
+        self.schema = schema
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query, operation_name=None):
+        """Return ``(document_ast, validation_errors)`` for the query
+
+        Raises GraphQLError if the query cannot be parsed. Parse failures
+        are not cached.
+        """
+        key = (query, operation_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        ast = parse(Source(query, 'GraphQL request'))
+        entry = (ast, validate(self.schema, ast))
+
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from tornado import web
+
+
+class BoundedExecutor(object):
+    """Thread pool which runs GraphQL operations off the IOLoop
+
+    At most ``max_workers`` operations run at once and at most
+    ``max_queue`` more wait for a worker. Submitting beyond that raises
+    HTTPError(503) so that the request is shed instead of queued.
+    """
+
+    def __init__(self, max_workers, max_queue=0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.rejected = 0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise web.HTTPError(503, 'GraphQL executor is saturated')
+            self.in_flight += 1
+
+        future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    @property
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'rejected': self.rejected
+        }
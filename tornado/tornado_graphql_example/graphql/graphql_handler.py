@@ -5,11 +5,19 @@ from __future__ import absolute_import, division, print_function
 from functools import wraps
 from graphql.error import GraphQLError
 from graphql.error import format_error as format_graphql_error
+from graphql.execution import ExecutionResult, execute
+from graphql.language.parser import parse
+from graphql.language.source import Source
+from graphql.utils.get_operation_ast import get_operation_ast
+from graphql.validation import validate
 import sys
-from tornado import web
-from tornado.escape import json_decode, json_encode
+import time
+from tornado import gen, web
 from tornado.log import app_log
 import traceback
+from .. import jsoncodec
+from .response_cache import response_etag
+from .tracing import TRACE_HEADER
 
 
 def error_status(exception):
@@ -35,15 +43,16 @@ def error_format(exception):
 
 def error_response(func):
     @wraps(func)
+    @gen.coroutine
     def wrapper(self, *args, **kwargs):
         try:
-            result = func(self, *args, **kwargs)
+            result = yield gen.maybe_future(func(self, *args, **kwargs))
         except Exception as ex:
             if not isinstance(ex, (web.HTTPError, ExecutionError, GraphQLError)):
                 tb = ''.join(traceback.format_exception(*sys.exc_info()))
                 app_log.error('Error: {0} {1}'.format(ex, tb))
             self.set_status(error_status(ex))
-            error_json = json_encode({'errors': error_format(ex)})
+            error_json = jsoncodec.dumps({'errors': error_format(ex)})
             app_log.debug('error_json: %s', error_json)
             self.write(error_json)
         else:
@@ -52,6 +61,16 @@ def error_response(func):
     return wrapper
 
 
+def operation_name_of(ast, operation_name=None):
+    """Return the name of the operation to run, from the request or the document"""
+    if operation_name or ast is None:
+        return operation_name
+    operation = get_operation_ast(ast)
+    if operation is None or operation.name is None:
+        return None
+    return operation.name.value
+
+
 class ExecutionError(Exception):
     def __init__(self, status_code=400, errors=None):
         self.status_code = status_code
@@ -64,12 +83,78 @@ class ExecutionError(Exception):
 
 class GraphQLHandler(web.RequestHandler):
 
+    @error_response
+    def get(self):
+        return self.handle_graphql_get()
+
     @error_response
     def post(self):
         return self.handle_graqhql()
 
+    @gen.coroutine
+    def handle_graphql_get(self):
+        """Run a query operation sent as URL parameters
+
+        If ``data_version`` is given, the response gets a strong ETag of the
+        request and that version. A request whose If-None-Match matches it
+        gets 304 Not Modified without running the operation, and otherwise
+        the response is served from ``response_cache`` while the version
+        stays the same.
+        """
+        graphql_req = self.graphql_request
+        query = self.request_query(graphql_req)
+        if not query:
+            raise ExecutionError(errors=['Must provide query string.'])
+        operation_name = graphql_req.get('operationName')
+        documents = {}
+        ast, validation_errors = self.get_document(query, operation_name, documents)
+        operation = None if validation_errors else get_operation_ast(ast, operation_name)
+        if operation is not None and operation.operation != 'query':
+            self.set_header('Allow', 'POST')
+            raise web.HTTPError(405, 'Only query operations can be sent with GET')
+
+        version = self.data_version
+        etag = None
+        if version is not None and not self.trace_requested:
+            variables = jsoncodec.dumps(graphql_req.get('variables') or {})
+            etag = response_etag(version, query, operation_name, variables)
+            self.set_header('Etag', etag)
+            self.set_header('Cache-Control', 'no-cache')
+            if self.check_etag_header():
+                self.set_status(304)
+                return
+            key = (query, operation_name, variables)
+            cache = self.response_cache
+            body = cache.get(key, version) if cache is not None else None
+            if body is not None:
+                self.write(body)
+                return
+
+        extensions = {}
+        # the query is resolved already, so a persisted query is looked up once
+        result = yield self.run_graphql(self.execute_graphql, graphql_req, documents,
+                                        extensions, query)
+        if result.invalid:
+            raise ExecutionError(errors=result.errors)
+
+        body = jsoncodec.dumps(self.graphql_response(result, extensions))
+        if etag is not None:
+            if result.errors or self.data_version != version:
+                # the data changed while the operation ran, or may have
+                self.clear_header('Etag')
+            elif cache is not None:
+                cache.put(key, version, body)
+        self.write(body)
+
+    @gen.coroutine
     def handle_graqhql(self):
-        result = self.execute_graphql()
+        graphql_req = self.graphql_request
+        if isinstance(graphql_req, list):
+            yield self.handle_graphql_batch(graphql_req)
+            return
+
+        extensions = {}
+        result = yield self.run_graphql(self.execute_graphql, graphql_req, None, extensions)
         app_log.debug('GraphQL result data: %s errors: %s invalid %s',
                       result.data, result.errors, result.invalid)
         if result and result.invalid:
@@ -77,23 +162,161 @@ class GraphQLHandler(web.RequestHandler):
             app_log.warn('GraphQL Error: %s', ex)
             raise ex
 
+        self.write(jsoncodec.dumps(self.graphql_response(result, extensions)))
+
+    @gen.coroutine
+    def handle_graphql_batch(self, graphql_reqs):
+        if len(graphql_reqs) > self.max_batch_size:
+            raise ExecutionError(errors=[
+                'Batch size {0} exceeds the maximum of {1}'.format(
+                    len(graphql_reqs), self.max_batch_size)
+            ])
+
+        responses = yield self.run_graphql(self.batch_responses, graphql_reqs)
+        self.write(jsoncodec.dumps(responses))
+
+    def batch_responses(self, graphql_reqs):
+        documents = {}
+        return [self.batch_response(graphql_req, documents)
+                for graphql_req in graphql_reqs]
+
+    def batch_response(self, graphql_req, documents):
+        extensions = {}
+        try:
+            if not isinstance(graphql_req, dict):
+                raise ExecutionError(errors=['Each batched operation must be an object'])
+            result = self.execute_graphql(graphql_req, documents, extensions)
+        except Exception as ex:
+            if not isinstance(ex, (web.HTTPError, ExecutionError, GraphQLError)):
+                tb = ''.join(traceback.format_exception(*sys.exc_info()))
+                app_log.error('Error: {0} {1}'.format(ex, tb))
+            return {'errors': error_format(ex)}
+
+        if result.invalid:
+            app_log.warn('GraphQL Error: %s', ExecutionError(errors=result.errors))
+            return {'errors': error_format(ExecutionError(errors=result.errors))}
+        return self.graphql_response(result, extensions)
+
+    def graphql_response(self, result, extensions=None):
+        """Return the response of an executed operation, with the errors
+        of the fields which resolved to null"""
         response = {'data': result.data}
-        self.write(json_encode(response))
+        if result.errors:
+            response['errors'] = [e for error in result.errors for e in error_format(error)]
+        if extensions:
+            response['extensions'] = extensions
+        return response
 
-    def execute_graphql(self):
-        graphql_req = self.graphql_request
+    def run_graphql(self, fn, *args):
+        """Run ``fn`` on the executor, or inline if there is none"""
+        if self.executor is None:
+            return gen.maybe_future(fn(*args))
+        return self.executor.submit(fn, *args)
+
+    def execute_graphql(self, graphql_req=None, documents=None, extensions=None, query=None):
+        """Run the operation of the request
+
+        ``query`` is the query text if the caller already resolved it with
+        ``request_query()``.
+        """
+        if graphql_req is None:
+            graphql_req = self.graphql_request
         app_log.debug('graphql request: %s', graphql_req)
-        return self.schema.execute(
-            graphql_req.get('query'),
-            variable_values=graphql_req.get('variables'),
-            operation_name=graphql_req.get('operationName'),
-            context_value=graphql_req.get('context'),
-            middleware=self.middleware
-        )
+        if query is None:
+            query = self.request_query(graphql_req)
+        if not query:
+            raise ExecutionError(errors=['Must provide query string.'])
+        operation_name = graphql_req.get('operationName')
+
+        trace = None
+        middleware = self.middleware
+        if self.tracer is not None:
+            trace = self.tracer.begin(force=self.trace_requested)
+            if trace is not None:
+                middleware = self.tracing_middleware
+        started = time.time()
+        ast = None
+        try:
+            ast, validation_errors = self.get_document(query, operation_name, documents)
+            if validation_errors:
+                result = ExecutionResult(errors=validation_errors, invalid=True)
+            else:
+                result = execute(
+                    self.schema,
+                    ast,
+                    context_value=graphql_req.get('context'),
+                    variable_values=graphql_req.get('variables') or {},
+                    operation_name=operation_name,
+                    middleware=middleware
+                )
+        except Exception as e:
+            result = ExecutionResult(errors=[e], invalid=True)
+        elapsed = time.time() - started
+        operation_name = operation_name_of(ast, operation_name)
+        if trace is not None:
+            self.tracer.end(trace, operation_name)
+            if trace.forced and extensions is not None:
+                extensions['tracing'] = trace.as_dict()
+        self.on_executed(ast, operation_name, result, elapsed)
+        return result
+
+    def request_query(self, graphql_req):
+        """Return the query text of a request, looking up persisted queries"""
+        query = graphql_req.get('query')
+        if self.persisted_queries is not None:
+            query = self.persisted_queries.resolve(query, graphql_req.get('extensions'))
+        return query
+
+    def on_executed(self, ast, operation_name, result, elapsed):
+        """Called after each operation with the seconds it took to parse,
+        validate and execute it
+
+        ``operation_name`` is taken from the document if the request has
+        none, and is None for an anonymous operation. ``ast`` is None if the
+        query could not be parsed.
+        """
+        pass
+
+    def get_document(self, query, operation_name, documents=None):
+        """Return ``(document_ast, validation_errors)`` for the query
+
+        ``documents`` memoizes the lookups shared by the operations of a
+        batch.
+        """
+        key = (query, operation_name)
+        if documents is not None and key in documents:
+            return documents[key]
+
+        if self.document_cache is not None:
+            document = self.document_cache.get(query, operation_name)
+        else:
+            ast = parse(Source(query, 'GraphQL request'))
+            document = (ast, validate(self.schema, ast))
+
+        if documents is not None:
+            documents[key] = document
+        return document
 
     @property
     def graphql_request(self):
-        return json_decode(self.request.body)
+        if self.request.method == 'GET':
+            return self.graphql_request_from_arguments()
+        return jsoncodec.loads(self.request.body)
+
+    def graphql_request_from_arguments(self):
+        """Return the request of a GET, whose variables and extensions are JSON"""
+        graphql_req = {
+            'query': self.get_query_argument('query', None),
+            'operationName': self.get_query_argument('operationName', None)
+        }
+        for name in ('variables', 'extensions'):
+            value = self.get_query_argument(name, None)
+            if value:
+                try:
+                    graphql_req[name] = jsoncodec.loads(value)
+                except ValueError:
+                    raise ExecutionError(errors=['{0} must be JSON'.format(name)])
+        return graphql_req
 
     @property
     def content_type(self):
@@ -107,6 +330,60 @@ class GraphQLHandler(web.RequestHandler):
     def middleware(self):
         return []
 
+    @property
+    def document_cache(self):
+        return None
+
+    @property
+    def data_version(self):
+        """A value which changes whenever the data read by queries changes
+
+        GET responses get an ETag and are cached only if it is not None.
+        """
+        return None
+
+    def compute_etag(self):
+        # the ETag is derived from data_version in handle_graphql_get, and a
+        # response without one must not get the ETag of its body instead
+        return None
+
+    @property
+    def response_cache(self):
+        """The ResponseCache of GET responses, used with ``data_version``"""
+        return None
+
+    @property
+    def tracer(self):
+        """The Tracer of the resolvers, used with its TracingMiddleware"""
+        return None
+
+    @property
+    def tracing_middleware(self):
+        """The middleware of the traced operations, including a
+        TracingMiddleware of ``tracer``
+
+        The other operations run with ``middleware`` only, so that tracing
+        costs nothing when they are not sampled.
+        """
+        return self.middleware
+
+    @property
+    def trace_requested(self):
+        """Whether the client asked for the trace in ``extensions.tracing``"""
+        return self.request.headers.get(TRACE_HEADER, '0') not in ('', '0')
+
+    @property
+    def max_batch_size(self):
+        return 0
+
+    @property
+    def executor(self):
+        return None
+
+    @property
+    def persisted_queries(self):
+        return None
+
     @property
     def context(self):
         return None
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import time
+
+
+def field_path(info):
+    return '{0}.{1}'.format(info.parent_type.name, info.field_name)
+
+
+def is_root_field(info):
+    schema = info.schema
+    return info.parent_type in (schema.get_query_type(), schema.get_mutation_type(),
+                                schema.get_subscription_type())
+
+
+class ResolverTimingMiddleware(object):
+    """GraphQL middleware which times the resolvers
+
+    ``observe(field, seconds)`` is called after each resolver with the
+    field as ``Type.field``. With ``root_only``, only the fields of the
+    root types are timed; their resolvers are where the operations do
+    their work, while timing every field of every object in a list adds
+    up.
+    """
+
+    def __init__(self, observe, root_only=True):
+        self.observe = observe
+        self.root_only = root_only
+
+    def resolve(self, next, root, args, context, info):
+        if self.root_only and not is_root_field(info):
+            return next(root, args, context, info)
+        started = time.time()
+        try:
+            return next(root, args, context, info)
+        finally:
+            self.observe(field_path(info), time.time() - started)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import hashlib
+import json
+from tornado.log import app_log
+from .graphql_handler import ExecutionError
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class PersistedQueryRegistry(object):
+    """Registry of persisted queries looked up by SHA-256 hash
+
+    Implements the Apollo ``extensions.persistedQuery`` protocol. A request
+    may carry only the hash of a registered query. Unknown hashes are
+    answered with ``PersistedQueryNotFound`` so that the client retries with
+    the full query, which is then registered automatically.
+
+    If ``allowlist_only`` is set, only the queries loaded from a manifest
+    are executed and anything else is rejected before it is parsed.
+    """
+
+    def __init__(self, allowlist_only=False, max_entries=10000):
+        self.allowlist_only = allowlist_only
+        self.max_entries = max_entries
+        self._queries = {}
+
+    def __len__(self):
+        return len(self._queries)
+
+    def __contains__(self, sha256_hash):
+        return sha256_hash in self._queries
+
+    def get(self, sha256_hash):
+        return self._queries.get(sha256_hash)
+
+    def register(self, query):
+        sha256_hash = query_hash(query)
+        self._queries[sha256_hash] = query
+        return sha256_hash
+
+    def load_manifest(self, path):
+        """Load queries from a JSON manifest
+
+        The manifest is either a list of query strings or an object which
+        maps SHA-256 hashes to query strings.
+        """
+        with open(path, 'r') as f:
+            manifest = json.load(f)
+
+        if isinstance(manifest, dict):
+            for sha256_hash, query in manifest.items():
+                if query_hash(query) != sha256_hash:
+                    raise ValueError(
+                        'hash mismatch in {0}: {1}'.format(path, sha256_hash))
+                self._queries[sha256_hash] = query
+        else:
+            for query in manifest:
+                self.register(query)
+        app_log.info('persisted queries: %d loaded from %s', len(manifest), path)
+
+    def resolve(self, query, extensions):
+        """Return the query text for a request
+
+        Raises ExecutionError if the hash is unknown or does not match the
+        query, or if the query is not allowed.
+        """
+        persisted = (extensions or {}).get('persistedQuery')
+        if persisted is None:
+            if self.allowlist_only:
+                if query is None or query_hash(query) not in self._queries:
+                    raise ExecutionError(errors=['PersistedQueryNotAllowed'])
+            return query
+
+        sha256_hash = persisted.get('sha256Hash')
+        if persisted.get('version', 1) != 1 or not sha256_hash:
+            raise ExecutionError(errors=['PersistedQueryNotSupported'])
+
+        registered = self._queries.get(sha256_hash)
+        if registered is not None:
+            return registered
+
+        if self.allowlist_only:
+            raise ExecutionError(errors=['PersistedQueryNotAllowed'])
+        if query is None:
+            raise ExecutionError(errors=['PersistedQueryNotFound'])
+        if query_hash(query) != sha256_hash:
+            raise ExecutionError(errors=['provided sha does not match query'])
+
+        if len(self._queries) < self.max_entries:
+            self._queries[sha256_hash] = query
+        return query
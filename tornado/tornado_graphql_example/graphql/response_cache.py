@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+from hashlib import sha1
+import threading
+
+
+def response_etag(version, query, operation_name, variables):
+    """Return a strong ETag of the response to a read-only operation
+
+    The response depends only on the request and the data, so the ETag is
+    derived from them without executing the operation.
+    """
+    digest = sha1()
+    for part in (version, query, operation_name, variables):
+        digest.update(repr(part).encode('utf-8'))
+        digest.update(b'\0')
+    return '"{0}"'.format(digest.hexdigest())
+
+
+class ResponseCache(object):
+    """Bounded LRU cache of encoded responses of read-only GraphQL operations
+
+    Entries are keyed by ``(query, operation_name, variables)`` and hold
+    the JSON response for one version of the data. Only the entries of the
+    latest version are kept: a lookup or a store with a newer version
+    clears the cache, so a mutation bumping the version invalidates it.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _use_version(self, version):
+        if version != self.version:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self.version = version
+
+    def get(self, key, version):
+        """Return the cached response for ``key`` at ``version``, or None"""
+        with self._lock:
+            self._use_version(version)
+            body = self._entries.get(key)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return body
+
+    def put(self, key, version, body):
+        """Cache the response, unless the data changed since ``version``"""
+        with self._lock:
+            if version != self.version:
+                return
+            self._entries[key] = body
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }
@@ -2,14 +2,41 @@
 
 from __future__ import absolute_import, division, print_function
 
+from collections import deque
 from graphql import parse as graphql_parse
 from graphql.utils.get_operation_ast import get_operation_ast
-from tornado import websocket
-from tornado.escape import json_decode, json_encode
+from tornado import gen, ioloop, websocket
 from tornado.log import app_log
+from .. import jsoncodec
+
+
+BACKPRESSURE_POLICIES = ('drop-oldest', 'coalesce', 'pause')
 
 
 class GraphQLSubscriptionHandler(websocket.WebSocketHandler):
+    """GraphQL subscriptions over a WebSocket
+
+    Messages to the client go through a send queue which writes one frame
+    at a time. When the queued bytes exceed ``max_buffer_size``, the
+    ``backpressure_policy`` applies:
+
+    * ``drop-oldest`` drops the oldest droppable messages in the queue
+    * ``coalesce`` merges consecutive data of the same subscription with
+      ``coalesce()``
+    * ``pause`` calls ``pause_upstream()`` to hold back the sources of this
+      socket only, and ``resume_upstream()`` once the queue drains below
+      half of ``max_buffer_size``
+    """
+
+    def initialize(self):
+        super(GraphQLSubscriptionHandler, self).initialize()
+
+        self.send_queue = deque()
+        self.buffered_bytes = 0
+        self.dropped = 0
+        self.paused = False
+        self.draining = False
+        self._writing = False
 
     @property
     def schema(self):
@@ -27,6 +54,20 @@ class GraphQLSubscriptionHandler(websocket.WebSocketHandler):
     def subscriptions(self, subscriptions):
         raise NotImplementedError('subscriptions() must be implemented')
 
+    @property
+    def pubsub(self):
+        """The PubSub which subscriptions are registered to by their root fields"""
+        return None
+
+    @property
+    def max_buffer_size(self):
+        """The high-water mark of the send queue in bytes, or 0 for no limit"""
+        return 0
+
+    @property
+    def backpressure_policy(self):
+        return 'pause'
+
     def select_subprotocol(self, subprotocols):
         return 'graphql-subscriptions'
 
@@ -39,9 +80,16 @@ class GraphQLSubscriptionHandler(websocket.WebSocketHandler):
         app_log.info('close socket %s', self)
         self.sockets.remove(self)
         self.subscriptions = {}
+        if self.pubsub is not None:
+            self.pubsub.unsubscribe_all(self)
+        self.send_queue.clear()
+        self.buffered_bytes = 0
+        if self.paused:
+            self.paused = False
+            self.resume_upstream()
 
     def on_message(self, message):
-        data = json_decode(message)
+        data = jsoncodec.loads(message)
         subid = data.get('id')
         if data.get('type') == 'subscription_start':
             self.on_subscribe(subid, data)
@@ -51,25 +99,203 @@ class GraphQLSubscriptionHandler(websocket.WebSocketHandler):
             raise ValueError('Invalid type: {0}'.format(data.get('type')))
 
     def on_subscribe(self, subid, data):
+        """Register a subscription; return False if it is refused"""
+        if self.draining:
+            self.send({
+                'type': 'subscription_fail',
+                'id': subid,
+                'payload': {
+                    'errors': [{'message': 'server is shutting down'}]
+                }
+            })
+            return False
         query = data.get('query')
-        op_name = self._get_op_name(query)
+        ast = get_operation_ast(graphql_parse(query))
+        op_name = ast.name.value
         app_log.info('subscrption start: subid=%s query=%s op_name=%s',
                      subid, query, op_name)
         if op_name in self.subscriptions:
             del self.subscriptions[op_name]
         self.subscriptions[op_name] = subid
+        if self.pubsub is not None:
+            for selection in ast.selection_set.selections:
+                self.pubsub.subscribe(selection.name.value, self, subid)
         app_log.debug('subscriptions: %s', self.subscriptions)
-        self.write_message(json_encode({
+        self.send({
             'type': 'subscription_success',
             'id': subid
-        }))
+        })
+        return True
 
     def on_unsubscribe(self, subid, data):
         app_log.info('subscrption end: subid=%s', subid)
         self.subscriptions = {n: s for n, s in self.subscriptions.items()
                               if s != subid}
+        if self.pubsub is not None:
+            for topic, subscribers in list(self.pubsub.topics.items()):
+                if subscribers.get(self) == subid:
+                    self.pubsub.unsubscribe(topic, self)
         app_log.debug('subscriptions: %s', self.subscriptions)
 
+    def send_data(self, subid, data, encoded_data=None):
+        """Send subscription data
+
+        ``encoded_data`` is ``data`` already encoded as JSON, which is put in
+        the frame as is, e.g. when the same data is sent to many sockets.
+        """
+        message = {
+            'type': 'subscription_data',
+            'id': subid,
+            'payload': {
+                'data': data
+            }
+        }
+        if encoded_data is None:
+            self.send(message)
+        else:
+            self.send(message, b''.join([
+                b'{"type":"subscription_data","id":', jsoncodec.dumps(subid),
+                b',"payload":{"data":', encoded_data, b'}}'
+            ]))
+
+    def send(self, message, frame=None):
+        """Queue a message to the client, optionally already encoded as ``frame``"""
+        if frame is None:
+            frame = jsoncodec.dumps(message)
+        self.send_queue.append((message, frame))
+        self.buffered_bytes += len(frame)
+        if self.max_buffer_size and self.buffered_bytes > self.max_buffer_size:
+            self.on_high_water()
+        self._write_next()
+
+    def _write_next(self):
+        while self.send_queue and not self._writing:
+            message, frame = self.send_queue.popleft()
+            try:
+                future = self.write_message(frame)
+            except websocket.WebSocketClosedError:
+                self.send_queue.clear()
+                self.buffered_bytes = 0
+                return
+            if future is None or future.done():
+                self._written(len(frame))
+            else:
+                self._writing = True
+                future.add_done_callback(lambda f, size=len(frame): self._on_written(size))
+
+    def _on_written(self, size):
+        self._writing = False
+        self._written(size)
+        self._write_next()
+
+    def _written(self, size):
+        self.buffered_bytes -= size
+        if self.paused and self.buffered_bytes <= self.max_buffer_size // 2:
+            app_log.info('resume upstream of socket %s', self)
+            self.paused = False
+            self.resume_upstream()
+
+    def on_high_water(self):
+        policy = self.backpressure_policy
+        if policy == 'drop-oldest':
+            self._drop_oldest()
+        elif policy == 'coalesce':
+            self._coalesce_queue()
+        elif policy == 'pause':
+            if not self.paused:
+                app_log.warning('pause upstream of socket %s: %d bytes buffered',
+                                self, self.buffered_bytes)
+                self.paused = True
+                self.pause_upstream()
+        else:
+            raise ValueError('Unknown backpressure policy: {0}'.format(policy))
+
+    def _drop_oldest(self):
+        kept = deque()
+        while self.send_queue and self.buffered_bytes > self.max_buffer_size:
+            message, frame = self.send_queue.popleft()
+            if self.droppable(message):
+                self.buffered_bytes -= len(frame)
+                self.dropped += 1
+            else:
+                kept.append((message, frame))
+        kept.extend(self.send_queue)
+        self.send_queue = kept
+
+    def _coalesce_queue(self):
+        queue = deque()
+        run = []
+
+        def flush_run():
+            if len(run) > 1:
+                data = self.coalesce([m['payload']['data'] for m, _ in run])
+                if data is not None:
+                    message = dict(run[-1][0], payload={'data': data})
+                    frame = jsoncodec.dumps(message)
+                    self.buffered_bytes += len(frame) - sum(len(f) for _, f in run)
+                    queue.append((message, frame))
+                    return
+            queue.extend(run)
+
+        for message, frame in self.send_queue:
+            if message.get('type') != 'subscription_data' or \
+                    (run and run[-1][0]['id'] != message['id']):
+                flush_run()
+                run = []
+            if message.get('type') == 'subscription_data':
+                run.append((message, frame))
+            else:
+                queue.append((message, frame))
+        flush_run()
+        self.send_queue = queue
+
+    def droppable(self, message):
+        """Whether a queued message may be dropped by the drop-oldest policy"""
+        return message.get('type') == 'subscription_data'
+
+    def coalesce(self, data_list):
+        """Merge the data of consecutive messages of a subscription into one
+
+        Return None if they cannot be merged.
+        """
+        return None
+
+    @gen.coroutine
+    def drain(self, deadline):
+        """Complete the subscriptions and close the socket by ``deadline``
+
+        ``drain_upstream()`` is given until the deadline to let the sources
+        of the subscriptions finish. Then the client is sent
+        ``subscription_end`` for each subscription and the socket is closed
+        once its send queue is flushed.
+        """
+        self.draining = True
+        yield gen.maybe_future(self.drain_upstream(deadline))
+        for subid in set(self.subscriptions.values()):
+            self.send({'type': 'subscription_end', 'id': subid})
+        io_loop = ioloop.IOLoop.current()
+        while (self.send_queue or self._writing) and io_loop.time() < deadline:
+            yield gen.sleep(0.05)
+        self.close(1001, 'server is shutting down')
+
+    def drain_upstream(self, deadline):
+        pass
+
+    def pause_upstream(self):
+        pass
+
+    def resume_upstream(self):
+        pass
+
+    @property
+    def stats(self):
+        return {
+            'buffered_bytes': self.buffered_bytes,
+            'queued_messages': len(self.send_queue),
+            'dropped_messages': self.dropped,
+            'paused': self.paused
+        }
+
     def _get_op_name(self, query):
         ast = get_operation_ast(graphql_parse(query))
         return ast.name.value
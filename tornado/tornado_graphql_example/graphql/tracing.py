@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from datetime import datetime
+from graphql.type.definition import get_named_type
+import random
+import threading
+import time
+
+TRACE_HEADER = 'X-GraphQL-Trace'
+
+
+def iso_time(timestamp):
+    return datetime.utcfromtimestamp(timestamp).isoformat() + 'Z'
+
+
+class Trace(object):
+    """Resolver timings of one GraphQL operation
+
+    graphql-core does not pass the path of a field to its resolver, so
+    the path is rebuilt from the order resolvers run in: depth first, a
+    field's children resolving after it. List indexes are left out.
+    """
+
+    def __init__(self, forced=False):
+        self.forced = forced
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.resolvers = []
+        self._stack = []
+
+    def enter(self, info):
+        parent_type = info.parent_type.name
+        while self._stack and self._stack[-1][1] != parent_type:
+            self._stack.pop()
+        return (self._stack[-1][0] if self._stack else ()) + (info.field_name,)
+
+    def exit(self, info, path, started, finished):
+        self._stack.append((path, get_named_type(info.return_type).name))
+        self.resolvers.append((path, info.parent_type.name, info.field_name,
+                               str(info.return_type), started - self.started,
+                               finished - started))
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def as_dict(self):
+        """Return the trace in the Apollo tracing format"""
+        return {
+            'version': 1,
+            'startTime': iso_time(self.start_time),
+            'endTime': iso_time(self.start_time + self.duration),
+            'duration': int(self.duration * 1e9),
+            'execution': {
+                'resolvers': [{
+                    'path': list(path),
+                    'parentType': parent_type,
+                    'fieldName': field_name,
+                    'returnType': return_type,
+                    'startOffset': int(offset * 1e9),
+                    'duration': int(duration * 1e9)
+                } for path, parent_type, field_name, return_type, offset, duration
+                    in self.resolvers]
+            }
+        }
+
+    def collapsed_stacks(self, operation_name):
+        """Yield the resolvers as lines of the collapsed stack format of
+        flame graph tools, in microseconds"""
+        for path, _, _, _, _, duration in self.resolvers:
+            yield '{0};{1} {2}\n'.format(operation_name, ';'.join(path),
+                                         int(duration * 1e6))
+
+
+class Tracer(object):
+    """Sample GraphQL operations and trace their resolvers
+
+    A ``sample_rate`` share of the operations is traced, and any operation
+    ``begin()`` is told to force. The resolver timings of the traced
+    operations are aggregated by field, counting the calls which took
+    ``slow_threshold`` seconds or more, and appended to ``trace_file`` in
+    the collapsed stack format if given.
+
+    Operations may run on several threads at once; the current trace is
+    kept per thread.
+    """
+
+    def __init__(self, sample_rate=0.01, slow_threshold=0.01, trace_file=None):
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.trace_file = trace_file
+        self.traced = 0
+        self.fields = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def begin(self, force=False):
+        """Start a trace of the operation about to run on this thread, if sampled"""
+        if not force and random.random() >= self.sample_rate:
+            return None
+        trace = self._local.trace = Trace(forced=force)
+        return trace
+
+    def end(self, trace, operation_name):
+        self._local.trace = None
+        trace.finish()
+        with self._lock:
+            self.traced += 1
+            for _, parent_type, field_name, _, _, duration in trace.resolvers:
+                key = '{0}.{1}'.format(parent_type, field_name)
+                field = self.fields.get(key)
+                if field is None:
+                    field = self.fields[key] = [0, 0.0, 0.0, 0]
+                field[0] += 1
+                field[1] += duration
+                field[2] = max(field[2], duration)
+                if duration >= self.slow_threshold:
+                    field[3] += 1
+            if self.trace_file:
+                with open(self.trace_file, 'a') as f:
+                    f.writelines(trace.collapsed_stacks(operation_name or 'anonymous'))
+
+    def slow_fields(self, limit=20):
+        """Return the aggregates of the fields which took the most time in total"""
+        with self._lock:
+            fields = sorted(self.fields.items(), key=lambda item: item[1][1], reverse=True)
+        return [{
+            'field': key,
+            'calls': count,
+            'total_ms': round(total * 1000, 3),
+            'mean_ms': round(total * 1000 / count, 3),
+            'max_ms': round(longest * 1000, 3),
+            'slow_calls': slow
+        } for key, (count, total, longest, slow) in fields[:limit]]
+
+    @property
+    def stats(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'traced_operations': self.traced,
+            'slow_fields': self.slow_fields()
+        }
+
+
+class TracingMiddleware(object):
+    """GraphQL middleware which records resolvers in the current trace of
+    a Tracer
+
+    It is meant to be given only to the operations the tracer samples;
+    without a trace it just calls the resolver.
+    """
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+
+    def resolve(self, next, root, args, context, info):
+        trace = self.tracer.current
+        if trace is None:
+            return next(root, args, context, info)
+        path = trace.enter(info)
+        started = time.perf_counter()
+        try:
+            return next(root, args, context, info)
+        finally:
+            trace.exit(info, path, started, time.perf_counter())
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import time
+
+
+class ServerHealth(object):
+    """Heartbeat statistics and circuit breaker state of a job server
+
+    RTT and failure rate are exponentially weighted moving averages over
+    the heartbeats. The circuit opens after ``failure_threshold``
+    consecutive missed heartbeats, which stops routing jobs to the server,
+    and closes again on the next heartbeat answered in time.
+    """
+
+    def __init__(self, failure_threshold=3, alpha=0.2):
+        self.failure_threshold = failure_threshold
+        self.alpha = alpha
+        self.rtt = None
+        self.failure_rate = 0.0
+        self.consecutive_failures = 0
+        self.heartbeats = 0
+        self.failures = 0
+        self.last_seen = None
+        self.opened_at = None
+
+    @property
+    def state(self):
+        return 'open' if self.opened_at is not None else 'closed'
+
+    @property
+    def available(self):
+        return self.opened_at is None
+
+    def seen(self):
+        self.last_seen = time.time()
+
+    def success(self, rtt):
+        """Record an answered heartbeat; return True if the circuit closed"""
+        self.heartbeats += 1
+        self.consecutive_failures = 0
+        self.rtt = rtt if self.rtt is None else self.rtt + self.alpha * (rtt - self.rtt)
+        self.failure_rate += self.alpha * (0.0 - self.failure_rate)
+        self.seen()
+        if self.opened_at is not None:
+            self.opened_at = None
+            return True
+        return False
+
+    def failure(self):
+        """Record a missed heartbeat; return True if the circuit opened"""
+        self.heartbeats += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.failure_rate += self.alpha * (1.0 - self.failure_rate)
+        if self.opened_at is None and self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.time()
+            return True
+        return False
+
+    def as_dict(self):
+        now = time.time()
+        return {
+            'state': self.state,
+            'rtt_ms': None if self.rtt is None else round(self.rtt * 1000, 3),
+            'failure_rate': round(self.failure_rate, 4),
+            'consecutive_failures': self.consecutive_failures,
+            'heartbeats': self.heartbeats,
+            'failures': self.failures,
+            'last_seen_ago': None if self.last_seen is None else round(now - self.last_seen, 3),
+            'open_for': None if self.opened_at is None else round(now - self.opened_at, 3)
+        }
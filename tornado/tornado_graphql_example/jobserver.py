@@ -5,11 +5,16 @@ from __future__ import absolute_import, division, print_function
 import atexit
 from datetime import datetime
 import errno
+import heapq
+import itertools
 import json
 import logging
+from multiprocessing import cpu_count
 import os
 import shlex
-from traitlets import Bool, Integer, Unicode
+import signal
+import time
+from traitlets import Bool, Float, Integer, Unicode
 from traitlets.config.application import Application, catch_config_error
 import zmq
 from zmq.eventloop import ioloop, zmqstream
@@ -18,13 +23,143 @@ ioloop.install()
 
 # tornado must be imported after `ioloop.install()`
 from tornado import gen  # noqa
-from tornado.escape import json_decode, json_encode, to_unicode, utf8  # noqa
+from tornado.concurrent import Future, chain_future  # noqa
+from tornado.escape import to_unicode  # noqa
 from tornado.iostream import StreamClosedError  # noqa
 from tornado.log import LogFormatter  # noqa
 from tornado.process import Subprocess  # noqa
+from . import jsoncodec  # noqa
+from .commands import COMMANDS  # noqa
+from .membership import pid_alive, read_server_info, runtime_dir, server_info_files  # noqa
+from .profiling import BlockingDetector, Profiler, ProfilerBusy  # noqa
 from .version import __version__  # noqa
 
 
+PRIORITIES = {
+    'high': 0,
+    'normal': 1,
+    'low': 2
+}
+
+# the Future write() returns while output is not paused
+_flowing = Future()
+_flowing.set_result(None)
+
+
+class JobCancelled(Exception):
+    """Raised by ``JobOutput.write()`` once the job is cancelled"""
+
+
+class JobOutput(object):
+    """Send the stdout lines of a job to the requester
+
+    Each line is sent as a reply of its own unless the job server has
+    ``coalesce_interval`` set. Then lines are buffered until the interval
+    elapses or they reach ``coalesce_bytes``, and sent as one reply with
+    a ``lines`` array.
+
+    While the requester has paused the job, lines are buffered and sent as
+    one reply on ``resume()``. ``write()`` returns a Future which resolves
+    once the output flows again, so that a command yielding it waits.
+
+    ``done`` resolves when the command returns or the job is cancelled,
+    whichever comes first. Once cancelled, ``write()`` raises JobCancelled
+    so that the command stops.
+    """
+
+    def __init__(self, server, ident, request_id, wait_time=None, paused=False):
+        self.server = server
+        self.ident = ident
+        self.request_id = request_id
+        self.wait_time = wait_time
+        self.paused = paused
+        self.lines = []
+        self.size = 0
+        self.proc = None
+        self._timeout = None
+        self._resumed = None
+        self.cancelled = False
+        self.done = Future()
+
+    def write(self, line):
+        if self.cancelled:
+            raise JobCancelled(self.request_id)
+        self.server.log.debug('command output: %s', line)
+        timestamp = datetime.now().timestamp()
+        if self.paused:
+            self.lines.append({'stdout': line, 'timestamp': timestamp})
+            self.size += len(line)
+            if self._resumed is None:
+                self._resumed = Future()
+            return self._resumed
+        if not self.server.coalesce_interval:
+            self.server.reply(self.ident, self.request_id, {
+                'stdout': line,
+                'finished': False,
+                'wait_time': self.wait_time,
+                'timestamp': timestamp
+            })
+            return _flowing
+        self.lines.append({'stdout': line, 'timestamp': timestamp})
+        self.size += len(line)
+        if self.size >= self.server.coalesce_bytes:
+            self.flush()
+        elif self._timeout is None:
+            self._timeout = ioloop.IOLoop.current().call_later(
+                self.server.coalesce_interval, self.flush)
+        return _flowing
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.flush()
+        resumed, self._resumed = self._resumed, None
+        if resumed is not None:
+            resumed.set_result(None)
+
+    def flush(self, force=False):
+        """Send the buffered lines, unless paused and not ``force``"""
+        if self.paused and not force:
+            return
+        if self._timeout is not None:
+            ioloop.IOLoop.current().remove_timeout(self._timeout)
+            self._timeout = None
+        if not self.lines:
+            return
+        lines = self.lines
+        self.lines = []
+        self.size = 0
+        self.server.reply(self.ident, self.request_id, {
+            'lines': lines,
+            'finished': False,
+            'wait_time': self.wait_time,
+            'timestamp': lines[-1]['timestamp']
+        })
+
+    def cancel(self, error):
+        """Kill the external process of the job, if any, and finish it with ``error``"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if not self.done.done():
+            self.done.set_result(None)
+        if self.proc is not None:
+            self.proc.proc.kill()
+        self.flush(force=True)
+        self.server.reply(self.ident, self.request_id, {
+            'stdout': None,
+            'finished': True,
+            'error': error,
+            'timestamp': datetime.now().timestamp()
+        })
+        # a command waiting for a paused output goes on, and its next write raises
+        resumed, self._resumed = self._resumed, None
+        if resumed is not None:
+            resumed.set_result(None)
+
+
 class JobServer(Application):
 
     name = 'tornado-graphql-example-jobserver'
@@ -34,13 +169,23 @@ class JobServer(Application):
     aliases = {
         'log-level': 'Application.log_level',
         'ip': 'JobServer.ip',
-        'port': 'JobServer.port'
+        'port': 'JobServer.port',
+        'capacity': 'JobServer.capacity',
+        'max-queue-size': 'JobServer.max_queue_size',
+        'coalesce-interval': 'JobServer.coalesce_interval',
+        'coalesce-bytes': 'JobServer.coalesce_bytes',
+        'shutdown-timeout': 'JobServer.shutdown_timeout',
+        'blocking-threshold': 'JobServer.blocking_threshold'
     }
 
     flags = {
         'debug': (
             {'Application': {'log_level': logging.DEBUG}},
             'set log level to logging.DEBUG (maximize logging output)'
+        ),
+        'no-native-commands': (
+            {'JobServer': {'native_commands': False}},
+            'run built-in commands as external processes'
         )
     }
 
@@ -66,8 +211,75 @@ class JobServer(Application):
         help='The port the server will listen on.'
     )
 
+    capacity = Integer(
+        cpu_count(), config=True,
+        help='The number of jobs the server runs at once; further jobs are queued.'
+    )
+
+    max_queue_size = Integer(
+        100, config=True,
+        help='The number of jobs which can wait in the queue; further jobs are refused as busy.'
+    )
+
+    heartbeat_interval = Float(
+        5.0, config=True,
+        help='The interval in seconds of touching the server info file as a heartbeat.'
+    )
+
+    coalesce_interval = Float(
+        0.0, config=True,
+        help="""The time in seconds output lines of a job are buffered for
+
+        Buffered lines are sent as one reply with a ``lines`` array of
+        ``{stdout, timestamp}`` instead of one reply per line. 0 disables it.
+        """
+    )
+
+    coalesce_bytes = Integer(
+        16384, config=True,
+        help='Buffered output lines are sent early once they reach this many bytes.'
+    )
+
+    native_commands = Bool(
+        True, config=True,
+        help='Run the built-in commands in process instead of forking external commands.'
+    )
+
+    shutdown_timeout = Float(
+        10.0, config=True,
+        help='The seconds running jobs are given to finish on SIGTERM before they are cancelled.'
+    )
+
+    blocking_threshold = Float(
+        0.0, config=True,
+        help='Log the stack when a callback blocks the IOLoop this many seconds (0 disables it).'
+    )
+
     pid = Integer()
 
+    running = Integer(0)
+
+    def __init__(self, **kwargs):
+        super(JobServer, self).__init__(**kwargs)
+        self.queue = []
+        self._queue_seq = itertools.count()
+        self.jobs = {}
+        # whether the requester paused each queued or running job, by (ident, request_id)
+        self.paused_jobs = {}
+        self.draining = False
+        self.profiler = Profiler()
+        self.blocking_detector = None
+        self.counters = {
+            'jobs_started': 0,
+            'jobs_completed': 0,
+            'jobs_failed': 0,
+            'jobs_refused': 0,
+            'jobs_cancelled': 0,
+            'wait_seconds': 0.0,
+            'run_seconds': 0.0,
+            'replies': 0
+        }
+
     zmq_port = Integer()
 
     def __repr__(self):
@@ -79,10 +291,7 @@ class JobServer(Application):
 
     @property
     def info_file(self):
-        env = os.environ
-        xdg = env.get('XDG_RUNTIME_DIR', os.path.join(env.get('HOME'), '.config'))
-        appdir = os.path.join(xdg, 'tornado-graphql-example')
-        return os.path.join(appdir, 'jobserver-{0}'.format(self.pid))
+        return os.path.join(runtime_dir(), 'jobserver-{0}'.format(self.pid))
 
     @property
     def server_info(self):
@@ -90,7 +299,8 @@ class JobServer(Application):
             'pid': self.pid,
             'ip': self.ip,
             'port': self.port,
-            'zmq_port': self.zmq_port
+            'zmq_port': self.zmq_port,
+            'capacity': self.capacity
         }
 
     def write_server_info_file(self):
@@ -98,9 +308,31 @@ class JobServer(Application):
         if not os.path.exists(dirname):
             os.makedirs(dirname)
 
-        with open(self.info_file, 'w') as f:
+        # write to a hidden file and rename it so that readers never see a partial file
+        tmp_file = os.path.join(dirname, '.jobserver-{0}.tmp'.format(self.pid))
+        with open(tmp_file, 'w') as f:
             self.log.debug('write server_info: %s\n%s', self.info_file, self.server_info)
             json.dump(self.server_info, f, indent=2, sort_keys=True)
+        os.rename(tmp_file, self.info_file)
+
+    def touch_server_info_file(self):
+        try:
+            os.utime(self.info_file, None)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.write_server_info_file()
+
+    def remove_stale_server_info_files(self):
+        for file_path in server_info_files():
+            server = read_server_info(file_path)
+            if server is not None and not pid_alive(server['pid']):
+                self.log.info('remove stale server_info: %s', file_path)
+                try:
+                    os.unlink(file_path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
 
     def remove_server_info_file(self):
         try:
@@ -121,9 +353,8 @@ class JobServer(Application):
     def start(self):
         self.pid = os.getpid()
         context = zmq.Context.instance()
-        zmq_sock = context.socket(zmq.DEALER)
+        zmq_sock = context.socket(zmq.ROUTER)
         zmq_sock.linger = 1000
-        zmq_sock.identity = bytes(str(self.pid), 'ascii')
         if self.port == 0:
             self.zmq_port = zmq_sock.bind_to_random_port('tcp://{0}'.format(self.ip))
         else:
@@ -136,61 +367,320 @@ class JobServer(Application):
                            u'%(name)s-{0}]%(end_color)s %(message)s').format(self.pid)
         self.log.info('start %s', self)
 
+        self.remove_stale_server_info_files()
         self.write_server_info_file()
 
         atexit.register(self.remove_server_info_file)
 
+        self.heartbeat = ioloop.PeriodicCallback(self.touch_server_info_file,
+                                                 self.heartbeat_interval * 1000)
+        self.heartbeat.start()
+
         self.io_loop = ioloop.IOLoop.current()
+        if self.blocking_threshold > 0:
+            self.blocking_detector = BlockingDetector(self.blocking_threshold)
+            self.blocking_detector.start()
+        signal.signal(signal.SIGTERM, self._signal_drain)
         try:
             self.io_loop.start()
         except KeyboardInterrupt:
             self.log.info('JobServer interrupted...')
         finally:
+            if self.blocking_detector is not None:
+                self.blocking_detector.stop()
             self.remove_server_info_file()
+            # linger lets the last replies go out before the process exits
+            self.zmq_stream.close()
+            context.term()
 
     @gen.coroutine
     def request_handler(self, msg):
-        ident, request = msg
-        req_data = json_decode(to_unicode(request))
+        ident, request_id, request = msg
+        try:
+            req_data = jsoncodec.loads(request)
+        except ValueError:
+            self.reply_error(ident, request_id, 'a request must be JSON')
+            return
+        if req_data.get('command') == 'ping':
+            # the counters go with every pong so that the web app can export them
+            self.reply(ident, request_id, {'pong': True, 'finished': True,
+                                           'metrics': self.metrics})
+            return
+        if req_data.get('command') == 'profile':
+            yield self.profile_handler(ident, request_id, req_data)
+            return
+        if req_data.get('command') in ('pause', 'resume'):
+            self.flow_handler(ident, request_id, req_data)
+            return
+        if req_data.get('command') == 'cancel':
+            self.cancel_handler(ident, request_id, req_data)
+            return
         self.log.info('request: %s', req_data)
 
-        if 'command' not in req_data:
-            raise ValueError('command must be specified in a request')
-        command = req_data['command']
-        if command == 'countdown':
-            yield self.countdown_handler(
-                req_data.get('interval', 1),
-                req_data.get('count', 5)
-            )
+        # every request gets a final reply, or the requester waits for it forever
+        command = req_data.get('command')
+        priority = req_data.get('priority', 'normal')
+        if command is None:
+            self.reply_error(ident, request_id, 'command must be specified in a request')
+            return
+        if command not in COMMANDS:
+            self.reply_error(ident, request_id, "Unknown command '{0}'".format(command))
+            return
+        if priority not in PRIORITIES:
+            self.reply_error(ident, request_id, "Unknown priority '{0}'".format(priority))
+            return
+        if self.draining:
+            self.reply_busy(ident, request_id, 'job server {0} is shutting down')
+            return
+        if self.running >= self.capacity and len(self.queue) >= self.max_queue_size:
+            self.log.warning('busy: %d running, %d queued', self.running, len(self.queue))
+            self.reply_busy(ident, request_id, 'job server {0} is busy')
+            return
+
+        queued_at = time.time()
+        self.paused_jobs[(ident, request_id)] = False
+        try:
+            yield self.run_job(ident, request_id, command, priority, req_data, queued_at)
+        finally:
+            self.paused_jobs.pop((ident, request_id), None)
+
+    @gen.coroutine
+    def run_job(self, ident, request_id, command, priority, req_data, queued_at):
+        key = (ident, request_id)
+        acquired = yield self.acquire(PRIORITIES[priority], key)
+        if acquired is None:
+            # cancelled while queued, and already replied to
+            return
+        if not acquired:
+            self.reply_busy(ident, request_id, 'job server {0} is shutting down')
+            return
+        started_at = time.time()
+        self.counters['jobs_started'] += 1
+        self.counters['wait_seconds'] += started_at - queued_at
+        output = self.jobs[key] = JobOutput(self, ident, request_id,
+                                            wait_time=started_at - queued_at,
+                                            paused=self.paused_jobs.get(key, False))
+        error = None
+        try:
+            yield self.run_command(output, command, req_data)
+        except Exception as e:
+            self.log.exception('command %s failed', command)
+            self.counters['jobs_failed'] += 1
+            error = str(e) or e.__class__.__name__
+        else:
+            if not output.cancelled:
+                self.counters['jobs_completed'] += 1
+        finally:
+            self.jobs.pop(key, None)
+            self.release()
+            self.counters['run_seconds'] += time.time() - started_at
+        if output.cancelled:
+            # the final reply went with the cancellation
+            return
+        resp = {
+            'stdout': None,
+            'finished': True,
+            'wait_time': started_at - queued_at,
+            'run_time': time.time() - started_at,
+            'timestamp': datetime.now().timestamp()
+        }
+        if error is not None:
+            resp['error'] = error
+        self.reply(ident, request_id, resp)
+
+    def flow_handler(self, ident, request_id, req_data):
+        """Pause or resume the output of a job of the same requester
+
+        The output of a paused job is held back until it is resumed, so
+        that a slow consumer of one job does not hold back the others. A
+        paused job keeps its slot.
+        """
+        key = (ident, str(req_data.get('request_id')).encode('ascii'))
+        if key in self.paused_jobs:
+            paused = self.paused_jobs[key] = req_data['command'] == 'pause'
+            output = self.jobs.get(key)
+            if output is not None and paused:
+                output.pause()
+            elif output is not None:
+                output.resume()
+        self.reply(ident, request_id, {
+            'finished': True,
+            'timestamp': datetime.now().timestamp()
+        })
+
+    def cancel_handler(self, ident, request_id, req_data):
+        """Cancel a queued or running job of the same requester
+
+        A running job's process is killed and its slot released at once,
+        and a queued job leaves the queue. Either gets its final reply with
+        an error.
+        """
+        key = (ident, str(req_data.get('request_id')).encode('ascii'))
+        error = 'cancelled by the requester'
+        output = self.jobs.get(key)
+        if output is not None:
+            self.log.info('cancel request %s', key[1])
+            output.cancel(error)
+            self.counters['jobs_cancelled'] += 1
         else:
-            raise ValueError("Unknown command '{0}'".format(command))
+            for i, (_, _, future, queued_key) in enumerate(self.queue):
+                if queued_key == key:
+                    self.log.info('cancel queued request %s', key[1])
+                    self.queue.pop(i)
+                    heapq.heapify(self.queue)
+                    future.set_result(None)
+                    self.reply_error(ident, key[1], error)
+                    self.counters['jobs_cancelled'] += 1
+                    break
+        self.reply(ident, request_id, {
+            'finished': True,
+            'timestamp': datetime.now().timestamp()
+        })
 
     @gen.coroutine
-    def countdown_handler(self, interval, count):
+    def profile_handler(self, ident, request_id, req_data):
+        """Profile the job server as requested and reply with the profile"""
+        try:
+            profile = yield self.profiler.profile(
+                float(req_data.get('seconds', 5)),
+                kind=req_data.get('kind', 'cprofile'),
+                format=req_data.get('format'),
+                interval=float(req_data.get('interval', 0.005)))
+        except (ValueError, ProfilerBusy) as e:
+            self.reply(ident, request_id, {
+                'finished': True,
+                'error': str(e),
+                'profiler_busy': isinstance(e, ProfilerBusy),
+                'timestamp': datetime.now().timestamp()
+            })
+            return
+        self.reply(ident, request_id, {
+            'profile': profile,
+            'finished': True,
+            'timestamp': datetime.now().timestamp()
+        })
+
+    @property
+    def metrics(self):
+        if self.blocking_detector is None:
+            return self.counters
+        return dict(self.counters,
+                    ioloop_blocked=self.blocking_detector.blocked,
+                    ioloop_blocked_seconds=self.blocking_detector.blocked_seconds)
+
+    def reply_error(self, ident, request_id, error):
+        self.log.warning('request %s: %s', request_id, error)
+        self.reply(ident, request_id, {
+            'stdout': None,
+            'finished': True,
+            'error': error,
+            'timestamp': datetime.now().timestamp()
+        })
+
+    def reply_busy(self, ident, request_id, error):
+        self.counters['jobs_refused'] += 1
+        self.reply(ident, request_id, {
+            'stdout': None,
+            'finished': True,
+            'busy': True,
+            'error': error.format(self.pid),
+            'timestamp': datetime.now().timestamp()
+        })
+
+    def acquire(self, priority, key=None):
+        """Return a Future resolved when a job of the priority may run
+
+        Jobs wait in a heap ordered by priority, then by arrival. The Future
+        resolves to False if the job is not to run because of shutdown, or
+        to None if it is cancelled while queued.
+        """
+        future = Future()
+        if self.running < self.capacity and not self.queue:
+            self.running += 1
+            future.set_result(True)
+        else:
+            heapq.heappush(self.queue, (priority, next(self._queue_seq), future, key))
+        return future
+
+    def release(self):
+        self.running -= 1
+        if self.queue:
+            _, _, future, _ = heapq.heappop(self.queue)
+            self.running += 1
+            future.set_result(True)
+
+    @gen.coroutine
+    def run_command(self, output, command, req_data):
+        if command == 'countdown' and not self.native_commands:
+            future = self.countdown_handler(output, req_data.get('interval', 1),
+                                            req_data.get('count', 5))
+        else:
+            future = COMMANDS[command](output.write, req_data)
+        # a cancelled job releases its slot without waiting for the command to
+        # stop, and the command's error then is of no interest
+        future.add_done_callback(lambda f: f.exception())
+        chain_future(future, output.done)
+        try:
+            yield output.done
+        finally:
+            # the output goes before the final reply even if the job is paused
+            output.flush(force=True)
+
+    def reply(self, ident, request_id, data):
+        data['running'] = self.running
+        data['queued'] = len(self.queue)
+        data['draining'] = self.draining
+        data['capacity'] = self.capacity
+        self.counters['replies'] += 1
+        self.zmq_stream.send_multipart([ident, request_id, jsoncodec.dumps(data)])
+
+    @gen.coroutine
+    def countdown_handler(self, output, interval, count):
         command = '{0}/countdown -i {1} {2}'.format(os.getcwd(), interval, count)
-        proc = Subprocess(shlex.split(command), stdout=Subprocess.STREAM)
+        proc = output.proc = Subprocess(shlex.split(command), stdout=Subprocess.STREAM)
         try:
             while True:
                 line_bytes = yield proc.stdout.read_until(b'\n')
                 line = to_unicode(line_bytes)[:-1]
                 self.log.info('command read: %s', line)
-                timestamp = datetime.now().timestamp()
-                self.zmq_stream.send_multipart([b'0', utf8(json_encode({
-                    'stdout': line,
-                    'finished': False,
-                    'timestamp': timestamp
-                }))])
+                # the pipe is not read while the job is paused
+                yield output.write(line)
         except StreamClosedError:
             self.log.info('command closed')
-            timestamp = datetime.now().timestamp()
-            self.zmq_stream.send_multipart([b'0', utf8(json_encode({
-                'stdout': None,
-                'finished': True,
-                'timestamp': timestamp
-            }))])
 
-    def countdown_handler2(self, interval, count):
-        return self.countdown_handler(interval, count)
+    def countdown_handler2(self, output, interval, count):
+        return self.countdown_handler(output, interval, count)
+
+    @gen.coroutine
+    def drain(self):
+        """Refuse new jobs, wait for the running ones until the deadline, then cancel them"""
+        if self.draining:
+            return
+        started = time.time()
+        self.draining = True
+        self.log.info('draining %d running and %d queued jobs (timeout %.1fs)',
+                      self.running, len(self.queue), self.shutdown_timeout)
+
+        # queued jobs are refused as busy so that the web app retries them elsewhere
+        queue, self.queue = self.queue, []
+        for _, _, future, _ in queue:
+            future.set_result(False)
+
+        deadline = self.io_loop.time() + self.shutdown_timeout
+        while self.jobs and self.io_loop.time() < deadline:
+            yield gen.sleep(0.05)
+        for output in list(self.jobs.values()):
+            self.log.warning('cancel request %s: job server is shutting down', output.request_id)
+            output.cancel('job server {0} is shutting down'.format(self.pid))
+            self.counters['jobs_cancelled'] += 1
+        self.jobs.clear()
+
+        self.zmq_stream.flush()
+        self.log.info('drained in %.3fs', time.time() - started)
+        self.io_loop.stop()
+
+    def _signal_drain(self, signum, frame):
+        self.io_loop.add_callback_from_signal(self.drain)
 
     def stop(self):
         def _stop():
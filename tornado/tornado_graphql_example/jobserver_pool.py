@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from functools import partial
+import itertools
+import os
+import time
+from tornado import ioloop
+from tornado.log import app_log
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+from . import jsoncodec
+from .health import ServerHealth
+from .scheduler import RoundRobinScheduler
+
+
+def job_server_url(server):
+    ip = server['ip']
+    if ip == '*':
+        ip = 'localhost'
+    return 'tcp://{0}:{1}'.format(ip, server['zmq_port'])
+
+
+class JobRequest(object):
+    """A request submitted to the pool
+
+    The same object follows the job when it is retried on another server,
+    so the submitter can always cancel it through it.
+
+    A ``control`` request, such as a ping, is addressed to its server: it
+    is not retried elsewhere nor reported as a finished job.
+
+    ``pause()`` asks the job server to hold back the output of the job
+    until ``resume()``, which is sent again if the job is retried.
+    ``cancel()`` asks it to stop the job, and discards its further replies.
+    """
+
+    __slots__ = ('request', 'callback', 'control', 'conn', 'request_id', 'retries',
+                 'finished', 'submitted', 'paused')
+
+    def __init__(self, request, callback, control=False):
+        self.request = request
+        self.callback = callback
+        self.control = control
+        self.conn = None
+        self.request_id = None
+        self.retries = 0
+        self.finished = False
+        self.submitted = time.time()
+        self.paused = False
+
+    def cancel(self):
+        if self.conn is not None:
+            if not self.control:
+                self.send_control('cancel')
+            self.conn.cancel(self.request_id)
+        self.finished = True
+
+    def pause(self):
+        if not self.paused:
+            self.paused = True
+            self.send_control('pause')
+
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            self.send_control('resume')
+
+    def send_control(self, command):
+        """Send a control request about this job to its job server"""
+        if self.conn is not None and not self.finished and not self.conn.closed:
+            self.conn.send(JobRequest({'command': command,
+                                       'request_id': self.request_id.decode('ascii')},
+                                      _ignore_reply, control=True))
+
+
+def _ignore_reply(resp):
+    pass
+
+
+class JobServerConnection(object):
+    """A long-lived DEALER connection to one job server
+
+    Requests are multiplexed over the connection. Each one is sent as
+    ``[request_id, request]`` and the job server echoes the request id in
+    every reply, which is used to dispatch the reply to the callback of
+    the request. Replies also report the number of jobs running and queued
+    on the server and its capacity.
+
+    A reply with ``busy: true`` means the server refused the job because
+    its queue is full; it is passed to ``on_busy`` if given. Any other
+    final reply of a job is passed to ``on_finished`` if given before the
+    callback of the job.
+
+    ``metrics`` holds the counters the server reported in its last pong.
+    """
+
+    def __init__(self, server, context, failure_threshold=3, on_busy=None,
+                 on_finished=None):
+        self.server = server
+        self.url = job_server_url(server)
+        self.handlers = {}
+        self.running = 0
+        self.queued = 0
+        self.draining = False
+        self.capacity = server.get('capacity', 1)
+        self.on_busy = on_busy
+        self.on_finished = on_finished
+        self.metrics = {}
+        self.health = ServerHealth(failure_threshold)
+        self.ping = None
+        self.ping_sent = None
+        self._request_ids = itertools.count(1)
+
+        zmq_sock = context.socket(zmq.DEALER)
+        zmq_sock.linger = 1000
+        zmq_sock.identity = bytes(str(os.getpid()), 'ascii')
+        app_log.info('connect %s', self.url)
+        zmq_sock.connect(self.url)
+        self.stream = ZMQStream(zmq_sock)
+        self.stream.on_recv(self.response_handler)
+
+    @property
+    def in_flight(self):
+        return len(self.handlers) - (1 if self.ping is not None else 0)
+
+    @property
+    def closed(self):
+        return self.stream.closed()
+
+    @property
+    def paused_jobs(self):
+        return sum(1 for job in self.handlers.values() if job.paused)
+
+    def send(self, job):
+        """Send a JobRequest
+
+        Its callback is called with each decoded reply until the reply
+        with ``finished: true``.
+        """
+        job.conn = self
+        job.request_id = str(next(self._request_ids)).encode('ascii')
+        self.handlers[job.request_id] = job
+        self.stream.send_multipart([job.request_id, jsoncodec.dumps(job.request)])
+        if job.paused:
+            job.send_control('pause')
+        return job
+
+    def cancel(self, request_id):
+        self.handlers.pop(request_id, None)
+
+    def response_handler(self, msg):
+        request_id, resp_bytes = msg
+        resp = jsoncodec.loads(resp_bytes)
+        self.running = resp.pop('running', self.running)
+        self.queued = resp.pop('queued', self.queued)
+        self.draining = resp.pop('draining', self.draining)
+        self.capacity = resp.pop('capacity', self.capacity)
+        self.health.seen()
+        if resp.get('finished'):
+            job = self.handlers.pop(request_id, None)
+        else:
+            job = self.handlers.get(request_id)
+        if job is None:
+            app_log.debug('discard response for request %s: %s', request_id, resp)
+            return
+        if resp.get('busy') and self.on_busy is not None:
+            self.on_busy(self, job, resp)
+            return
+        job.finished = resp.get('finished', False)
+        if job.finished and not job.control and self.on_finished is not None:
+            self.on_finished(self, job, resp)
+        job.callback(resp)
+
+    def take_pending(self):
+        """Remove and return the jobs in flight, leaving a heartbeat in place"""
+        jobs = [job for job in self.handlers.values() if job is not self.ping]
+        self.handlers = {job.request_id: job for job in self.handlers.values()
+                         if job is self.ping}
+        return jobs
+
+    def close(self):
+        if not self.closed:
+            app_log.info('close %s (%d in flight)', self.url, self.in_flight)
+            self.stream.close()
+        self.handlers.clear()
+        self.ping = None
+
+
+class JobServerPool(object):
+    """Persistent connections to the job servers, one per server
+
+    ``select()`` chooses the server for a job with the scheduler, based on
+    the outstanding jobs of each server: the larger of the requests in
+    flight from this process and the running and queued jobs last
+    reported by the server. A job refused by a busy server is retried on
+    another server.
+
+    Once started, every server is pinged every ``heartbeat_interval``
+    seconds. A ping unanswered within ``heartbeat_timeout`` counts as a
+    failure, and after ``failure_threshold`` consecutive failures the
+    circuit of the server opens: jobs are no longer routed to it and its
+    jobs in flight are retried on another server up to ``max_retries``
+    times. The circuit closes on the next answered ping.
+
+    ``on_job_finished(conn, job, resp)`` is called with the final reply of
+    every job, including a refusal or failure the pool finishes the job
+    with, on the connection of the server it last ran on.
+    """
+
+    def __init__(self, job_servers, scheduler=None, context=None,
+                 heartbeat_interval=1.0, heartbeat_timeout=3.0,
+                 failure_threshold=3, max_retries=1, on_job_finished=None):
+        self.job_servers = job_servers
+        self.scheduler = scheduler or RoundRobinScheduler()
+        self.context = context or zmq.Context.instance()
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.failure_threshold = failure_threshold
+        self.max_retries = max_retries
+        self.on_job_finished = on_job_finished
+        self.connections = {}
+        self._heartbeat = None
+
+    def load(self, server):
+        conn = self.connections.get(server['pid'])
+        if conn is None:
+            return 0
+        return max(conn.in_flight, conn.running + conn.queued)
+
+    def capacity(self, server):
+        conn = self.connections.get(server['pid'])
+        if conn is None:
+            return server.get('capacity', 1)
+        return conn.capacity
+
+    def available(self, server):
+        conn = self.connections.get(server['pid'])
+        return conn is None or (conn.health.available and not conn.draining)
+
+    def select(self, exclude=None):
+        """Return the server for the next job, or None if there is none"""
+        servers = [s for s in self.job_servers
+                   if s['pid'] != exclude and self.available(s)]
+        if not servers:
+            return None
+        return self.scheduler.select(servers, self.load, self.capacity)
+
+    def add_server(self, server):
+        self.job_servers.append(server)
+
+    def remove_server(self, pid):
+        self.job_servers[:] = [s for s in self.job_servers if s['pid'] != pid]
+        conn = self.connections.pop(pid, None)
+        if conn is not None:
+            self.fail_over(conn, 'job server {0} is gone'.format(pid))
+            conn.close()
+
+    def connection(self, server):
+        conn = self.connections.get(server['pid'])
+        if conn is None or conn.closed:
+            conn = JobServerConnection(server, self.context, self.failure_threshold,
+                                       on_busy=self.busy, on_finished=self.finished)
+            self.connections[server['pid']] = conn
+        return conn
+
+    def submit(self, server, request, callback):
+        """Send a request to the server and return its JobRequest"""
+        return self.connection(server).send(JobRequest(request, callback))
+
+    def control(self, server, request, callback):
+        """Send a control request, such as ``profile``, to the server"""
+        return self.connection(server).send(JobRequest(request, callback, control=True))
+
+    def busy(self, conn, job, resp):
+        """Retry a job refused by a busy server elsewhere, or pass on the refusal"""
+        server = None
+        if job.retries < self.max_retries:
+            server = self.select(exclude=conn.server['pid'])
+        if server is None:
+            job.finished = True
+            self.finished(conn, job, resp)
+            job.callback(resp)
+            return
+        job.retries += 1
+        app_log.info('retry request %s refused by %s on job server %s',
+                     job.request_id, conn.url, server['pid'])
+        self.connection(server).send(job)
+
+    def finished(self, conn, job, resp):
+        if self.on_job_finished is not None and not job.control:
+            self.on_job_finished(conn, job, resp)
+
+    def fail_over(self, conn, error):
+        """Retry the jobs in flight on ``conn`` elsewhere, or finish them with ``error``"""
+        for job in conn.take_pending():
+            server = None
+            if job.retries < self.max_retries and not job.control:
+                server = self.select(exclude=conn.server['pid'])
+            if server is None:
+                job.finished = True
+                resp = {'stdout': None, 'finished': True, 'error': error,
+                        'timestamp': time.time()}
+                self.finished(conn, job, resp)
+                job.callback(resp)
+                continue
+            job.retries += 1
+            app_log.warning('retry request %s of %s on job server %s',
+                            job.request_id, conn.url, server['pid'])
+            self.connection(server).send(job)
+
+    def start(self):
+        self._heartbeat = ioloop.PeriodicCallback(self.heartbeat,
+                                                  self.heartbeat_interval * 1000)
+        self._heartbeat.start()
+
+    def heartbeat(self):
+        now = time.time()
+        for server in list(self.job_servers):
+            conn = self.connection(server)
+            if conn.ping is not None:
+                if now - conn.ping_sent < self.heartbeat_timeout:
+                    continue
+                conn.cancel(conn.ping.request_id)
+                conn.ping = None
+                if conn.health.failure():
+                    app_log.warning('circuit open: %s is not responding', conn.url)
+                    self.fail_over(conn, 'job server {0} is not responding'.format(
+                        server['pid']))
+            conn.ping = JobRequest({'command': 'ping'}, partial(self._pong, conn), control=True)
+            conn.ping_sent = now
+            conn.send(conn.ping)
+
+    def _pong(self, conn, resp):
+        conn.ping = None
+        conn.metrics = resp.get('metrics', conn.metrics)
+        if conn.health.success(time.time() - conn.ping_sent):
+            app_log.info('circuit closed: %s', conn.url)
+
+    def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.stop()
+            self._heartbeat = None
+        for conn in self.connections.values():
+            conn.close()
+        self.connections.clear()
+
+    @property
+    def stats(self):
+        return {
+            pid: dict(conn.health.as_dict(), **{
+                'url': conn.url,
+                'open_connections': 0 if conn.closed else 1,
+                'in_flight': conn.in_flight,
+                'running': conn.running,
+                'queued': conn.queued,
+                'paused_jobs': conn.paused_jobs,
+                'draining': conn.draining,
+                'capacity': conn.capacity
+            })
+            for pid, conn in self.connections.items()
+        }
@@ -3,8 +3,9 @@
 from __future__ import absolute_import, division, print_function
 
 import logging
-from multiprocessing import Process
-from traitlets import Bool, Integer, List, Unicode
+from multiprocessing import Process, cpu_count
+import signal
+from traitlets import Bool, Float, Integer, List, Unicode
 from traitlets.config.application import Application, catch_config_error
 from zmq.eventloop import ioloop
 from .version import __version__
@@ -28,13 +29,23 @@ class JobServerApp(Application):
         'ip': 'JobServerApp.ip',
         'ports': 'JobServerApp.ports',
         'num': 'JobServerApp.num',
-        'sleep': 'JobServerApp.sleep'
+        'sleep': 'JobServerApp.sleep',
+        'capacity': 'JobServerApp.capacity',
+        'max-queue-size': 'JobServerApp.max_queue_size',
+        'coalesce-interval': 'JobServerApp.coalesce_interval',
+        'coalesce-bytes': 'JobServerApp.coalesce_bytes',
+        'shutdown-timeout': 'JobServerApp.shutdown_timeout',
+        'blocking-threshold': 'JobServerApp.blocking_threshold'
     }
 
     flags = {
         'debug': (
             {'Application': {'log_level': logging.DEBUG}},
             'set log level to logging.DEBUG (maximize logging output)'
+        ),
+        'no-native-commands': (
+            {'JobServerApp': {'native_commands': False}},
+            'run built-in commands as external processes'
         )
     }
 
@@ -70,6 +81,41 @@ class JobServerApp(Application):
         help='Suspend executing each job for the specified numbrer of seconds'
     )
 
+    capacity = Integer(
+        cpu_count(), config=True,
+        help='The number of jobs each server runs at once; further jobs are queued.'
+    )
+
+    max_queue_size = Integer(
+        100, config=True,
+        help='The number of jobs which can wait in the queue of each server.'
+    )
+
+    coalesce_interval = Float(
+        0.0, config=True,
+        help='The time in seconds output lines of a job are buffered for (0 disables it).'
+    )
+
+    coalesce_bytes = Integer(
+        16384, config=True,
+        help='Buffered output lines are sent early once they reach this many bytes.'
+    )
+
+    native_commands = Bool(
+        True, config=True,
+        help='Run the built-in commands in process instead of forking external commands.'
+    )
+
+    shutdown_timeout = Float(
+        10.0, config=True,
+        help='The seconds running jobs are given to finish on SIGTERM before they are cancelled.'
+    )
+
+    blocking_threshold = Float(
+        0.0, config=True,
+        help='Log the stack when a callback blocks the IOLoop this many seconds (0 disables it).'
+    )
+
     procs = List()
 
     debug = Bool(False)
@@ -85,6 +131,8 @@ class JobServerApp(Application):
         for i in range(self.num):
             self.start_jobserver(i)
 
+        signal.signal(signal.SIGTERM, self._signal_terminate)
+
         if self.debug:
             self.io_loop = ioloop.IOLoop.current()
             try:
@@ -95,13 +143,30 @@ class JobServerApp(Application):
                     print('terminate jobserver {0}: {1}'.format(i, proc))
                     proc.terminate()
 
+        # the job servers drain on SIGTERM, so wait for them to finish
+        for proc in self.procs:
+            proc.join()
+
+    def _signal_terminate(self, signum, frame):
+        self.log.info('terminate %d job servers', len(self.procs))
+        for proc in self.procs:
+            proc.terminate()
+        if self.debug:
+            self.io_loop.add_callback_from_signal(self.io_loop.stop)
+
     def start_jobserver(self, i):
         try:
             port = (self.ports or [])[i]
         except IndexError:
             port = 0
         job_server = JobServer(log_level=self.log_level, ip=self.ip, port=port,
-                               sleep=self.sleep)
+                               sleep=self.sleep, capacity=self.capacity,
+                               max_queue_size=self.max_queue_size,
+                               coalesce_interval=self.coalesce_interval,
+                               coalesce_bytes=self.coalesce_bytes,
+                               native_commands=self.native_commands,
+                               shutdown_timeout=self.shutdown_timeout,
+                               blocking_threshold=self.blocking_threshold)
         job_server.log.parent = self.log
         # self.log.debug('start %s', job_server)
         proc = Process(target=job_server)
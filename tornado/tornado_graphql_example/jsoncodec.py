@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+"""JSON codec used on the request, response and job server paths
+
+The fastest installed backend out of orjson, ujson and rapidjson is used,
+falling back to the standard library. ``dumps`` returns UTF-8 encoded bytes
+which can be written to a socket as-is, and ``loads`` accepts bytes or str.
+
+Like ``tornado.escape.json_encode``, ``dumps`` escapes ``</`` as ``<\\/``
+so that its output is safe to embed in a ``<script>`` element of a page.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+import json
+
+
+def _orjson_backend():
+    import orjson
+    return orjson.dumps, orjson.loads
+
+
+def _ujson_backend():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    return dumps, ujson.loads
+
+
+def _rapidjson_backend():
+    import rapidjson
+
+    def dumps(obj):
+        return rapidjson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    return dumps, rapidjson.loads
+
+
+def _stdlib_backend():
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        return encoder.encode(obj).encode('utf-8')
+
+    return dumps, json.loads
+
+
+def _html_safe(dumps):
+    def html_safe_dumps(obj):
+        return dumps(obj).replace(b'</', b'<\\/')
+
+    return html_safe_dumps
+
+
+def available_backends():
+    """Return an OrderedDict of the installed backends in preference order
+
+    Each value is a ``(dumps, loads)`` pair.
+    """
+    backends = OrderedDict()
+    for name, backend in [('orjson', _orjson_backend),
+                          ('ujson', _ujson_backend),
+                          ('rapidjson', _rapidjson_backend),
+                          ('json', _stdlib_backend)]:
+        try:
+            dumps, loads = backend()
+            backends[name] = (_html_safe(dumps), loads)
+        except ImportError:
+            pass
+    return backends
+
+
+backend, (dumps, loads) = next(iter(available_backends().items()))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+from glob import glob
+import json
+import os
+import time
+from tornado import ioloop
+from tornado.log import app_log
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+
+def runtime_dir():
+    env = os.environ
+    xdg = env.get('XDG_RUNTIME_DIR', os.path.join(env.get('HOME'), '.config'))
+    return os.path.join(xdg, 'tornado-graphql-example')
+
+
+def server_info_files(appdir=None, kind='jobserver'):
+    return glob(os.path.join(appdir or runtime_dir(), '{0}-*'.format(kind)))
+
+
+def read_server_info(file_path):
+    """Return the server info in the file, or None if it is gone or incomplete"""
+    try:
+        with open(file_path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+    except ValueError:
+        pass
+    return None
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class JobServerMembership(object):
+    """Keep the job servers of a JobServerPool in sync with the info files
+
+    Job servers write ``jobserver-<pid>`` into the runtime directory and
+    touch it every heartbeat interval. A server is a member while its
+    process is alive and its file was touched within ``timeout`` seconds.
+    The directory is rescanned every ``poll_interval`` seconds, and
+    immediately on changes if inotify_simple is installed.
+    """
+
+    def __init__(self, pool, appdir=None, poll_interval=2.0, timeout=15.0):
+        self.pool = pool
+        self.appdir = appdir or runtime_dir()
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.io_loop = None
+        self._poller = None
+        self._inotify = None
+
+    def is_alive(self, file_path, server):
+        try:
+            age = time.time() - os.path.getmtime(file_path)
+        except OSError:
+            return False
+        return pid_alive(server['pid']) and age < self.timeout
+
+    def scan(self):
+        found = {}
+        for file_path in server_info_files(self.appdir):
+            server = read_server_info(file_path)
+            if server is not None and self.is_alive(file_path, server):
+                found[server['pid']] = server
+
+        current = set(s['pid'] for s in self.pool.job_servers)
+        for pid in set(found) - current:
+            app_log.info('job server joined: %s', found[pid])
+            self.pool.add_server(found[pid])
+        for pid in current - set(found):
+            app_log.warning('job server left: %s', pid)
+            self.pool.remove_server(pid)
+
+    def start(self):
+        if not os.path.exists(self.appdir):
+            os.makedirs(self.appdir)
+        self.scan()
+
+        self.io_loop = ioloop.IOLoop.current()
+        self._poller = ioloop.PeriodicCallback(self.scan, self.poll_interval * 1000)
+        self._poller.start()
+
+        if INotify is not None:
+            self._inotify = INotify()
+            self._inotify.add_watch(self.appdir, inotify_flags.CREATE | inotify_flags.DELETE |
+                                    inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+            self.io_loop.add_handler(self._inotify.fileno(), self._inotify_handler,
+                                     ioloop.IOLoop.READ)
+        else:
+            app_log.debug('inotify_simple is not installed, polling %s', self.appdir)
+
+    def _inotify_handler(self, fd, events):
+        self._inotify.read(timeout=0)
+        self.scan()
+
+    def stop(self):
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
+        if self._inotify is not None:
+            self.io_loop.remove_handler(self._inotify.fileno())
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from bisect import bisect_left
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+OVERFLOW_LABEL = '_other'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '{0:.1f}'.format(value)
+    return repr(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', r'\\')
+                           .replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in zip(names, values)
+    ) + '}'
+
+
+class Metric(object):
+    """A metric family with one series per set of label values
+
+    Label values are given as a tuple in the order of ``labelnames``.
+    Beyond ``max_series`` series, new label values are recorded under
+    ``_other`` so that labels taken from requests cannot grow the
+    registry without bound.
+
+    Metrics may be updated from any thread, e.g. by resolvers on the
+    GraphQL executor.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labelnames=(), max_series=1000):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if labels in self.series or len(self.series) < self.max_series:
+            return labels
+        return (OVERFLOW_LABEL,) * len(self.labelnames)
+
+    def clear(self):
+        with self._lock:
+            self.series.clear()
+
+    def samples(self):
+        """Yield ``(suffix, labelnames, labelvalues, value)``"""
+        with self._lock:
+            series = list(self.series.items())
+        for labels, value in sorted(series):
+            yield '', self.labelnames, labels, value
+
+    def render(self):
+        lines = ['# HELP {0} {1}'.format(self.name, self.help),
+                 '# TYPE {0} {1}'.format(self.name, self.type)]
+        for suffix, names, values, value in self.samples():
+            lines.append('{0}{1}{2} {3}'.format(
+                self.name, suffix, format_labels(names, values), format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    type = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            key = self._key(labels)
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def set(self, value, labels=()):
+        """Set a counter kept elsewhere, e.g. reported by a job server"""
+        with self._lock:
+            self.series[self._key(labels)] = value
+
+
+class Gauge(Metric):
+
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self.series[self._key(labels)] = value
+
+    def inc(self, amount=1, labels=()):
+        with self._lock:
+            key = self._key(labels)
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """Observations counted in buckets of upper bounds ``buckets``
+
+    Each observation increments a single bucket; the cumulative counts of
+    the exposition format are summed up when rendering.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, max_series=1000):
+        super(Histogram, self).__init__(name, help, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, labels=()):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total)
+                      for labels, (counts, total) in self.series.items()]
+        names = self.labelnames + ('le',)
+        for labels, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield '_bucket', names, labels + (format_value(float(bound)),), cumulative
+            yield '_sum', self.labelnames, labels, total
+            yield '_count', self.labelnames, labels, cumulative
+
+
+class MetricsRegistry(object):
+    """Metrics rendered in the Prometheus text exposition format
+
+    Collectors registered with ``add_collector()`` are called before each
+    rendering to set gauges from state sampled at scrape time, such as the
+    queue depths of the job servers.
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=(), **kwargs):
+        return self.register(Counter(name, help, labelnames, **kwargs))
+
+    def gauge(self, name, help, labelnames=(), **kwargs):
+        return self.register(Gauge(name, help, labelnames, **kwargs))
+
+    def histogram(self, name, help, labelnames=(), **kwargs):
+        return self.register(Histogram(name, help, labelnames, **kwargs))
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def render(self):
+        for collector in self.collectors:
+            collector()
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
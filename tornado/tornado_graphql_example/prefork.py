@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import os
+import signal
+import sys
+import time
+from tornado.log import app_log
+
+
+def fork_workers(num_workers, max_restarts=100, restart_delay=1.0):
+    """Fork worker processes and supervise them
+
+    Returns the worker id (``0`` to ``num_workers - 1``) in each worker.
+    The parent never returns: it restarts a worker which dies, and on
+    SIGTERM or SIGINT it sends SIGTERM to the workers, waits for them to
+    exit and exits.
+
+    Like ``tornado.process.fork_processes``, this must be called before
+    the IOLoop or a ZeroMQ context is created, so that each worker creates
+    its own.
+    """
+    children = {}
+    stopping = []
+
+    def start_worker(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            return worker_id
+        app_log.info('started worker %d (pid %d)', worker_id, pid)
+        children[pid] = worker_id
+        return None
+
+    for i in range(num_workers):
+        if start_worker(i) is not None:
+            return i
+
+    def on_signal(signum, frame):
+        if not stopping:
+            app_log.info('stopping %d workers', len(children))
+        stopping.append(signum)
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    restarts = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if pid not in children:
+            continue
+        worker_id = children.pop(pid)
+        if os.WIFSIGNALED(status):
+            reason = 'killed by signal {0}'.format(os.WTERMSIG(status))
+        else:
+            reason = 'exited with status {0}'.format(os.WEXITSTATUS(status))
+        if stopping:
+            app_log.info('worker %d (pid %d) %s', worker_id, pid, reason)
+            continue
+
+        app_log.warning('worker %d (pid %d) %s, restarting', worker_id, pid, reason)
+        restarts += 1
+        if restarts > max_restarts:
+            raise RuntimeError('Too many worker restarts, giving up')
+        time.sleep(restart_delay)
+        if not stopping and start_worker(worker_id) is not None:
+            return worker_id
+    sys.exit(0)
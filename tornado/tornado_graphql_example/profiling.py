@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from base64 import b64encode
+from collections import Counter
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from tornado import gen, ioloop
+from tornado.log import app_log
+
+PROFILE_KINDS = ('cprofile', 'sample')
+
+PROFILE_FORMATS = {
+    'cprofile': ('text', 'pstats'),
+    'sample': ('collapsed',)
+}
+
+MAX_PROFILE_SECONDS = 60
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def check_profile_args(seconds, kind, format=None):
+    """Return the format of the profile, raising ValueError for invalid arguments"""
+    if kind not in PROFILE_KINDS:
+        raise ValueError('Unknown profile kind: {0}'.format(kind))
+    format = format or PROFILE_FORMATS[kind][0]
+    if format not in PROFILE_FORMATS[kind]:
+        raise ValueError('Unknown format of {0} profiles: {1}'.format(kind, format))
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError('The seconds must be in (0, {0}]'.format(MAX_PROFILE_SECONDS))
+    return format
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return '{0}@{1}:{2}'.format(code.co_name, os.path.basename(code.co_filename),
+                                code.co_firstlineno)
+
+
+def collapsed_stack(frame):
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """Sample the stack of a thread from a background thread
+
+    Every ``interval`` seconds the stack of the thread is recorded in the
+    collapsed stack format of flame graph tools: the frames from the
+    outermost, separated by semicolons, followed by the number of samples.
+    """
+
+    def __init__(self, thread_ident, interval=0.005):
+        self.thread_ident = thread_ident
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_ident)
+            if frame is not None:
+                self.stacks[collapsed_stack(frame)] += 1
+
+    def collapsed(self):
+        return ''.join('{0} {1}\n'.format(stack, count)
+                       for stack, count in self.stacks.most_common())
+
+
+class Profiler(object):
+    """On-demand profiles of the IOLoop thread
+
+    ``profile()`` profiles everything the thread runs for some seconds,
+    either with cProfile or by sampling its stack, while the IOLoop keeps
+    serving. One profile runs at a time.
+    """
+
+    def __init__(self):
+        self.running = False
+
+    @gen.coroutine
+    def profile(self, seconds, kind='cprofile', format=None, interval=0.005,
+                sort='cumulative', limit=100):
+        """Profile for ``seconds`` and return the profile
+
+        ``cprofile`` profiles are returned as a ``text`` report of the top
+        ``limit`` functions by ``sort``, or as ``pstats``, the binary dump
+        of ``pstats`` and snakeviz, encoded in base64. ``sample`` profiles
+        are returned as ``collapsed`` stacks sampled every ``interval``
+        seconds.
+        """
+        format = check_profile_args(seconds, kind, format)
+        if self.running:
+            raise ProfilerBusy('A profile is already running')
+
+        self.running = True
+        app_log.info('start %s profile for %.1fs', kind, seconds)
+        try:
+            if kind == 'cprofile':
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield gen.sleep(seconds)
+                finally:
+                    profiler.disable()
+                if format == 'pstats':
+                    profiler.create_stats()
+                    raise gen.Return(b64encode(marshal.dumps(profiler.stats)).decode('ascii'))
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+                raise gen.Return(stream.getvalue())
+            else:
+                sampler = StackSampler(threading.current_thread().ident, interval)
+                sampler.start()
+                try:
+                    yield gen.sleep(seconds)
+                finally:
+                    sampler.stop()
+                raise gen.Return(sampler.collapsed())
+        finally:
+            self.running = False
+
+
+class BlockingDetector(object):
+    """Log the stack of the IOLoop thread when a callback blocks the loop
+
+    The IOLoop updates a tick every ``threshold / 2`` seconds and a
+    watchdog thread checks it. Once the tick is ``threshold`` seconds old,
+    the stack of the IOLoop thread, which shows the blocking code, is
+    logged, and when the loop runs again the time it was blocked for. So
+    blocks of about ``threshold`` to ``1.5 * threshold`` seconds and
+    longer are caught.
+
+    Unlike ``IOLoop.set_blocking_signal_threshold()``, this also covers
+    callbacks, such as coroutines resuming, and uses no signals.
+    """
+
+    def __init__(self, threshold, io_loop=None):
+        self.threshold = threshold
+        self.io_loop = io_loop or ioloop.IOLoop.current()
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.last_tick = None
+        self._reported = None
+        self._thread_ident = None
+        self._ticker = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.io_loop.add_callback(self._start_ticker)
+        self._thread = threading.Thread(target=self._watch, name='blocking-detector')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _start_ticker(self):
+        self._thread_ident = threading.current_thread().ident
+        self.tick()
+        self._ticker = ioloop.PeriodicCallback(self.tick, self.threshold * 500)
+        self._ticker.start()
+
+    def tick(self):
+        now = time.time()
+        if self._reported is not None:
+            blocked_for = now - self._reported
+            app_log.warning('IOLoop was blocked for %.3fs', blocked_for)
+            self.blocked_seconds += blocked_for
+            self._reported = None
+        self.last_tick = now
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 4):
+            last_tick = self.last_tick
+            if last_tick is None or self._reported is not None or \
+                    time.time() - last_tick < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._thread_ident)
+            if frame is None:
+                continue
+            self.blocked += 1
+            self._reported = last_tick
+            app_log.warning('IOLoop blocked for more than %.3fs:\n%s', self.threshold,
+                            ''.join(traceback.format_stack(frame)))
+
+    def stop(self):
+        self._stop.set()
+        if self._ticker is not None:
+            self._ticker.stop()
+
+    @property
+    def stats(self):
+        return {
+            'threshold': self.threshold,
+            'blocked': self.blocked,
+            'blocked_seconds': round(self.blocked_seconds, 3)
+        }
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from tornado import ioloop
+from . import jsoncodec
+
+
+class PubSub(object):
+    """Index of subscribers by topic
+
+    Subscribers are WebSocket handlers with ``send_data(subid, data,
+    encoded_data)``. ``publish()`` encodes the data once, and the encoded
+    data is put in the frame of every subscriber of the topic.
+
+    ``publish()`` may be called from any thread, e.g. by a mutation on the
+    GraphQL executor; the frames are sent on the IOLoop.
+
+    With a PubSubBus attached, events are also published to the other web
+    app processes, and the bus is told which topics have local subscribers.
+    """
+
+    def __init__(self):
+        self.topics = {}
+        self.io_loop = None
+        self.bus = None
+
+    def attach(self, bus):
+        self.io_loop = ioloop.IOLoop.current()
+        self.bus = bus
+
+    def subscribe(self, topic, subscriber, subid):
+        if self.io_loop is None:
+            self.io_loop = ioloop.IOLoop.current()
+        if topic not in self.topics:
+            self.topics[topic] = {}
+            if self.bus is not None:
+                self.bus.subscribe(topic)
+        self.topics[topic][subscriber] = subid
+
+    def unsubscribe(self, topic, subscriber):
+        subscribers = self.topics.get(topic)
+        if subscribers is None:
+            return
+        subscribers.pop(subscriber, None)
+        if not subscribers:
+            del self.topics[topic]
+            if self.bus is not None:
+                self.bus.unsubscribe(topic)
+
+    def unsubscribe_all(self, subscriber):
+        for topic in list(self.topics):
+            self.unsubscribe(topic, subscriber)
+
+    def publish(self, topic, data):
+        if self.bus is None and not self.topics.get(topic):
+            return
+        self.io_loop.add_callback(self._publish, topic, data, jsoncodec.dumps(data))
+
+    def _publish(self, topic, data, encoded_data):
+        if self.bus is not None:
+            self.bus.send(topic, encoded_data)
+        self.deliver(topic, data, encoded_data)
+
+    def deliver(self, topic, data, encoded_data):
+        """Send an event to the local subscribers of the topic"""
+        for subscriber, subid in list(self.topics.get(topic, {}).items()):
+            subscriber.send_data(subid, data, encoded_data)
+
+    @property
+    def stats(self):
+        return {topic: len(subscribers) for topic, subscribers in self.topics.items()}
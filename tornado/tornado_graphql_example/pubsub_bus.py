@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import json
+import os
+from tornado import ioloop
+from tornado.log import app_log
+import zmq
+from zmq.eventloop.zmqstream import ZMQStream
+from . import jsoncodec
+from .membership import pid_alive, read_server_info, runtime_dir, server_info_files
+
+
+def topic_frame(topic):
+    # the terminator keeps the prefix matching of SUB sockets exact
+    return topic.encode('utf-8') + b'\x00'
+
+
+class PubSubBus(object):
+    """Broker-less ZeroMQ bus between the PubSubs of the web app processes
+
+    Each process binds a PUB socket and writes its address to
+    ``webapp-<pid>`` in the runtime directory. Its SUB socket connects to
+    the PUB sockets of the other processes found there, rescanned every
+    ``poll_interval`` seconds, and subscribes to the topics its local
+    sockets subscribe to, so the publishers only send the events it cares
+    about.
+
+    Events are sent as ``[topic, encoded_data]``.
+    """
+
+    def __init__(self, pubsub, ip='127.0.0.1', context=None, appdir=None,
+                 poll_interval=2.0):
+        self.pubsub = pubsub
+        self.ip = ip
+        self.context = context or zmq.Context.instance()
+        self.appdir = appdir or runtime_dir()
+        self.poll_interval = poll_interval
+        self.pid = os.getpid()
+        self.port = None
+        self.peers = {}
+        self.published = 0
+        self.received = 0
+        self._pub = None
+        self._sub = None
+        self._poller = None
+
+    @property
+    def url(self):
+        return 'tcp://{0}:{1}'.format(self.ip, self.port)
+
+    @property
+    def info_file(self):
+        return os.path.join(self.appdir, 'webapp-{0}'.format(self.pid))
+
+    def start(self):
+        if not os.path.exists(self.appdir):
+            os.makedirs(self.appdir)
+
+        self._pub = self.context.socket(zmq.PUB)
+        self._pub.linger = 0
+        self.port = self._pub.bind_to_random_port('tcp://{0}'.format(self.ip))
+
+        sub = self.context.socket(zmq.SUB)
+        sub.linger = 0
+        for topic in self.pubsub.topics:
+            sub.setsockopt(zmq.SUBSCRIBE, topic_frame(topic))
+        self._sub = ZMQStream(sub)
+        self._sub.on_recv(self.receive)
+
+        tmp_file = os.path.join(self.appdir, '.webapp-{0}.tmp'.format(self.pid))
+        with open(tmp_file, 'w') as f:
+            json.dump({'pid': self.pid, 'bus_url': self.url}, f)
+        os.rename(tmp_file, self.info_file)
+        app_log.info('pubsub bus: %s', self.url)
+
+        self.pubsub.attach(self)
+        self.scan()
+        self._poller = ioloop.PeriodicCallback(self.scan, self.poll_interval * 1000)
+        self._poller.start()
+
+    def scan(self):
+        found = {}
+        for file_path in server_info_files(self.appdir, 'webapp'):
+            peer = read_server_info(file_path)
+            if peer is None or peer['pid'] == self.pid:
+                continue
+            if pid_alive(peer['pid']):
+                found[peer['pid']] = peer['bus_url']
+            else:
+                self._remove_file(file_path)
+
+        for pid in set(found) - set(self.peers):
+            app_log.info('pubsub bus peer joined: %s %s', pid, found[pid])
+            self._sub.socket.connect(found[pid])
+            self.peers[pid] = found[pid]
+        for pid in set(self.peers) - set(found):
+            app_log.info('pubsub bus peer left: %s', pid)
+            self._sub.socket.disconnect(self.peers.pop(pid))
+
+    def subscribe(self, topic):
+        if self._sub is not None:
+            self._sub.socket.setsockopt(zmq.SUBSCRIBE, topic_frame(topic))
+
+    def unsubscribe(self, topic):
+        if self._sub is not None:
+            self._sub.socket.setsockopt(zmq.UNSUBSCRIBE, topic_frame(topic))
+
+    def send(self, topic, encoded_data):
+        self.published += 1
+        self._pub.send_multipart([topic_frame(topic), encoded_data])
+
+    def receive(self, msg):
+        frame, encoded_data = msg
+        self.received += 1
+        topic = frame[:-1].decode('utf-8')
+        self.pubsub.deliver(topic, jsoncodec.loads(encoded_data), encoded_data)
+
+    def _remove_file(self, file_path):
+        try:
+            os.unlink(file_path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def stop(self):
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
+        self.pubsub.attach(None)
+        self._remove_file(self.info_file)
+        if self._sub is not None:
+            self._sub.close()
+            self._sub = None
+        if self._pub is not None:
+            self._pub.close()
+            self._pub = None
+
+    @property
+    def stats(self):
+        return {
+            'url': self.url,
+            'peers': sorted(self.peers),
+            'published': self.published,
+            'received': self.received
+        }
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+import random
+
+
+class Scheduler(object):
+    """Base class of the policies which choose a job server for a job
+
+    ``select()`` is given the list of servers and two functions returning
+    the number of outstanding jobs and the capacity of a server.
+    """
+
+    def select(self, servers, load, capacity):
+        raise NotImplementedError('select() must be implemented')
+
+
+class RoundRobinScheduler(Scheduler):
+
+    def __init__(self):
+        self.index = 0
+
+    def select(self, servers, load, capacity):
+        self.index %= len(servers)
+        server = servers[self.index]
+        self.index += 1
+        return server
+
+
+class LeastOutstandingScheduler(Scheduler):
+    """Choose the server with the fewest outstanding jobs
+
+    Ties are broken round-robin so idle servers share the work.
+    """
+
+    def __init__(self):
+        self.index = 0
+
+    def select(self, servers, load, capacity):
+        self.index = (self.index + 1) % len(servers)
+        rotated = servers[self.index:] + servers[:self.index]
+        return min(rotated, key=load)
+
+
+class PowerOfTwoScheduler(Scheduler):
+    """Choose the less loaded of two random servers"""
+
+    def __init__(self, rand=None):
+        self.random = rand or random.Random()
+
+    def select(self, servers, load, capacity):
+        if len(servers) == 1:
+            return servers[0]
+        a, b = self.random.sample(servers, 2)
+        return a if load(a) <= load(b) else b
+
+
+class WeightedCapacityScheduler(Scheduler):
+    """Choose the server with the lowest load relative to its capacity"""
+
+    def __init__(self):
+        self.index = 0
+
+    def select(self, servers, load, capacity):
+        self.index = (self.index + 1) % len(servers)
+        rotated = servers[self.index:] + servers[:self.index]
+        return min(rotated, key=lambda s: (load(s) + 1) / max(capacity(s), 1))
+
+
+SCHEDULERS = {
+    'round-robin': RoundRobinScheduler,
+    'least-outstanding': LeastOutstandingScheduler,
+    'power-of-two': PowerOfTwoScheduler,
+    'weighted': WeightedCapacityScheduler
+}
+
+
+def make_scheduler(name):
+    try:
+        return SCHEDULERS[name]()
+    except KeyError:
+        raise ValueError('Unknown scheduler: {0}'.format(name))
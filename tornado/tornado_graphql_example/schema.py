@@ -2,8 +2,12 @@
 
 from __future__ import absolute_import, division, print_function
 
-from collections import OrderedDict
+from base64 import b64decode, b64encode
+import binascii
 import graphene
+from graphql.error import GraphQLError
+from .pubsub import PubSub
+from .todo_store import TodoStore
 
 
 class Todo(graphene.ObjectType):
@@ -12,23 +16,95 @@ class Todo(graphene.ObjectType):
     completed = graphene.Boolean()
 
 
+class TodoEdge(graphene.ObjectType):
+    cursor = graphene.String()
+    node = graphene.Field(Todo)
+
+
 class TodoList(graphene.ObjectType):
     todos = graphene.List(Todo)
+    edges = graphene.List(TodoEdge)
+    page_info = graphene.Field(graphene.relay.PageInfo)
+    total_count = graphene.Int()
+
+    def resolve_edges(self, args, context, info):
+        return [TodoEdge(cursor=todo_cursor(t.id), node=t) for t in self.todos]
+
+
+def todo_cursor(todo_id):
+    return b64encode('todo:{0}'.format(todo_id).encode('utf-8')).decode('ascii')
+
+
+def todo_cursor_id(cursor):
+    try:
+        prefix, todo_id = b64decode(cursor.encode('ascii')).decode('utf-8').split(':', 1)
+        if prefix != 'todo':
+            raise ValueError(cursor)
+        int(todo_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise GraphQLError('Invalid cursor: {0}'.format(cursor))
+    return todo_id
+
+
+sample_todos = [
+    ('Make America Great Again', False),
+    ('Quit TPP', False)
+]
+
+todo_store = TodoStore(sample_todos)
+
+
+def use_todo_store(store):
+    global todo_store
+    todo_store = store
+
+
+def todo_store_version():
+    """Return the version of the todos, which every mutation changes"""
+    todo_store.refresh()
+    return todo_store.epoch, todo_store.version
+
+
+pubsub = PubSub()
 
 
-todo_data = OrderedDict(
-    [(t.id, t) for t in [
-        Todo('1', 'Make America Great Again', False),
-        Todo('2', 'Quit TPP', False)
-    ]]
-)
+def publish_todo(topic, todo):
+    pubsub.publish(topic, {
+        'id': str(todo.id),
+        'text': todo.text,
+        'completed': todo.completed
+    })
 
 
 class Query(graphene.ObjectType):
-    todo_list = graphene.Field(TodoList)
+    todo_list = graphene.Field(
+        TodoList,
+        first=graphene.Int(),
+        after=graphene.String(),
+        last=graphene.Int(),
+        before=graphene.String(),
+        completed=graphene.Boolean(),
+        text_prefix=graphene.String()
+    )
 
     def resolve_todo_list(self, args, context, info):
-        return TodoList(todo_data.values())
+        after = args.get('after')
+        before = args.get('before')
+        page = todo_store.page(
+            completed=args.get('completed'),
+            text_prefix=args.get('text_prefix'),
+            after=todo_cursor_id(after) if after else None,
+            before=todo_cursor_id(before) if before else None,
+            first=args.get('first'),
+            last=args.get('last')
+        )
+        page_info = graphene.relay.PageInfo(
+            has_next_page=page.has_next,
+            has_previous_page=page.has_previous,
+            start_cursor=todo_cursor(page.todos[0].id) if page.todos else None,
+            end_cursor=todo_cursor(page.todos[-1].id) if page.todos else None
+        )
+        return TodoList(todos=page.todos, page_info=page_info, total_count=page.total)
 
 
 class AddTodo(graphene.Mutation):
@@ -38,10 +114,8 @@ class AddTodo(graphene.Mutation):
     todo = graphene.Field(lambda: Todo)
 
     def mutate(self, args, context, info):
-        todo = Todo(str(len(todo_data) + 1),
-                    args.get('text', ''),
-                    args.get('completed', False))
-        todo_data[todo.id] = todo
+        todo = todo_store.add(args.get('text', ''), args.get('completed', False))
+        publish_todo('newTodos', todo)
         return AddTodo(todo=todo)
 
 
@@ -52,8 +126,8 @@ class ToggleTodo(graphene.Mutation):
     todo = graphene.Field(lambda: Todo)
 
     def mutate(self, args, context, info):
-        todo = todo_data[args.get('id')]
-        todo.completed = not todo.completed
+        todo = todo_store.toggle(args.get('id'))
+        publish_todo('toggledTodos', todo)
         return ToggleTodo(todo)
 
 
@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from array import array
+from contextlib import contextmanager
+from glob import glob
+import errno
+import fcntl
+import mmap
+import os
+import re
+import struct
+import threading
+from tornado.log import app_log
+from . import jsoncodec
+from .todo_store import TodoStore
+
+
+FSYNC_POLICIES = ('always', 'interval', 'never')
+
+SNAPSHOT_MAGIC = b'TODOSNP1'
+
+# magic, log generation, number of positions, length of the text blob
+SNAPSHOT_HEADER = struct.Struct('<8sQQQ')
+
+
+class TodoLog(object):
+    """Append-only write-ahead log of todo mutations
+
+    Each entry is a JSON line appended to ``todos.<generation>.log`` in
+    ``data_dir``. The fsync policy is one of:
+
+    * ``always``: ``sync()`` returns once the entry is on disk. Concurrent
+      writers share a single fsync (group commit).
+    * ``interval``: a background thread fsyncs every ``fsync_interval``
+      seconds.
+    * ``never``: leave flushing to the OS.
+
+    The last entry of a generation is ``{"op": "rotate", "generation": n}``,
+    naming the next one, so that a reader following the log moves on.
+    """
+
+    def __init__(self, data_dir, fsync='interval', fsync_interval=0.05):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: {0}'.format(fsync))
+        self.data_dir = data_dir
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.generation = 0
+        self.entries = 0
+        self.fsyncs = 0
+        self._file = None
+        self._seq = 0
+        self._synced = 0
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def log_path(self, generation):
+        return os.path.join(self.data_dir, 'todos.{0}.log'.format(generation))
+
+    @property
+    def generations(self):
+        """Return the generations of the log files on disk in order"""
+        pattern = re.compile(r'todos\.(\d+)\.log$')
+        matches = (pattern.search(p) for p in glob(os.path.join(self.data_dir, 'todos.*.log')))
+        return sorted(int(m.group(1)) for m in matches if m)
+
+    def open(self, generation):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            self.generation = generation
+            self._file = open(self.log_path(generation), 'ab')
+
+        if self.fsync == 'interval' and self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop,
+                                             name='todo-log-flusher')
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def write(self, entry):
+        """Append an entry and return its sequence number for ``sync()``"""
+        line = jsoncodec.dumps(entry) + b'\n'
+        with self._lock:
+            self._file.write(line)
+            self._seq += 1
+            self.entries += 1
+            return self._seq
+
+    def flush(self):
+        """Hand the entries written so far to the OS, so other processes read them"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def sync(self, seq):
+        """Wait until the entry ``seq`` is on disk if the policy is ``always``"""
+        if self.fsync == 'always':
+            self._fsync(seq)
+
+    def sync_all(self):
+        """Wait until every entry written so far is on disk"""
+        self._fsync(self._seq)
+
+    def _fsync(self, seq):
+        # Whoever holds _sync_lock fsyncs every entry written so far, so the
+        # writers queued behind it usually find their entry already synced.
+        with self._sync_lock:
+            if self._synced >= seq:
+                return
+            with self._lock:
+                if self._file is None:
+                    return
+                self._file.flush()
+                fd = self._file.fileno()
+                target = self._seq
+            os.fsync(fd)
+            self.fsyncs += 1
+            self._synced = target
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            self._fsync(self._seq)
+
+    def rotate(self):
+        """End the current log, sync it and start the next generation"""
+        generation = self.generation + 1
+        # the next file exists before the entry naming it is read
+        open(self.log_path(generation), 'ab').close()
+        self.write({'op': 'rotate', 'generation': generation})
+        self._fsync(self._seq)
+        self.open(generation)
+        return generation
+
+    def remove_before(self, generation):
+        for g in self.generations:
+            if g < generation:
+                os.unlink(self.log_path(g))
+
+    def replay(self, generation, apply):
+        """Call ``apply(entry)`` for each entry of the log file
+
+        A torn entry at the end of the file, left by a crash in the middle
+        of a write, is truncated.
+        """
+        path = self.log_path(generation)
+        count = 0
+        with open(path, 'rb+') as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = jsoncodec.loads(line)
+                except ValueError:
+                    break
+                apply(entry)
+                offset += len(line)
+                count += 1
+            else:
+                return count
+            app_log.warning('truncate torn entry in %s at %d', path, offset)
+            f.truncate(offset)
+        return count
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        self._fsync(self._seq)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @property
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'entries': self.entries,
+            'fsyncs': self.fsyncs,
+            'fsync': self.fsync
+        }
+
+
+def write_snapshot(path, generation, texts, completed, removed):
+    """Write the store columns to a snapshot file atomically
+
+    The layout is the header, the completed and removed flags, the text
+    offsets as int64 and the UTF-8 text blob, so that it can be read back
+    from a memory map without parsing.
+    """
+    encoded = [(t or u'').encode('utf-8') for t in texts]
+    offsets = array('q', [0])
+    for t in encoded:
+        offsets.append(offsets[-1] + len(t))
+    if offsets.itemsize != 8:
+        raise RuntimeError('array q must be 64-bit')
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation, len(texts), offsets[-1]))
+        f.write(completed)
+        f.write(removed)
+        f.write(offsets.tobytes())
+        for t in encoded:
+            f.write(t)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_snapshot(path):
+    """Return ``(generation, texts, completed, removed)`` from a snapshot file"""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        magic, generation, count, text_len = SNAPSHOT_HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError('{0} is not a todo snapshot'.format(path))
+        pos = SNAPSHOT_HEADER.size
+        completed = bytearray(mm[pos:pos + count])
+        pos += count
+        removed = bytearray(mm[pos:pos + count])
+        pos += count
+        offsets = array('q')
+        offsets.frombytes(mm[pos:pos + 8 * (count + 1)])
+        pos += 8 * (count + 1)
+        blob = memoryview(mm)[pos:pos + text_len]
+        try:
+            texts = [None if removed[i] else str(blob[offsets[i]:offsets[i + 1]], 'utf-8')
+                     for i in range(count)]
+        finally:
+            blob.release()
+    finally:
+        mm.close()
+    return generation, texts, completed, removed
+
+
+class DurableTodoStore(TodoStore):
+    """TodoStore which persists every mutation to a TodoLog
+
+    Mutations are applied and appended to the log under the store lock so
+    the log order matches the apply order, and waited on for fsync outside
+    of it so concurrent writers can share one fsync. Every
+    ``snapshot_interval`` entries a background thread rotates the log and
+    writes a snapshot of the store, holding the store lock only to rotate
+    and copy the columns; recovery loads the snapshot and replays only the
+    log generations after it.
+    """
+
+    def __init__(self, data_dir, fsync='interval', fsync_interval=0.05,
+                 snapshot_interval=100000):
+        super(DurableTodoStore, self).__init__()
+        self.data_dir = data_dir
+        self.snapshot_interval = snapshot_interval
+        self.log = TodoLog(data_dir, fsync, fsync_interval)
+        self._since_snapshot = 0
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_wanted = threading.Event()
+        self._closing = False
+        self.recover()
+        self._snapshotter = threading.Thread(target=self._snapshot_loop,
+                                             name='todo-snapshotter')
+        self._snapshotter.daemon = True
+        self._snapshotter.start()
+
+    @property
+    def snapshot_path(self):
+        return os.path.join(self.data_dir, 'todos.snapshot')
+
+    def recover(self):
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        generation = 0
+        try:
+            generation, texts, completed, removed = read_snapshot(self.snapshot_path)
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        else:
+            self._restore(texts, completed, removed)
+            app_log.info('todo snapshot: %d todos (log generation %d)', len(self), generation)
+
+        replayed = 0
+        for g in self.log.generations:
+            if g >= generation:
+                replayed += self.log.replay(g, self._apply)
+                generation = g
+        app_log.info('todo log: %d entries replayed', replayed)
+        self._since_snapshot = replayed
+        self.log.open(generation)
+
+    @property
+    def is_empty(self):
+        return len(self._texts) == 0
+
+    def _apply(self, entry):
+        op = entry['op']
+        if op == 'add':
+            record = TodoStore.add(self, entry['text'], entry['completed'])
+            if record.id != entry['id']:
+                raise ValueError('todo log out of order: {0} != {1}'.format(
+                    record.id, entry['id']))
+        elif op == 'set':
+            TodoStore.set_completed(self, entry['id'], entry['completed'])
+        elif op == 'remove':
+            TodoStore.remove(self, entry['id'])
+        elif op != 'rotate':
+            raise ValueError('Unknown todo log entry: {0}'.format(entry))
+
+    def _mutating(self):
+        """Return the lock held while a mutation is applied and logged"""
+        return self._lock
+
+    def _logged(self, entry):
+        seq = self.log.write(entry)
+        self._since_snapshot += 1
+        return seq
+
+    def _committed(self, seq):
+        self.log.sync(seq)
+        if self._since_snapshot >= self.snapshot_interval:
+            # the mutating thread may be the IOLoop, so it does not write the snapshot
+            self._snapshot_wanted.set()
+
+    def _snapshot_loop(self):
+        while True:
+            self._snapshot_wanted.wait()
+            self._snapshot_wanted.clear()
+            if self._closing:
+                return
+            try:
+                self.snapshot()
+            except Exception:
+                app_log.exception('todo snapshot failed')
+
+    def add(self, text, completed=False):
+        with self._mutating():
+            record = super(DurableTodoStore, self).add(text, completed)
+            seq = self._logged({'op': 'add', 'id': record.id, 'text': record.text,
+                                'completed': record.completed})
+        self._committed(seq)
+        return record
+
+    def set_completed(self, todo_id, completed):
+        with self._mutating():
+            record = super(DurableTodoStore, self).set_completed(todo_id, completed)
+            seq = self._logged({'op': 'set', 'id': record.id, 'completed': record.completed})
+        self._committed(seq)
+        return record
+
+    def toggle(self, todo_id):
+        with self._mutating():
+            completed = not self.get(todo_id).completed
+            record = super(DurableTodoStore, self).set_completed(todo_id, completed)
+            seq = self._logged({'op': 'set', 'id': record.id, 'completed': record.completed})
+        self._committed(seq)
+        return record
+
+    def remove(self, todo_id):
+        with self._mutating():
+            super(DurableTodoStore, self).remove(todo_id)
+            seq = self._logged({'op': 'remove', 'id': str(todo_id)})
+        self._committed(seq)
+
+    def snapshot(self):
+        """Rotate the log and write a snapshot covering the previous generations"""
+        if not self._snapshot_lock.acquire(False):
+            return
+        try:
+            # most of the log is synced before the mutations wait for the rotation
+            self.log.sync_all()
+            with self._mutating():
+                generation = self.log.rotate()
+                columns = self._columns()
+                self._since_snapshot = 0
+            write_snapshot(self.snapshot_path, generation, *columns)
+            with self._mutating():
+                self.log.remove_before(generation)
+            app_log.info('todo snapshot: %d positions (log generation %d)',
+                         len(columns[0]), generation)
+        finally:
+            self._snapshot_lock.release()
+
+    def close(self):
+        self._closing = True
+        self._snapshot_wanted.set()
+        self._snapshotter.join()
+        self.log.close()
+
+
+class SharedTodoStore(DurableTodoStore):
+    """DurableTodoStore shared by the processes which open the same ``data_dir``
+
+    The log is the order of the mutations of all the processes. Each
+    process keeps its own copy of the todos and follows the log: a read
+    first applies the entries the other processes appended since, which
+    costs an ``fstat()`` when there are none. A mutation holds an
+    exclusive ``flock()`` of ``todos.lock`` while it catches up, applies
+    its change and appends its entry, so that ids are allocated in log
+    order. Snapshots are written by one process at a time, and a process
+    whose log generation was removed meanwhile reloads from the snapshot.
+
+    ``version`` is still counted per process, with its own ``epoch``.
+    """
+
+    def __init__(self, data_dir, **kwargs):
+        self._lock_file = None
+        self._flock_depth = 0
+        self._tail_file = None
+        self._tail_generation = None
+        self._tail_offset = 0
+        super(SharedTodoStore, self).__init__(data_dir, **kwargs)
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.data_dir, 'todos.lock')
+
+    @contextmanager
+    def _flock(self):
+        # called with self._lock held, so the depth is not shared between threads
+        if self._flock_depth == 0:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        self._flock_depth += 1
+        try:
+            yield
+        finally:
+            self._flock_depth -= 1
+            if self._flock_depth == 0:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def recover(self):
+        if not os.path.exists(self.data_dir):
+            os.makedirs(self.data_dir)
+        if self._lock_file is None:
+            self._lock_file = open(self.lock_path, 'a')
+
+        with self._lock, self._flock():
+            # the log is not followed while it is replayed
+            if self._tail_file is not None:
+                self._tail_file.close()
+                self._tail_file = None
+            self._reset([], bytearray(), bytearray())
+            super(SharedTodoStore, self).recover()
+            generation = self.log.generation
+            self._follow_from(generation, os.path.getsize(self.log.log_path(generation)))
+
+    def _follow_from(self, generation, offset):
+        tail_file = open(self.log.log_path(generation), 'rb')
+        if self._tail_file is not None:
+            self._tail_file.close()
+        self._tail_file = tail_file
+        self._tail_generation = generation
+        self._tail_offset = offset
+
+    def _tail_size(self):
+        return os.fstat(self._tail_file.fileno()).st_size
+
+    def _catch_up(self):
+        """Apply the entries appended by the other processes"""
+        while self._tail_file is not None:
+            size = self._tail_size()
+            if size <= self._tail_offset:
+                return
+            self._tail_file.seek(self._tail_offset)
+            next_generation = None
+            for line in self._tail_file.read(size - self._tail_offset).splitlines(True):
+                # an entry being appended, or torn, is left for later
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = jsoncodec.loads(line)
+                except ValueError:
+                    break
+                self._tail_offset += len(line)
+                if entry['op'] == 'rotate':
+                    next_generation = entry['generation']
+                    break
+                self._apply(entry)
+            if next_generation is None:
+                return
+
+            try:
+                self._follow_from(next_generation, 0)
+            except (IOError, OSError) as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                app_log.info('todo log generation %d is gone, reloading', next_generation)
+                self.recover()
+                return
+            # another process rotated the log for its snapshot
+            self.log.open(next_generation)
+            self._since_snapshot = 0
+
+    def refresh(self):
+        with self._lock:
+            self._catch_up()
+
+    @contextmanager
+    def _mutating(self):
+        with self._lock, self._flock():
+            self._catch_up()
+            if self._tail_size() > self._tail_offset:
+                app_log.warning('truncate torn entry in %s at %d',
+                                self._tail_file.name, self._tail_offset)
+                os.truncate(self._tail_file.name, self._tail_offset)
+            try:
+                yield
+            finally:
+                # the entries of this process are applied already
+                self.log.flush()
+                if self.log.generation != self._tail_generation:
+                    self._follow_from(self.log.generation, 0)
+                self._tail_offset = self._tail_size()
+
+    def __len__(self):
+        self.refresh()
+        return super(SharedTodoStore, self).__len__()
+
+    def __contains__(self, todo_id):
+        self.refresh()
+        return super(SharedTodoStore, self).__contains__(todo_id)
+
+    def get(self, todo_id):
+        self.refresh()
+        return super(SharedTodoStore, self).get(todo_id)
+
+    def count(self, completed=None):
+        self.refresh()
+        return super(SharedTodoStore, self).count(completed)
+
+    def values(self, completed=None):
+        self.refresh()
+        return super(SharedTodoStore, self).values(completed)
+
+    def page(self, *args, **kwargs):
+        self.refresh()
+        return super(SharedTodoStore, self).page(*args, **kwargs)
+
+    def snapshot(self):
+        with open(os.path.join(self.data_dir, 'todos.snapshot.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                # another process is writing one
+                return
+            super(SharedTodoStore, self).snapshot()
+
+    def close(self):
+        super(SharedTodoStore, self).close()
+        with self._lock:
+            self._tail_file.close()
+            self._lock_file.close()
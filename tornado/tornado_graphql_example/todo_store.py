@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import, division, print_function
+
+from array import array
+from bisect import bisect_left
+from itertools import islice
+import threading
+import uuid
+
+
+class TodoRecord(object):
+    """A read-only snapshot of a todo
+
+    Graphene resolves ``Todo`` fields by attribute lookup, so records are
+    returned to the schema as they are instead of as ``Todo`` instances.
+    """
+
+    __slots__ = ('id', 'text', 'completed')
+
+    def __init__(self, id, text, completed):
+        self.id = id
+        self.text = text
+        self.completed = completed
+
+    def __repr__(self):
+        return '<TodoRecord {id=%s text=%r completed=%s}>' % (
+            self.id, self.text, self.completed)
+
+    def __eq__(self, other):
+        return (isinstance(other, TodoRecord) and
+                (self.id, self.text, self.completed) ==
+                (other.id, other.text, other.completed))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+PREFIX_SPLIT_SIZE = 64
+
+
+class TodoPage(object):
+
+    __slots__ = ('todos', 'has_previous', 'has_next', 'total')
+
+    def __init__(self, todos, has_previous, has_next, total):
+        self.todos = todos
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.total = total
+
+
+class TodoStore(object):
+    """Thread-safe in-memory todo storage
+
+    Todos are stored column-wise: a list of texts and a bytearray of
+    completion flags, both indexed by position ``int(id) - 1``. Ids are
+    allocated monotonically and never reused.
+
+    The ``completed`` filters are bytearrays over positions as well, with
+    a byte set for each live todo, each live completed todo and each live
+    active todo. A change only sets bytes, and a page is found by scanning
+    a filter with ``find()`` or ``rfind()`` from its ``after`` or
+    ``before`` cursor, stopping once the page is full.
+
+    Texts are indexed by prefix, mapping a prefix to the positions of its
+    todos in id order, which only ever grow at the end. Single characters
+    are indexed, and once a prefix has more than ``PREFIX_SPLIT_SIZE``
+    todos, the prefixes one character longer are indexed as well. A
+    text-prefix page scans the positions of the longest indexed part of
+    the prefix the same way, and its total is either counted in the index
+    or by checking at most ``PREFIX_SPLIT_SIZE`` todos. Removed todos stay
+    in the prefix index and are skipped.
+
+    ``version`` is bumped by every change, and ``epoch`` is unique to each
+    store, so that ``(epoch, version)`` identifies the contents even across
+    restarts.
+    """
+
+    def __init__(self, todos=()):
+        self._lock = threading.RLock()
+        self.epoch = uuid.uuid4().hex[:16]
+        self.version = 0
+        self._reset([], bytearray(), bytearray())
+        for text, completed in todos:
+            self.add(text, completed)
+
+    def _reset(self, texts, completed, removed):
+        self._texts = texts
+        self._completed = completed
+        self._removed = removed
+        # a filter for each value of the ``completed`` argument
+        self._filters = {None: bytearray(), False: bytearray(), True: bytearray()}
+        self._counts = {None: 0, False: 0, True: 0}
+        # prefix -> [positions, live todos, completed todos]
+        self._prefixes = {}
+
+    def __len__(self):
+        return self._counts[None]
+
+    def __contains__(self, todo_id):
+        return self._position(todo_id) is not None
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def refresh(self):
+        """Apply the changes other processes made to the todos, if any
+
+        Only this process changes a TodoStore, so there is nothing to do.
+        """
+
+    def _position(self, todo_id):
+        try:
+            pos = int(todo_id) - 1
+        except (TypeError, ValueError):
+            return None
+        if pos < 0 or pos >= len(self._texts) or self._removed[pos]:
+            return None
+        return pos
+
+    def _record(self, pos):
+        return TodoRecord(str(pos + 1), self._texts[pos], bool(self._completed[pos]))
+
+    def _columns(self):
+        """Return copies of the texts, completed and removed columns"""
+        with self._lock:
+            return list(self._texts), bytearray(self._completed), bytearray(self._removed)
+
+    def _restore(self, texts, completed, removed):
+        """Replace the contents with the given columns and rebuild the indexes"""
+        with self._lock:
+            self._reset(texts, completed, removed)
+            for pos in range(len(texts)):
+                self._index(pos, not removed[pos])
+            self.version += 1
+
+    def _index(self, pos, alive):
+        """Append the position to the indexes"""
+        completed = bool(self._completed[pos])
+        self._filters[None].append(alive)
+        self._filters[completed].append(alive)
+        self._filters[not completed].append(False)
+        if not alive:
+            return
+        self._counts[None] += 1
+        self._counts[completed] += 1
+        text = self._texts[pos]
+        for length in range(1, len(text) + 1):
+            prefix = text[:length]
+            node = self._prefixes.get(prefix)
+            if node is None:
+                self._prefixes[prefix] = [array('l', [pos]), 1, int(completed)]
+                return
+            node[0].append(pos)
+            node[1] += 1
+            node[2] += completed
+            if len(node[0]) == PREFIX_SPLIT_SIZE + 1:
+                # this also indexes the position under the longer prefixes
+                self._split(prefix)
+                return
+            if len(node[0]) <= PREFIX_SPLIT_SIZE:
+                return
+
+    def _split(self, prefix):
+        """Index the todos of the prefix by the prefixes one character longer"""
+        length = len(prefix) + 1
+        children = []
+        for pos in self._prefixes[prefix][0]:
+            text = self._texts[pos]
+            if text is None or len(text) < length:
+                continue
+            child = text[:length]
+            node = self._prefixes.get(child)
+            if node is None:
+                node = self._prefixes[child] = [array('l'), 0, 0]
+                children.append(child)
+            node[0].append(pos)
+            node[1] += 1
+            node[2] += self._completed[pos]
+        for child in children:
+            if len(self._prefixes[child][0]) > PREFIX_SPLIT_SIZE:
+                self._split(child)
+
+    def _prefix_nodes(self, text):
+        """Return the index nodes of the prefixes of the text, shortest first"""
+        nodes = []
+        for length in range(1, len(text) + 1):
+            node = self._prefixes.get(text[:length])
+            if node is None:
+                break
+            nodes.append(node)
+            if len(node[0]) <= PREFIX_SPLIT_SIZE:
+                break
+        return nodes
+
+    def add(self, text, completed=False):
+        completed = bool(completed)
+        with self._lock:
+            pos = len(self._texts)
+            self._texts.append(text)
+            self._completed.append(completed)
+            self._removed.append(False)
+            self._index(pos, True)
+            self.version += 1
+            return self._record(pos)
+
+    def get(self, todo_id):
+        """Return the todo, or raise KeyError if it does not exist"""
+        with self._lock:
+            pos = self._position(todo_id)
+            if pos is None:
+                raise KeyError(todo_id)
+            return self._record(pos)
+
+    def set_completed(self, todo_id, completed):
+        completed = bool(completed)
+        with self._lock:
+            pos = self._position(todo_id)
+            if pos is None:
+                raise KeyError(todo_id)
+            if bool(self._completed[pos]) != completed:
+                self._completed[pos] = completed
+                self._filters[completed][pos] = True
+                self._filters[not completed][pos] = False
+                self._counts[completed] += 1
+                self._counts[not completed] -= 1
+                delta = 1 if completed else -1
+                for node in self._prefix_nodes(self._texts[pos]):
+                    node[2] += delta
+                self.version += 1
+            return self._record(pos)
+
+    def toggle(self, todo_id):
+        with self._lock:
+            pos = self._position(todo_id)
+            if pos is None:
+                raise KeyError(todo_id)
+            return self.set_completed(todo_id, not self._completed[pos])
+
+    def remove(self, todo_id):
+        with self._lock:
+            pos = self._position(todo_id)
+            if pos is None:
+                raise KeyError(todo_id)
+            completed = bool(self._completed[pos])
+            self._filters[None][pos] = False
+            self._filters[completed][pos] = False
+            self._counts[None] -= 1
+            self._counts[completed] -= 1
+            for node in self._prefix_nodes(self._texts[pos]):
+                node[1] -= 1
+                node[2] -= completed
+            self._removed[pos] = True
+            self._texts[pos] = None
+            self.version += 1
+
+    def count(self, completed=None):
+        if completed is None:
+            return self._counts[None]
+        return self._counts[bool(completed)]
+
+    def values(self, completed=None):
+        """Return the todos in id order, optionally filtered by ``completed``"""
+        with self._lock:
+            forward, _ = self._scanners(completed, None)
+            return [self._record(pos) for pos in forward(0, len(self._texts))]
+
+    def _scanners(self, completed, text_prefix):
+        """Return ``(forward, backward)`` functions which yield the positions
+        of the matching todos in ``[lo, hi)``, in and against id order"""
+        flags = self._filters[None if completed is None else bool(completed)]
+
+        if not text_prefix:
+            def forward(lo, hi):
+                pos = flags.find(1, lo, hi)
+                while pos != -1:
+                    yield pos
+                    pos = flags.find(1, pos + 1, hi)
+
+            def backward(lo, hi):
+                pos = flags.rfind(1, lo, hi)
+                while pos != -1:
+                    yield pos
+                    pos = flags.rfind(1, lo, pos)
+
+            return forward, backward
+
+        nodes = self._prefix_nodes(text_prefix)
+        exact = len(nodes) == len(text_prefix)
+        if not nodes or (not exact and len(nodes[-1][0]) > PREFIX_SPLIT_SIZE):
+            # a split node indexes all of its longer prefixes, so no todo matches
+            candidates = ()
+        else:
+            candidates = nodes[-1][0]
+        texts = self._texts
+
+        def matches(pos):
+            return flags[pos] and (exact or texts[pos].startswith(text_prefix))
+
+        def forward(lo, hi):
+            for i in range(bisect_left(candidates, lo), bisect_left(candidates, hi)):
+                if matches(candidates[i]):
+                    yield candidates[i]
+
+        def backward(lo, hi):
+            for i in range(bisect_left(candidates, hi) - 1, bisect_left(candidates, lo) - 1, -1):
+                if matches(candidates[i]):
+                    yield candidates[i]
+
+        return forward, backward
+
+    def _count_prefix(self, completed, text_prefix, forward):
+        node = self._prefixes.get(text_prefix)
+        if node is None:
+            # not indexed, so at most PREFIX_SPLIT_SIZE todos are checked
+            return sum(1 for _ in forward(0, len(self._texts)))
+        _, live, done = node
+        if completed is None:
+            return live
+        return done if completed else live - done
+
+    def page(self, completed=None, text_prefix=None, after=None, before=None,
+             first=None, last=None):
+        """Return a TodoPage of the todos in id order
+
+        ``after`` and ``before`` are exclusive todo ids, ``first`` and
+        ``last`` limit the page from the start or the end of that range.
+        The matching todos are scanned from ``after`` (or back from
+        ``before`` for ``last``) until the page is full.
+        """
+        with self._lock:
+            forward, backward = self._scanners(completed, text_prefix)
+            size = len(self._texts)
+            lo = 0 if after is None else min(max(int(after), 0), size)
+            hi = size if before is None else min(max(int(before) - 1, 0), size)
+            hi = max(lo, hi)
+
+            if first is not None:
+                positions = list(islice(forward(lo, hi), max(first, 0)))
+                # an empty page of the last 0 of them is at their end
+                boundary = positions[-1] + 1 if positions else lo
+                if last is not None:
+                    positions = positions[max(len(positions) - max(last, 0), 0):]
+            elif last is not None:
+                positions = list(islice(backward(lo, hi), max(last, 0)))[::-1]
+                boundary = hi
+            else:
+                positions = list(forward(lo, hi))
+                boundary = lo
+
+            start = positions[0] if positions else boundary
+            end = positions[-1] + 1 if positions else boundary
+            has_previous = next(backward(0, start), None) is not None
+            has_next = next(forward(end, size), None) is not None
+
+            if not text_prefix:
+                total = self.count(completed)
+            else:
+                total = self._count_prefix(completed, text_prefix, forward)
+            return TodoPage([self._record(pos) for pos in positions],
+                            has_previous, has_next, total)
@@ -2,15 +2,147 @@
 
 from __future__ import absolute_import, division, print_function
 
-from tornado import web
-from tornado.escape import json_decode, json_encode, to_unicode
+from base64 import b64decode
+from graphql.execution.middleware import MiddlewareManager
+import time
+from tornado import gen, ioloop, web
+from tornado.concurrent import Future
 from tornado.log import app_log
-import os
-import zmq
-from zmq.eventloop.zmqstream import ZMQStream
+from . import jsoncodec
+from .admin import AdminHandler
 from .cors import CORSRequestHandler
-from .graphql import GraphQLHandler, GraphQLSubscriptionHandler
-from .schema import schema
+from .graphql import (BoundedExecutor, DocumentCache, GraphQLHandler,
+                      GraphQLSubscriptionHandler, PersistedQueryRegistry,
+                      ResolverTimingMiddleware, ResponseCache, Tracer, TracingMiddleware)
+from .jobserver_pool import JobServerPool
+from .metrics import CONTENT_TYPE, MetricsRegistry
+from .profiling import BlockingDetector, Profiler, ProfilerBusy, check_profile_args
+from .scheduler import make_scheduler
+from .schema import pubsub, schema, todo_store_version
+
+
+JOB_SERVER_COUNTERS = {
+    'jobs_started': 'Jobs started by the job server',
+    'jobs_completed': 'Jobs completed by the job server',
+    'jobs_failed': 'Jobs which raised an error on the job server',
+    'jobs_refused': 'Jobs refused by the job server as busy',
+    'jobs_cancelled': 'Jobs cancelled by the job server on shutdown',
+    'wait_seconds': 'Seconds jobs waited in the queue of the job server',
+    'run_seconds': 'Seconds the job server spent running jobs',
+    'replies': 'Replies sent by the job server',
+    'ioloop_blocked': 'Times a callback blocked the IOLoop of the job server',
+    'ioloop_blocked_seconds': 'Seconds callbacks blocked the IOLoop of the job server'
+}
+
+
+class WebAppMetrics(MetricsRegistry):
+    """The metrics exported by /metrics"""
+
+    def __init__(self):
+        super(WebAppMetrics, self).__init__()
+
+        self.graphql_duration = self.histogram(
+            'graphql_request_duration_seconds',
+            'Seconds to parse, validate and execute a GraphQL operation', ['operation'])
+        self.graphql_errors = self.counter(
+            'graphql_errors_total', 'GraphQL operations which returned errors', ['operation'])
+        self.resolver_duration = self.histogram(
+            'graphql_resolver_duration_seconds', 'Seconds spent in GraphQL resolvers', ['field'])
+        self.executor_in_flight = self.gauge(
+            'graphql_executor_in_flight', 'GraphQL operations running or waiting on the executor')
+        self.executor_rejected = self.counter(
+            'graphql_executor_rejected_total', 'GraphQL operations shed by the executor')
+        self.not_modified = self.counter(
+            'graphql_not_modified_total', 'GET requests answered with 304 Not Modified')
+        self.response_cache_hits = self.counter(
+            'graphql_response_cache_hits_total', 'GET responses served from the response cache')
+        self.response_cache_misses = self.counter(
+            'graphql_response_cache_misses_total', 'GET responses missing in the response cache')
+        self.websocket_messages = self.counter(
+            'websocket_messages_total', 'WebSocket messages by direction', ['direction'])
+        self.websocket_connections = self.gauge(
+            'websocket_connections', 'Open WebSocket connections')
+        self.websocket_buffered_bytes = self.gauge(
+            'websocket_buffered_bytes', 'Bytes queued to the WebSocket clients')
+        self.job_duration = self.histogram(
+            'job_duration_seconds', 'Seconds from submitting a job to its final reply',
+            ['job_server', 'outcome'])
+        self.job_queue_wait = self.histogram(
+            'job_queue_wait_seconds', 'Seconds jobs waited in the queue of a job server',
+            ['job_server'])
+        self.job_server_up = self.gauge(
+            'job_server_up', 'Whether the job server takes jobs (circuit closed, not draining)',
+            ['job_server'])
+        self.job_server_running = self.gauge(
+            'job_server_running_jobs', 'Jobs running on the job server', ['job_server'])
+        self.job_server_queued = self.gauge(
+            'job_server_queued_jobs', 'Jobs queued on the job server', ['job_server'])
+        self.job_server_in_flight = self.gauge(
+            'job_server_in_flight_jobs', 'Jobs sent to the job server by this process',
+            ['job_server'])
+        self.ioloop_blocked = self.counter(
+            'ioloop_blocked_total', 'Times a callback blocked the IOLoop')
+        self.ioloop_blocked_seconds = self.counter(
+            'ioloop_blocked_seconds_total', 'Seconds callbacks blocked the IOLoop')
+        self.job_server_counters = {
+            name: self.counter('jobserver_{0}_total'.format(name), help, ['job_server'])
+            for name, help in sorted(JOB_SERVER_COUNTERS.items())
+        }
+
+    def operation_executed(self, operation, result, elapsed):
+        self.graphql_duration.observe(elapsed, (operation,))
+        if result.errors:
+            self.graphql_errors.inc(labels=(operation,))
+
+    def resolved(self, field, elapsed):
+        self.resolver_duration.observe(elapsed, (field,))
+
+    def job_finished(self, conn, job, resp):
+        if resp.get('busy'):
+            outcome = 'busy'
+        elif resp.get('error'):
+            outcome = 'error'
+        else:
+            outcome = 'ok'
+        job_server = str(conn.server['pid'])
+        self.job_duration.observe(time.time() - job.submitted, (job_server, outcome))
+        if resp.get('wait_time') is not None:
+            self.job_queue_wait.observe(resp['wait_time'], (job_server,))
+
+    def collect(self, opts):
+        sockets = opts['sockets']
+        self.websocket_connections.set(len(sockets))
+        self.websocket_buffered_bytes.set(sum(socket.buffered_bytes for socket in sockets))
+
+        detector = opts['blocking_detector']
+        if detector is not None:
+            self.ioloop_blocked.set(detector.blocked)
+            self.ioloop_blocked_seconds.set(detector.blocked_seconds)
+
+        executor = opts['executor']
+        if executor is not None:
+            self.executor_in_flight.set(executor.in_flight)
+            self.executor_rejected.set(executor.rejected)
+
+        response_cache = opts['response_cache']
+        if response_cache is not None:
+            self.response_cache_hits.set(response_cache.hits)
+            self.response_cache_misses.set(response_cache.misses)
+
+        # the series of job servers which are gone are dropped
+        gauges = (self.job_server_up, self.job_server_running, self.job_server_queued,
+                  self.job_server_in_flight) + tuple(self.job_server_counters.values())
+        for gauge in gauges:
+            gauge.clear()
+        for pid, conn in opts['job_server_pool'].connections.items():
+            labels = (str(pid),)
+            self.job_server_up.set(int(conn.health.available and not conn.draining), labels)
+            self.job_server_running.set(conn.running, labels)
+            self.job_server_queued.set(conn.queued, labels)
+            self.job_server_in_flight.set(conn.in_flight, labels)
+            for name, value in conn.metrics.items():
+                if name in self.job_server_counters:
+                    self.job_server_counters[name].set(value, labels)
 
 
 class ExampleAPIHandler(CORSRequestHandler, GraphQLHandler):
@@ -20,11 +152,57 @@ class ExampleAPIHandler(CORSRequestHandler, GraphQLHandler):
 
         self.opts = opts
         self._schema = schema
+        self.opts['requests_in_flight'] += 1
+
+    def on_finish(self):
+        super(ExampleAPIHandler, self).on_finish()
+        self.opts['requests_in_flight'] -= 1
+        if self.get_status() == 304:
+            self.opts['metrics'].not_modified.inc()
 
     @property
     def schema(self):
         return self._schema
 
+    @property
+    def document_cache(self):
+        return self.opts['document_cache']
+
+    @property
+    def data_version(self):
+        return todo_store_version()
+
+    @property
+    def response_cache(self):
+        return self.opts['response_cache']
+
+    @property
+    def persisted_queries(self):
+        return self.opts['persisted_queries']
+
+    @property
+    def max_batch_size(self):
+        return self.opts['max_batch_size']
+
+    @property
+    def executor(self):
+        return self.opts['executor']
+
+    @property
+    def middleware(self):
+        return self.opts['middleware']
+
+    @property
+    def tracer(self):
+        return self.opts['tracer']
+
+    @property
+    def tracing_middleware(self):
+        return self.opts['tracing_middleware']
+
+    def on_executed(self, ast, operation_name, result, elapsed):
+        self.opts['metrics'].operation_executed(operation_name or 'anonymous', result, elapsed)
+
 
 class SubscriptionHandler(GraphQLSubscriptionHandler):
 
@@ -33,6 +211,7 @@ class SubscriptionHandler(GraphQLSubscriptionHandler):
 
         self.opts = opts
         self._schema = schema
+        self.job_requests = []
 
     @property
     def schema(self):
@@ -55,12 +234,8 @@ class SubscriptionHandler(GraphQLSubscriptionHandler):
         return self.opts['job_servers']
 
     @property
-    def job_server_index(self):
-        return self.opts['job_server_index']
-
-    @job_server_index.setter
-    def job_server_index(self, job_server_index):
-        self.opts['job_server_index'] = job_server_index
+    def job_server_pool(self):
+        return self.opts['job_server_pool']
 
     @property
     def allow_origin(self):
@@ -70,6 +245,26 @@ class SubscriptionHandler(GraphQLSubscriptionHandler):
     def allow_origin_pat(self):
         return self.opts['allow_origin_pat']
 
+    @property
+    def pubsub(self):
+        return self.opts['pubsub']
+
+    @property
+    def max_buffer_size(self):
+        return self.opts.get('websocket_max_buffer_size', 0)
+
+    @property
+    def backpressure_policy(self):
+        return self.opts.get('websocket_backpressure', 'pause')
+
+    def on_message(self, message):
+        self.opts['metrics'].websocket_messages.inc(labels=('received',))
+        super(SubscriptionHandler, self).on_message(message)
+
+    def write_message(self, message, binary=False):
+        self.opts['metrics'].websocket_messages.inc(labels=('sent',))
+        return super(SubscriptionHandler, self).write_message(message, binary)
+
     def check_origin(self, origin):
         if self.allow_origin == '*':
             return True
@@ -81,7 +276,8 @@ class SubscriptionHandler(GraphQLSubscriptionHandler):
             return False
 
     def on_subscribe(self, subid, data):
-        super(SubscriptionHandler, self).on_subscribe(subid, data)
+        if not super(SubscriptionHandler, self).on_subscribe(subid, data):
+            return
 
         query = data.get('query')
         op_name = self._get_op_name(query)
@@ -89,46 +285,171 @@ class SubscriptionHandler(GraphQLSubscriptionHandler):
         if op_name == 'commandExecute':
             self._execute_command('countdown')  # TODO: get command name
 
+    def on_close(self):
+        super(SubscriptionHandler, self).on_close()
+
+        for job_request in self.job_requests:
+            job_request.cancel()
+        self.job_requests = []
+
     def _execute_command(self, command):
-        if len(self.job_servers) == 0:
+        server = self.job_server_pool.select()
+        if server is None:
             app_log.error('there is no job server')
             return
 
-        server = self.job_servers[self.job_server_index]
-        self.job_server_index = (self.job_server_index + 1) % len(self.job_servers)
-
-        context = zmq.Context.instance()
-        zmq_sock = context.socket(zmq.DEALER)
-        zmq_sock.linger = 1000
-        zmq_sock.identity = bytes(str(os.getpid()), 'ascii')
-        ip = server['ip']
-        if ip == '*':
-            ip = 'localhost'
-        url = 'tcp://{0}:{1}'.format(ip, server['zmq_port'])
-        app_log.info('connect %s', url)
-        zmq_sock.connect(url)
-
-        command = json_encode({'command': command})
-        app_log.info('command: %s', command)
-        zmq_sock.send_multipart([b'0', bytes(command, 'ascii')])
-
-        stream = ZMQStream(zmq_sock)
-        stream.on_recv(self.response_handler)
-
-    def response_handler(self, msg):
-        ident, resp_bytes = msg
-        resp = json_decode(to_unicode(resp_bytes))
+        request = {'command': command}
+        app_log.info('command: %s', request)
+        job_request = self.job_server_pool.submit(server, request, self.response_handler)
+        if self.paused:
+            job_request.pause()
+        self.job_requests.append(job_request)
+
+    def response_handler(self, resp):
         app_log.debug('resp: %s', resp)
 
+        if resp.get('finished'):
+            self.job_requests = [r for r in self.job_requests if not r.finished]
+
         subid = self.subscriptions.get('commandExecute')
         if subid is not None:
-            self.write_message(json_encode({
-                'type': 'subscription_data',
-                'id': subid,
-                'payload': {
-                    'data': resp
-                }
-            }))
+            self.send_data(subid, resp)
+
+    @gen.coroutine
+    def drain_upstream(self, deadline):
+        io_loop = ioloop.IOLoop.current()
+        while any(not r.finished for r in self.job_requests) and io_loop.time() < deadline:
+            yield gen.sleep(0.05)
+        for job_request in self.job_requests:
+            if job_request.finished:
+                continue
+            app_log.warning('cancel request %s: server is shutting down',
+                            job_request.request_id)
+            job_request.cancel()
+            self.response_handler({
+                'stdout': None,
+                'finished': True,
+                'error': 'server is shutting down',
+                'timestamp': time.time()
+            })
+        self.job_requests = []
+
+    def droppable(self, message):
+        data = message.get('payload', {}).get('data', {})
+        return super(SubscriptionHandler, self).droppable(message) and not data.get('finished')
+
+    def coalesce(self, data_list):
+        if any(d.get('finished') for d in data_list):
+            return None
+        lines = []
+        for data in data_list:
+            if data.get('lines'):
+                lines.extend(data['lines'])
+            elif data.get('stdout') is not None:
+                lines.append({'stdout': data['stdout'], 'timestamp': data.get('timestamp')})
+        return dict(data_list[-1], stdout=None, lines=lines)
+
+    def pause_upstream(self):
+        # only the jobs of this socket are paused, not their connections
+        for job_request in self.job_requests:
+            job_request.pause()
+
+    def resume_upstream(self):
+        for job_request in self.job_requests:
+            job_request.resume()
+
+
+class HealthHandler(AdminHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(jsoncodec.dumps({
+            str(pid): stats for pid, stats in self.opts['job_server_pool'].stats.items()
+        }))
+
+
+class SocketsHandler(AdminHandler):
+
+    def get(self):
+        self.set_header('Content-Type', 'application/json')
+        self.write(jsoncodec.dumps([
+            dict(socket.stats, remote_ip=socket.request.remote_ip)
+            for socket in self.opts['sockets']
+        ]))
+
+
+class TracingHandler(AdminHandler):
+
+    def get(self):
+        tracer = self.opts['tracer']
+        if tracer is None:
+            raise web.HTTPError(404, 'tracing is disabled')
+        self.set_header('Content-Type', 'application/json')
+        self.write(jsoncodec.dumps(tracer.stats))
+
+
+class ProfileHandler(AdminHandler):
+    """Profile the web app, or a job server given by ``job_server``, for some seconds"""
+
+    @gen.coroutine
+    def get(self):
+        try:
+            seconds = float(self.get_argument('seconds', '5'))
+            interval = float(self.get_argument('interval', '0.005'))
+            kind = self.get_argument('kind', 'cprofile')
+            format = check_profile_args(seconds, kind, self.get_argument('format', None))
+        except ValueError as e:
+            raise web.HTTPError(400, str(e))
+
+        job_server = self.get_argument('job_server', None)
+        try:
+            if job_server is None:
+                profile = yield self.opts['profiler'].profile(seconds, kind, format, interval)
+            else:
+                profile = yield self.profile_job_server(job_server, {
+                    'command': 'profile',
+                    'seconds': seconds,
+                    'kind': kind,
+                    'format': format,
+                    'interval': interval
+                })
+        except ProfilerBusy as e:
+            raise web.HTTPError(409, str(e))
+
+        if format == 'pstats':
+            self.set_header('Content-Type', 'application/octet-stream')
+            self.set_header('Content-Disposition', 'attachment; filename="profile.pstats"')
+            self.write(b64decode(profile))
+        else:
+            self.set_header('Content-Type', 'text/plain; charset=utf-8')
+            self.write(profile)
+
+    @gen.coroutine
+    def profile_job_server(self, pid, request):
+        pool = self.opts['job_server_pool']
+        server = next((s for s in pool.job_servers if str(s['pid']) == pid), None)
+        if server is None:
+            raise web.HTTPError(404, 'job server {0} is not found'.format(pid))
+
+        future = Future()
+        pool.control(server, request, future.set_result)
+        try:
+            resp = yield gen.with_timeout(ioloop.IOLoop.current().time() +
+                                          request['seconds'] + 10, future)
+        except gen.TimeoutError:
+            raise web.HTTPError(504, 'job server {0} did not reply'.format(pid))
+        if resp.get('profiler_busy'):
+            raise ProfilerBusy(resp['error'])
+        if resp.get('error'):
+            raise web.HTTPError(502, 'job server {0}: {1}'.format(pid, resp['error']))
+        raise gen.Return(resp['profile'])
+
+
+class MetricsHandler(AdminHandler):
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.write(self.opts['metrics'].render())
 
 
 class ExampleWebAPIApplication(web.Application):
@@ -136,16 +457,111 @@ class ExampleWebAPIApplication(web.Application):
     def __init__(self, settings, job_servers):
         app_log.info('job_servers: %s', [s['pid'] for s in job_servers])
 
+        document_cache_size = settings.get('document_cache_size', 256)
+        if document_cache_size > 0:
+            document_cache = DocumentCache(schema, document_cache_size)
+        else:
+            document_cache = None
+
+        response_cache_size = settings.get('response_cache_size', 256)
+        response_cache = ResponseCache(response_cache_size) if response_cache_size > 0 else None
+
+        if settings.get('persisted_queries'):
+            persisted_queries = PersistedQueryRegistry(
+                allowlist_only=settings.get('persisted_queries_only', False))
+            if settings.get('persisted_queries_manifest'):
+                persisted_queries.load_manifest(settings['persisted_queries_manifest'])
+        else:
+            persisted_queries = None
+
+        executor_threads = settings.get('executor_threads', 0)
+        if executor_threads > 0:
+            executor = BoundedExecutor(executor_threads,
+                                       settings.get('executor_queue_size', 0))
+        else:
+            executor = None
+
+        metrics = WebAppMetrics()
+        middleware = []
+        resolver_metrics = settings.get('resolver_metrics', 'root')
+        if resolver_metrics != 'off':
+            middleware.append(ResolverTimingMiddleware(metrics.resolved,
+                                                       root_only=resolver_metrics == 'root'))
+
+        if settings.get('tracing'):
+            tracer = Tracer(settings.get('tracing_sample_rate', 0.01),
+                            settings.get('tracing_slow_threshold', 0.01),
+                            settings.get('tracing_file') or None)
+            tracing_middleware = middleware + [TracingMiddleware(tracer)]
+        else:
+            tracer = None
+            tracing_middleware = middleware
+
         self.opts = dict(settings, **{
+            'document_cache': document_cache,
+            'response_cache': response_cache,
+            'persisted_queries': persisted_queries,
+            'max_batch_size': settings.get('max_batch_size', 10),
+            'executor': executor,
+            'metrics': metrics,
+            # the resolvers return plain values, so they need not be wrapped in promises
+            'middleware': MiddlewareManager(*middleware, wrap_in_promise=False)
+            if middleware else None,
+            'tracing_middleware': MiddlewareManager(*tracing_middleware, wrap_in_promise=False)
+            if tracing_middleware else None,
+            'tracer': tracer,
+            'profiler': Profiler(),
+            'blocking_detector': BlockingDetector(settings['blocking_threshold'])
+            if settings.get('blocking_threshold') else None,
             'job_servers': job_servers,
-            'job_server_index': 0,
+            'job_server_pool': JobServerPool(
+                job_servers, make_scheduler(settings.get('scheduler', 'least-outstanding')),
+                heartbeat_interval=settings.get('job_server_heartbeat_interval', 1.0),
+                heartbeat_timeout=settings.get('job_server_heartbeat_timeout', 3.0),
+                failure_threshold=settings.get('job_server_failure_threshold', 3),
+                max_retries=settings.get('job_max_retries', 1),
+                on_job_finished=metrics.job_finished),
+            'pubsub': pubsub,
             'sockets': [],
+            'requests_in_flight': 0,
             'subscriptions': {}
         })
+        metrics.add_collector(lambda: metrics.collect(self.opts))
 
         handlers = [
             (r'/', SubscriptionHandler, dict(opts=self.opts)),
-            (r'/graphql', ExampleAPIHandler, dict(opts=self.opts))
+            (r'/graphql', ExampleAPIHandler, dict(opts=self.opts)),
+            (r'/admin/health', HealthHandler, dict(opts=self.opts)),
+            (r'/admin/sockets', SocketsHandler, dict(opts=self.opts)),
+            (r'/admin/tracing', TracingHandler, dict(opts=self.opts)),
+            (r'/admin/profile', ProfileHandler, dict(opts=self.opts)),
+            (r'/metrics', MetricsHandler, dict(opts=self.opts))
         ]
 
         super(ExampleWebAPIApplication, self).__init__(handlers, **settings)
+
+    @property
+    def job_server_pool(self):
+        return self.opts['job_server_pool']
+
+    @property
+    def blocking_detector(self):
+        return self.opts['blocking_detector']
+
+    @gen.coroutine
+    def drain(self, timeout):
+        """Let the subscriptions and GraphQL requests finish within ``timeout`` seconds"""
+        io_loop = ioloop.IOLoop.current()
+        deadline = io_loop.time() + timeout
+        yield [socket.drain(deadline) for socket in list(self.opts['sockets'])]
+        while self.opts['requests_in_flight'] > 0 and io_loop.time() < deadline:
+            yield gen.sleep(0.05)
+        if self.opts['requests_in_flight'] > 0:
+            app_log.warning('%d requests still in flight', self.opts['requests_in_flight'])
+
+    def close(self):
+        if self.blocking_detector is not None:
+            self.blocking_detector.stop()
+        self.job_server_pool.close()
+        if self.opts['executor'] is not None:
+            self.opts['executor'].shutdown(wait=False)